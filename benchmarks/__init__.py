@@ -0,0 +1,2 @@
+import os
+os.environ.setdefault("ENV_STATE", "test")
@@ -0,0 +1,51 @@
+import benchmarks  # noqa: F401
+import logging
+import timeit
+from storeapi.logging_conf import EmailObfuscationFilter, obfuscated
+
+NUMBER = 200_000
+HANDLERS = 3
+
+def legacy_obfuscated(email: str, obfuscated_length: int) -> str:
+    characters = email[:obfuscated_length]
+    first, last = email.split("@")
+    return characters + ("*" * (len(first) - obfuscated_length)) + "@" + last
+
+class LegacyEmailObfuscationFilter(EmailObfuscationFilter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        if "email" in record.__dict__:
+            record.email = legacy_obfuscated(record.email, self.obfuscated_length)
+
+        return True
+
+def make_record(email: str) -> logging.LogRecord:
+    record = logging.LogRecord("storeapi", logging.DEBUG, __file__, 1, "message", None, None)
+    record.email = email
+    return record
+
+def run(record_filter: logging.Filter, emails: list) -> float:
+    def log_line():
+        # Every record goes through each configured handler's filter
+        record = make_record(emails[log_line.calls % len(emails)])
+        log_line.calls += 1
+        for _ in range(HANDLERS):
+            record_filter.filter(record)
+
+    log_line.calls = 0
+    return timeit.timeit(log_line, number=NUMBER)
+
+def main() -> None:
+    emails = [f"user{index}@example.net" for index in range(100)]
+    legacy = run(LegacyEmailObfuscationFilter(obfuscated_length=2), emails)
+    obfuscated.cache_clear()
+    current = run(EmailObfuscationFilter(obfuscated_length=2), emails)
+    baseline = timeit.timeit(lambda: make_record(emails[0]), number=NUMBER)
+
+    print(f"{NUMBER} records, {HANDLERS} handlers each")
+    print(f"record creation only: {baseline * 1e9 / NUMBER:8.1f} ns/record")
+    print(f"legacy filter:        {(legacy - baseline) * 1e9 / NUMBER:8.1f} ns/record")
+    print(f"cached filter:        {(current - baseline) * 1e9 / NUMBER:8.1f} ns/record")
+    print(obfuscated.cache_info())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+import benchmarks  # noqa: F401
+import timeit
+from databases import DatabaseURL
+from databases.backends.postgres import PostgresBackend, PostgresConnection
+from databases.backends.sqlite import SQLiteBackend, SQLiteConnection
+from storeapi.database import comment_table, post_table
+from storeapi.routers.post import CommentSorting, PostSorting, select_post_comment_pages, select_post_likes, select_post_likes_by_id, select_sorted_post_likes
+
+NUMBER = 20_000
+LIMIT = 1000
+
+def connections():
+    sqlite = SQLiteBackend(DatabaseURL("sqlite:///bench.db"))
+    postgres = PostgresBackend(DatabaseURL("postgresql://localhost/bench"))
+    return {
+        "sqlite": SQLiteConnection(None, sqlite._dialect),
+        "postgresql": PostgresConnection(postgres, postgres._dialect)
+    }
+
+def legacy_queries(post_id: int):
+    return [
+        select_post_likes.order_by(post_table.c.id.desc()).limit(LIMIT),
+        select_post_likes.where(post_table.c.id == post_id),
+        comment_table.select().where(comment_table.c.post_id == post_id).order_by(comment_table.c.id.asc()).limit(LIMIT)
+    ]
+
+def cached_queries(post_id: int):
+    return [
+        select_sorted_post_likes[PostSorting.new].bind(limit=LIMIT),
+        select_post_likes_by_id.bind(post_id=post_id),
+        select_post_comment_pages[CommentSorting.old, False].bind(post_id=post_id, limit=LIMIT)
+    ]
+
+def main() -> None:
+    for name, connection in connections().items():
+        # Both paths must hand the driver the same SQL and arguments
+        for legacy, cached in zip(legacy_queries(1), cached_queries(1)):
+            assert connection._compile(legacy)[:2] == connection._compile(cached)[:2]
+
+        legacy = timeit.timeit(lambda: [connection._compile(query) for query in legacy_queries(1)], number=NUMBER)
+        cached = timeit.timeit(lambda: [connection._compile(query) for query in cached_queries(1)], number=NUMBER)
+        print(f"{name:<10} build + compile: {legacy * 1e6 / NUMBER:8.1f} us/request")
+        print(f"{name:<10} cached compile:  {cached * 1e6 / NUMBER:8.1f} us/request")
+
+if __name__ == "__main__":
+    main()
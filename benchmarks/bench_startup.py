@@ -0,0 +1,46 @@
+import os
+import subprocess
+import sys
+import tempfile
+
+RUNS = 5
+
+# Runs in a fresh interpreter: import the app, serve one request through the
+# lifespan (which connects the database) and report the elapsed time.
+FIRST_REQUEST = """
+import time
+start = time.perf_counter()
+{setup}
+from fastapi.testclient import TestClient
+from storeapi.main import app
+with TestClient(app) as client:
+    assert client.get("/").status_code == 200
+print(time.perf_counter() - start)
+"""
+
+# What importing storeapi.database used to do in every worker
+IMPORT_TIME_DDL = """
+from storeapi.migrations import migrate
+migrate()
+"""
+
+def run(code: str, database_url: str) -> float:
+    environment = {**os.environ, "ENV_STATE": "test", "TEST_DATABASE_URL": database_url}
+    output = subprocess.run([sys.executable, "-c", code], env=environment, capture_output=True, text=True, check=True)
+    return float(output.stdout.strip().splitlines()[-1])
+
+def median(code: str, database_url: str) -> float:
+    return sorted(run(code, database_url) for _ in range(RUNS))[RUNS // 2]
+
+def main() -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        database_url = f"sqlite:///{os.path.join(directory, 'startup.db')}"
+        before = median(FIRST_REQUEST.format(setup=IMPORT_TIME_DDL), database_url)
+        after = median(FIRST_REQUEST.format(setup=""), database_url)
+
+    print(f"cold start to first request, median of {RUNS} runs")
+    print(f"with import-time engine + DDL: {before * 1e3:8.1f} ms")
+    print(f"lazy engine, no DDL:           {after * 1e3:8.1f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+import benchmarks  # noqa: F401
+import asyncio
+import os
+import random
+import tempfile
+import time
+import sqlalchemy
+from storeapi.config import config
+from storeapi.database import create_database, like_table, post_table, user_table
+from storeapi.migrations import backfills, migrate
+from storeapi.routers.post import PostSorting, select_sorted_post_likes, select_user_post_pages
+
+USERS = 1_000
+POSTS = 50_000
+LIKES = 100_000
+PAGE = 50
+ROUNDS = 50
+
+def skewed_authors(count: int) -> list:
+    # Zipf-like: a handful of prolific authors write most of the posts
+    weights = [1 / rank for rank in range(1, USERS + 1)]
+    return random.Random(0).choices(range(1, USERS + 1), weights=weights, k=count)
+
+async def seed(database) -> None:
+    await database.execute_many(user_table.insert(), [{"email": f"user{i}@example.net", "password": "1234"} for i in range(USERS)])
+    await database.execute_many(post_table.insert(), [{"body": "post", "user_id": user_id} for user_id in skewed_authors(POSTS)])
+    # Each user likes a post at most once, so the pairs are drawn without repeats
+    pairs = random.Random(1).sample(range(POSTS * USERS), LIKES)
+    await database.execute_many(like_table.insert(), [{"post_id": pair // USERS + 1, "user_id": pair % USERS + 1} for pair in pairs])
+    await database.execute(backfills["posts.like_count"])
+
+async def timed(call) -> float:
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        await call()
+
+    return (time.perf_counter() - start) * 1e3 / ROUNDS
+
+async def measure() -> None:
+    async with create_database() as database:
+        await seed(database)
+        for label, user_id in (("heaviest author", 1), ("median author", USERS // 2)):
+            async def whole_feed():
+                # What clients did before: pull GET /post and filter on user_id
+                posts = await database.fetch_all(select_sorted_post_likes[PostSorting.new].bind(limit=POSTS))
+                return [post for post in posts if post.user_id == user_id][:PAGE]
+
+            async def user_page():
+                return await database.fetch_all(select_user_post_pages[False].bind(user_id=user_id, limit=PAGE + 1))
+
+            print(f"{label:<15} whole feed + filter: {await timed(whole_feed):8.2f} ms")
+            print(f"{label:<15} user keyset page:    {await timed(user_page):8.2f} ms")
+
+def main() -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        config.DATABASE_URL = f"sqlite:///{os.path.join(directory, 'user_posts.db')}"
+        config.DB_FORCE_ROLL_BACK = True
+        migrate(sqlalchemy.create_engine(config.DATABASE_URL))
+        print(f"{USERS} users, {POSTS} posts with skewed authors, {LIKES} likes, pages of {PAGE}")
+        asyncio.run(measure())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,3 @@
+from storeapi.server import main
+
+main()
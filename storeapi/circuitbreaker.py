@@ -0,0 +1,161 @@
+import logging
+import math
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Deque, Dict, Iterator
+from storeapi.timing import span
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+breakers: Dict[str, "CircuitBreaker"] = {}
+
+class CircuitOpenError(Exception):
+    pass
+
+class CircuitBreaker:
+    # Opens once failure_rate of the last `window` calls failed (after at least
+    # min_calls), rejects calls for reset_timeout seconds, then lets a single
+    # trial call through. The timeout follows the observed p99 latency.
+    def __init__(
+        self,
+        name: str,
+        failure_rate: float = 0.5,
+        min_calls: int = 10,
+        window: int = 50,
+        reset_timeout: float = 30,
+        min_timeout: float = 1,
+        max_timeout: float = 60,
+        timeout_multiplier: float = 3,
+        clock: Callable[[], float] = time.monotonic
+    ) -> None:
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.reset_timeout = reset_timeout
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.timeout_multiplier = timeout_multiplier
+        self.clock = clock
+        self.outcomes: Deque[bool] = deque(maxlen=window)
+        self.latencies: Deque[float] = deque(maxlen=window)
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.trial_in_progress = False
+        # Bumped on every state change, so calls admitted under an earlier
+        # state can't decide the current one
+        self.generation = 0
+        self.rejected = 0
+        breakers[name] = self
+
+    def latency_percentile(self, percentile: float) -> float:
+        if not self.latencies:
+            return 0.0
+
+        latencies = sorted(self.latencies)
+        return latencies[max(0, math.ceil(percentile * len(latencies)) - 1)]
+
+    @property
+    def timeout(self) -> float:
+        if len(self.latencies) < self.min_calls:
+            return self.max_timeout
+
+        timeout = self.latency_percentile(0.99) * self.timeout_multiplier
+        return min(self.max_timeout, max(self.min_timeout, timeout))
+
+    @property
+    def current_failure_rate(self) -> float:
+        if not self.outcomes:
+            return 0.0
+
+        return self.outcomes.count(False) / len(self.outcomes)
+
+    def transition(self, state: str) -> None:
+        self.state = state
+        self.generation += 1
+
+    def allow(self) -> bool:
+        # Returns whether this call is the half open trial
+        if self.state == OPEN:
+            if self.clock() - self.opened_at < self.reset_timeout:
+                self.rejected += 1
+                raise CircuitOpenError(f"Circuit breaker '{self.name}' is open")
+
+            self.transition(HALF_OPEN)
+
+        if self.state == HALF_OPEN:
+            if self.trial_in_progress:
+                self.rejected += 1
+                raise CircuitOpenError(f"Circuit breaker '{self.name}' is half open")
+
+            self.trial_in_progress = True
+            return True
+
+        return False
+
+    def record_success(self, latency: float) -> None:
+        self.latencies.append(latency)
+        if self.state == HALF_OPEN:
+            logger.info(f"Circuit breaker '{self.name}' closed")
+            self.transition(CLOSED)
+            self.outcomes.clear()
+
+        self.outcomes.append(True)
+
+    def record_failure(self) -> None:
+        if self.state == HALF_OPEN:
+            self.open()
+            return
+
+        self.outcomes.append(False)
+        if len(self.outcomes) >= self.min_calls and self.current_failure_rate >= self.failure_rate:
+            self.open()
+
+    def open(self) -> None:
+        logger.warning(f"Circuit breaker '{self.name}' opened")
+        self.transition(OPEN)
+        self.opened_at = self.clock()
+
+    def reset(self) -> None:
+        self.transition(CLOSED)
+        self.trial_in_progress = False
+        self.rejected = 0
+        self.outcomes.clear()
+        self.latencies.clear()
+
+    @contextmanager
+    def guard(self) -> Iterator[float]:
+        # Works around both sync and async calls:
+        #   with breaker.guard() as timeout:
+        #       await client.post(..., timeout=timeout)
+        trial = self.allow()
+        generation = self.generation
+        start = self.clock()
+        try:
+            with span(self.name):
+                yield self.timeout
+        except Exception:
+            if self.generation == generation:
+                self.record_failure()
+            raise
+        else:
+            if self.generation == generation:
+                self.record_success(self.clock() - start)
+        finally:
+            if trial:
+                self.trial_in_progress = False
+
+    def metrics(self) -> Dict:
+        return {
+            "state": self.state,
+            "failure_rate": self.current_failure_rate,
+            "calls": len(self.outcomes),
+            "rejected": self.rejected,
+            "latency_p50": self.latency_percentile(0.5),
+            "latency_p99": self.latency_percentile(0.99),
+            "timeout": self.timeout
+        }
@@ -0,0 +1,218 @@
+import gzip
+import zlib
+import anyio
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, List, NamedTuple, Optional
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Media that is compressed already, or a stream that must reach the client
+# as soon as it is written
+SKIPPED_TYPES = ("image/", "video/", "audio/", "font/woff", "text/event-stream")
+SKIPPED_SUBTYPES = ("zip", "gzip", "x-gzip", "x-bzip2", "x-7z-compressed", "x-rar-compressed", "pdf", "octet-stream", "zstd", "x-brotli")
+UNSKIPPED_TYPES = ("image/svg+xml",)
+
+class StreamCompressor(ABC):
+    @abstractmethod
+    def compress(self, data: bytes) -> bytes:
+        ...
+
+    @abstractmethod
+    def flush(self) -> bytes:
+        ...
+
+class GzipStream(StreamCompressor):
+    def __init__(self, level: int) -> None:
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.flush()
+
+class BrotliStream(StreamCompressor):
+    def __init__(self, quality: int) -> None:
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.process(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.finish()
+
+class ZstdStream(StreamCompressor):
+    def __init__(self, level: int) -> None:
+        self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.flush()
+
+class Encoder(NamedTuple):
+    name: str
+    compress: Callable[[bytes], bytes]
+    stream: Callable[[], StreamCompressor]
+
+def available_encoders(gzip_level: int, brotli_quality: int, zstd_level: int) -> List[Encoder]:
+    # In server preference order, brotli and zstd only when installed
+    encoders = []
+    if zstandard is not None:
+        # ZstdCompressor isn't thread safe, so each offloaded body gets its own
+        encoders.append(Encoder("zstd", lambda body: zstandard.ZstdCompressor(level=zstd_level).compress(body), lambda: ZstdStream(zstd_level)))
+
+    if brotli is not None:
+        encoders.append(Encoder("br", lambda body: brotli.compress(body, quality=brotli_quality), lambda: BrotliStream(brotli_quality)))
+
+    encoders.append(Encoder("gzip", lambda body: gzip.compress(body, compresslevel=gzip_level, mtime=0), lambda: GzipStream(gzip_level)))
+    return encoders
+
+def parse_accept_encoding(value: str) -> Dict[str, float]:
+    # "gzip, br;q=0.8, *;q=0" -> {"gzip": 1.0, "br": 0.8, "*": 0.0}
+    accepted = {}
+    for item in value.split(","):
+        name, _, params = item.strip().partition(";")
+        if not name:
+            continue
+
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+
+        accepted[name.strip().lower()] = quality
+
+    return accepted
+
+def choose_encoder(encoders: List[Encoder], accept_encoding: str) -> Optional[Encoder]:
+    accepted = parse_accept_encoding(accept_encoding)
+    wildcard = accepted.get("*", 0.0)
+    best, best_quality = None, 0.0
+    for encoder in encoders:
+        quality = accepted.get(encoder.name, wildcard)
+        if quality > best_quality:
+            best, best_quality = encoder, quality
+
+    return best
+
+def is_compressible(headers: Headers) -> bool:
+    if "content-encoding" in headers:
+        return False
+
+    content_type = headers.get("content-type", "").lower()
+    if content_type.startswith(UNSKIPPED_TYPES):
+        return True
+
+    subtype = content_type.split(";")[0].partition("/")[2]
+    return not content_type.startswith(SKIPPED_TYPES) and subtype not in SKIPPED_SUBTYPES
+
+class CompressionMiddleware:
+    # Compresses HTTP responses with the best encoding the client accepts.
+    # Bodies under `minimum_size` are sent as they are, and bodies of at least
+    # `offload_size` are compressed in a worker thread so the event loop keeps
+    # serving other requests meanwhile.
+    def __init__(
+        self,
+        app: ASGIApp,
+        minimum_size: int = 500,
+        offload_size: int = 64 * 1024,
+        gzip_level: int = 6,
+        brotli_quality: int = 4,
+        zstd_level: int = 3
+    ) -> None:
+        self.app = app
+        self.minimum_size = minimum_size
+        self.offload_size = offload_size
+        self.encoders = available_encoders(gzip_level, brotli_quality, zstd_level)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        encoder = choose_encoder(self.encoders, Headers(scope=scope).get("accept-encoding", ""))
+        if encoder is None:
+            await self.app(scope, receive, send)
+            return
+
+        responder = CompressionResponder(self, encoder, send)
+        await self.app(scope, receive, responder.send)
+
+    async def compress(self, encoder: Encoder, body: bytes) -> bytes:
+        if len(body) >= self.offload_size:
+            return await anyio.to_thread.run_sync(encoder.compress, body)
+
+        return encoder.compress(body)
+
+class CompressionResponder:
+    def __init__(self, middleware: CompressionMiddleware, encoder: Encoder, send: Send) -> None:
+        self.middleware = middleware
+        self.encoder = encoder
+        self._send = send
+        self.start: Optional[Message] = None
+        self.stream: Optional[StreamCompressor] = None
+        self.passthrough = False
+
+    def encoded_start(self, content_length: Optional[int]) -> Message:
+        headers = MutableHeaders(raw=list(self.start["headers"]))
+        headers["Content-Encoding"] = self.encoder.name
+        headers.add_vary_header("Accept-Encoding")
+        if content_length is None:
+            del headers["Content-Length"]
+        else:
+            headers["Content-Length"] = str(content_length)
+
+        return {**self.start, "headers": headers.raw}
+
+    async def send(self, message: Message) -> None:
+        if message["type"] == "http.response.start":
+            # Held back until the first body chunk says how large the body is
+            self.start = message
+            self.passthrough = message["status"] in (204, 304) or not is_compressible(Headers(raw=message["headers"]))
+            if self.passthrough:
+                await self._send(message)
+            return
+
+        if message["type"] != "http.response.body" or self.passthrough:
+            await self._send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if self.stream is None and not more_body:
+            if len(body) < self.middleware.minimum_size:
+                await self._send(self.start)
+                await self._send(message)
+                return
+
+            body = await self.middleware.compress(self.encoder, body)
+            await self._send(self.encoded_start(len(body)))
+            await self._send({"type": "http.response.body", "body": body})
+            return
+
+        if self.stream is None:
+            # Streamed bodies are compressed chunk by chunk as they arrive
+            self.stream = self.encoder.stream()
+            await self._send(self.encoded_start(None))
+
+        chunk = self.stream.compress(body)
+        if not more_body:
+            chunk += self.stream.flush()
+
+        if chunk or not more_body:
+            await self._send({"type": "http.response.body", "body": chunk, "more_body": more_body})
@@ -1,7 +1,22 @@
-from typing import Optional
+from datetime import timedelta
+from typing import Any, Callable, Optional, Tuple
+from jose import jwk
+from jose.backends.base import Key
+from pydantic import BaseModel, ConfigDict, field_validator
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from functools import lru_cache
 
+RATE_LIMIT_PERIODS = {"second": 1, "minute": 60, "hour": 60 * 60, "day": 60 * 60 * 24}
+
+def check_rate_limit_format(value: Optional[str]) -> Optional[str]:
+    # "10/minute", or "10" for 10 per second
+    if value:
+        capacity, _, period = value.partition("/")
+        if not capacity.strip().isdigit() or int(capacity) < 1 or (period.strip() or "second") not in RATE_LIMIT_PERIODS:
+            raise ValueError(f"Invalid rate limit {value!r}, expected a count and a period of {', '.join(RATE_LIMIT_PERIODS)} such as '10/minute'")
+
+    return value
+
 class BaseConfig(BaseSettings):
     ENV_STATE: Optional[str] = None
 
@@ -10,6 +25,23 @@ class BaseConfig(BaseSettings):
 class GlobalConfig(BaseConfig):
     DATABASE_URL: Optional[str] = None
     DB_FORCE_ROLL_BACK: bool = False
+    DB_POOL_MIN_SIZE: int = 1
+    DB_POOL_MAX_SIZE: int = 3
+    DB_MAX_CONNECTIONS: Optional[int] = None
+    DB_BACKEND: str = "databases"
+    DB_STATEMENT_CACHE_SIZE: int = 500
+    POSTS_QUERY_TIMEOUT: float = 2
+    POSTS_MAX_RESULTS: int = 1000
+    POSTS_PAGE_SIZE: int = 50
+    COMMENTS_QUERY_TIMEOUT: float = 2
+    COMMENTS_MAX_RESULTS: int = 1000
+    COMMENTS_PAGE_SIZE: int = 50
+    SERVER_HOST: str = "127.0.0.1"
+    SERVER_PORT: int = 8000
+    SERVER_WORKERS: Optional[int] = None
+    SERVER_KEEPALIVE: int = 5
+    SERVER_GRACEFUL_TIMEOUT: int = 30
+    SERVER_BACKLOG: int = 2048
     LOGTAIL_APIKEY: Optional[str] = None
     SECRET_KEY: Optional[str] = None
     ALGORITHM: Optional[str] = "HS256"
@@ -17,11 +49,53 @@ class GlobalConfig(BaseConfig):
     CONFIRM_EXPIRATION: Optional[int] = 1440
     MAILGUN_API_KEY: Optional[str] = None
     MAILGUN_API_DOMAIN: Optional[str] = None
+    MAILGUN_BATCH_WINDOW: float = 0.5
+    MAILGUN_MAX_CONCURRENCY: int = 4
+    MAILGUN_TIMEOUT: float = 10
     B2_KEY_ID: Optional[str] = None
     B2_APPLICATION_KEY: Optional[str] = None
     B2_BUCKET_NAME: Optional[str] = None
     DEEPAI_API_KEY: Optional[str] = None
+    DEEPAI_MAX_CONCURRENCY: int = 4
+    DEEPAI_CACHE_TTL: int = 3600
+    DEEPAI_CACHE_SIZE: int = 256
+    DEEPAI_TIMEOUT: float = 60
+    BREAKER_FAILURE_RATE: float = 0.5
+    BREAKER_MIN_CALLS: int = 10
+    BREAKER_RESET_TIMEOUT: float = 30
     SENTRY_DSN: Optional[str] = None
+    TRENDING_HALF_LIFE: int = 6 * 60 * 60
+    FEED_BUFFER_SIZE: int = 100
+    FEED_KEEPALIVE: float = 15
+    COMPRESSION_MINIMUM_SIZE: int = 500
+    COMPRESSION_OFFLOAD_SIZE: int = 64 * 1024
+    COMPRESSION_GZIP_LEVEL: int = 6
+    COMPRESSION_BROTLI_QUALITY: int = 4
+    COMPRESSION_ZSTD_LEVEL: int = 3
+    UPLOAD_PART_SIZE: int = 5 * 1024 * 1024
+    UPLOAD_MAX_PARTS: int = 10_000
+    UPLOAD_AUTHORIZATION_TTL: int = 15 * 60
+    UPLOAD_SESSION_TTL: int = 24 * 60 * 60
+    UPLOAD_SWEEP_INTERVAL: float = 15 * 60
+    SERVER_TIMING_ENABLED: bool = False
+    QUERY_STATS_ENABLED: bool = False
+    QUERY_SLOW_THRESHOLD: float = 0.5
+    QUERY_PLAN_INTERVAL: float = 300
+    QUERY_STATS_MAX_SHAPES: int = 1000
+    IDEMPOTENCY_TTL: int = 24 * 60 * 60
+    IDEMPOTENCY_MAX_KEYS: int = 10_000
+    IDEMPOTENCY_WAIT_TIMEOUT: float = 30
+    RATE_LIMIT_ENABLED: bool = True
+    RATE_LIMIT_TOKEN: Optional[str] = "10/minute"
+    RATE_LIMIT_REGISTER: Optional[str] = "5/minute"
+    RATE_LIMIT_UPLOAD: Optional[str] = "10/minute"
+    RATE_LIMIT_LIKE: Optional[str] = "60/minute"
+    METRICS_TOKEN: Optional[str] = None
+
+    @field_validator("RATE_LIMIT_TOKEN", "RATE_LIMIT_REGISTER", "RATE_LIMIT_UPLOAD", "RATE_LIMIT_LIKE")
+    @classmethod
+    def validate_rate_limit(cls, value: Optional[str]) -> Optional[str]:
+        return check_rate_limit_format(value)
 
 class DevConfig(GlobalConfig):
     model_config = SettingsConfigDict(env_prefix="DEV_", extra="ignore")
@@ -37,6 +111,8 @@ class TestConfig(GlobalConfig):
     ALGORITHM: Optional[str] = "HS256"
     EXPIRATION: Optional[int] = 30
     CONFIRM_EXPIRATION: Optional[int] = 1440
+    RATE_LIMIT_ENABLED: bool = False
+    QUERY_STATS_ENABLED: bool = True
 
     model_config = SettingsConfigDict(env_prefix="TEST_", extra="allow")
 
@@ -45,4 +121,74 @@ def get_config(env_state: str):
     configs = {"dev": DevConfig, "prod": ProdConfig, "test": TestConfig}
     return configs[env_state]()
 
-config = get_config(BaseConfig().ENV_STATE)
+class LazyConfig:
+    # Builds the settings for ENV_STATE on first use rather than at import,
+    # then forwards attribute access to them
+    def __init__(self, factory: Callable[[], GlobalConfig]) -> None:
+        object.__setattr__(self, "_factory", factory)
+        object.__setattr__(self, "_config", None)
+
+    def resolve(self) -> GlobalConfig:
+        if self._config is None:
+            object.__setattr__(self, "_config", self._factory())
+
+        return self._config
+
+    def reset(self) -> None:
+        object.__setattr__(self, "_config", None)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.resolve(), name)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        setattr(self.resolve(), name, value)
+
+    def __delattr__(self, name: str) -> None:
+        delattr(self.resolve(), name)
+
+config = LazyConfig(lambda: get_config(BaseConfig().ENV_STATE))
+
+def reset_config() -> None:
+    # Forget the settings built for every ENV_STATE so the next access reads
+    # the environment again
+    get_config.cache_clear()
+    config.reset()
+
+class RuntimeSettings(BaseModel):
+    # Values derived from the config once, for code that runs on every request
+    model_config = ConfigDict(frozen=True, arbitrary_types_allowed=True)
+
+    signing_key: Key
+    algorithm: str
+    algorithms: Tuple[str, ...]
+    access_token_expiration: timedelta
+    confirmation_token_expiration: timedelta
+
+    @classmethod
+    def from_config(cls, settings: GlobalConfig) -> "RuntimeSettings":
+        return cls(
+            signing_key=jwk.construct(settings.SECRET_KEY.encode(), settings.ALGORITHM),
+            algorithm=settings.ALGORITHM,
+            algorithms=(settings.ALGORITHM,),
+            access_token_expiration=timedelta(minutes=settings.EXPIRATION),
+            confirmation_token_expiration=timedelta(minutes=settings.CONFIRM_EXPIRATION)
+        )
+
+runtime_settings: Optional[RuntimeSettings] = None
+
+def get_runtime_settings() -> RuntimeSettings:
+    if runtime_settings is None:
+        return rebuild_runtime_settings()
+
+    return runtime_settings
+
+def rebuild_runtime_settings(**overrides: Any) -> RuntimeSettings:
+    # rebuild_runtime_settings(EXPIRATION=-1) gives tests a snapshot with
+    # overridden values; call it without arguments to go back to the config
+    global runtime_settings
+    settings = config.resolve()
+    if overrides:
+        settings = settings.model_copy(update=overrides)
+
+    runtime_settings = RuntimeSettings.from_config(settings)
+    return runtime_settings
@@ -1,6 +1,14 @@
 import databases
 import sqlalchemy
+import time
+from functools import lru_cache
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple, Union
+from sqlalchemy.engine import Dialect
+from sqlalchemy.sql.compiler import Compiled
 from storeapi.config import config
+from storeapi.querystats import QueryStats, get_query_stats
+from storeapi.sqlalchemy_database import SQLAlchemyDatabase
+from storeapi.timing import record_span, span
 
 metadata = sqlalchemy.MetaData()
 
@@ -10,7 +18,15 @@ post_table = sqlalchemy.Table(
     sqlalchemy.Column("id", sqlalchemy.Integer, primary_key=True),
     sqlalchemy.Column("body", sqlalchemy.String),
     sqlalchemy.Column("user_id", sqlalchemy.ForeignKey("users.id"), nullable=False),
-    sqlalchemy.Column("image_url", sqlalchemy.String)
+    sqlalchemy.Column("image_url", sqlalchemy.String),
+    sqlalchemy.Column("like_count", sqlalchemy.Integer, nullable=False, server_default="0"),
+    # 0 is a single like at TRENDING_EPOCH, below any like made since, so posts
+    # without likes need no NULL handling and trending reads (trending_score, id)
+    sqlalchemy.Column("trending_score", sqlalchemy.Float, nullable=False, server_default="0"),
+    sqlalchemy.Column("comment_count", sqlalchemy.Integer, nullable=False, server_default="0"),
+    sqlalchemy.Index("ix_posts_like_count", "like_count", "id"),
+    sqlalchemy.Index("ix_posts_trending_score", "trending_score", "id"),
+    sqlalchemy.Index("ix_posts_user_id_id", "user_id", "id")
 )
 
 user_table = sqlalchemy.Table(
@@ -28,7 +44,8 @@ comment_table = sqlalchemy.Table(
     sqlalchemy.Column("id", sqlalchemy.Integer, primary_key=True),
     sqlalchemy.Column("body", sqlalchemy.String),
     sqlalchemy.Column("post_id", sqlalchemy.ForeignKey("posts.id"), nullable=False),
-    sqlalchemy.Column("user_id", sqlalchemy.ForeignKey("users.id"), nullable=False)
+    sqlalchemy.Column("user_id", sqlalchemy.ForeignKey("users.id"), nullable=False),
+    sqlalchemy.Index("ix_comments_post_id_id", "post_id", "id")
 )
 
 like_table = sqlalchemy.Table(
@@ -36,19 +53,231 @@ like_table = sqlalchemy.Table(
     metadata,
     sqlalchemy.Column("id", sqlalchemy.Integer, primary_key=True),
     sqlalchemy.Column("post_id", sqlalchemy.ForeignKey("posts.id"), nullable=False),
-    sqlalchemy.Column("user_id", sqlalchemy.ForeignKey("users.id"), nullable=False)
+    sqlalchemy.Column("user_id", sqlalchemy.ForeignKey("users.id"), nullable=False),
+    # One like per user and post; also serves the lookups by post alone
+    sqlalchemy.Index("ix_likes_post_id_user_id", "post_id", "user_id", unique=True)
+)
+
+upload_session_table = sqlalchemy.Table(
+    "upload_sessions",
+    metadata,
+    sqlalchemy.Column("id", sqlalchemy.String(32), primary_key=True),
+    sqlalchemy.Column("user_id", sqlalchemy.ForeignKey("users.id"), nullable=False),
+    sqlalchemy.Column("file_name", sqlalchemy.String, nullable=False),
+    sqlalchemy.Column("content_type", sqlalchemy.String, nullable=False),
+    sqlalchemy.Column("size", sqlalchemy.BigInteger, nullable=False),
+    sqlalchemy.Column("part_size", sqlalchemy.Integer, nullable=False),
+    sqlalchemy.Column("b2_file_id", sqlalchemy.String, nullable=False),
+    sqlalchemy.Column("file_url", sqlalchemy.String),
+    # Sessions that predate the column count as expired and are swept
+    sqlalchemy.Column("expires_at", sqlalchemy.Float, nullable=False, server_default="0")
 )
 
-connect_args = {"check_same_thread": False} if "sqlite" in config.DATABASE_URL else {}
-engine = sqlalchemy.create_engine(
-    config.DATABASE_URL,
-    connect_args=connect_args
+upload_part_table = sqlalchemy.Table(
+    "upload_parts",
+    metadata,
+    sqlalchemy.Column("id", sqlalchemy.Integer, primary_key=True),
+    sqlalchemy.Column("session_id", sqlalchemy.ForeignKey("upload_sessions.id"), nullable=False),
+    sqlalchemy.Column("part_number", sqlalchemy.Integer, nullable=False),
+    sqlalchemy.Column("size", sqlalchemy.Integer, nullable=False),
+    sqlalchemy.Column("sha1", sqlalchemy.String(40), nullable=False),
+    sqlalchemy.UniqueConstraint("session_id", "part_number", name="uq_upload_parts_session_id_part_number")
 )
 
-metadata.create_all(engine)
-db_args = {"min_size": 1, "max_size": 3} if "postgresql" in config.DATABASE_URL else {}
-database = databases.Database(
-    config.DATABASE_URL,
-    force_rollback=config.DB_FORCE_ROLL_BACK,
-    **db_args
+upload_authorization_table = sqlalchemy.Table(
+    "upload_authorizations",
+    metadata,
+    sqlalchemy.Column("id", sqlalchemy.String(32), primary_key=True),
+    sqlalchemy.Column("user_id", sqlalchemy.ForeignKey("users.id"), nullable=False),
+    sqlalchemy.Column("file_name", sqlalchemy.String, nullable=False),
+    sqlalchemy.Column("expires_at", sqlalchemy.Float, nullable=False),
+    sqlalchemy.Column("file_id", sqlalchemy.String),
+    sqlalchemy.Column("file_url", sqlalchemy.String)
 )
+
+@lru_cache()
+def get_engine() -> sqlalchemy.engine.Engine:
+    # Only schema migrations use the synchronous engine, requests go through `database`
+    connect_args = {"check_same_thread": False} if "sqlite" in config.DATABASE_URL else {}
+    return sqlalchemy.create_engine(
+        config.DATABASE_URL,
+        connect_args=connect_args
+    )
+
+def create_database(backend: str = None) -> Union[databases.Database, SQLAlchemyDatabase]:
+    # DB_BACKEND picks the `databases` library or SQLAlchemy's async engine,
+    # both expose the same fetch/execute/transaction calls to the routers
+    backend = backend or config.DB_BACKEND
+    db_args = {"min_size": config.DB_POOL_MIN_SIZE, "max_size": config.DB_POOL_MAX_SIZE} if "postgresql" in config.DATABASE_URL else {}
+    if backend == "sqlalchemy":
+        return SQLAlchemyDatabase(
+            config.DATABASE_URL,
+            force_rollback=config.DB_FORCE_ROLL_BACK,
+            statement_cache_size=config.DB_STATEMENT_CACHE_SIZE,
+            **db_args
+        )
+
+    if backend != "databases":
+        raise ValueError(f"Unknown database backend: {backend}")
+
+    return databases.Database(
+        config.DATABASE_URL,
+        force_rollback=config.DB_FORCE_ROLL_BACK,
+        **db_args
+    )
+
+class InstrumentedDatabase:
+    # Wraps either backend, times every query as a "db" span and, with
+    # `stats`, aggregates it by shape and reports the slow ones; everything
+    # else (connect, transaction, ...) is forwarded untouched. Without a
+    # backend, one is created from the config on first use.
+    def __init__(self, backend: Optional[Union[databases.Database, SQLAlchemyDatabase]] = None, stats: Optional[QueryStats] = None) -> None:
+        self._backend = backend
+        self._stats = stats
+
+    @property
+    def backend(self) -> Union[databases.Database, SQLAlchemyDatabase]:
+        if self._backend is None:
+            self._backend = create_database()
+            if config.QUERY_STATS_ENABLED:
+                self._stats = get_query_stats()
+
+        return self._backend
+
+    @property
+    def stats(self) -> Optional[QueryStats]:
+        self.backend
+        return self._stats
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.backend, name)
+
+    async def __aenter__(self) -> "InstrumentedDatabase":
+        await self.backend.connect()
+        return self
+
+    async def __aexit__(self, *args: Any) -> None:
+        await self.backend.disconnect()
+
+    async def observe(self, call: Callable[[], Awaitable[Any]], query: Any, values: Any, count_rows: Callable[[Any], Optional[int]]) -> Any:
+        if self.stats is None:
+            with span("db"):
+                return await call()
+
+        start = time.perf_counter()
+        try:
+            with span("db"):
+                result = await call()
+        except Exception:
+            slow = self.stats.record(query, values, time.perf_counter() - start, None, failed=True)
+            if slow is not None:
+                await self.stats.report(slow, self.backend.fetch_all, explain=False)
+            raise
+
+        slow = self.stats.record(query, values, time.perf_counter() - start, count_rows(result))
+        if slow is not None:
+            await self.stats.report(slow, self.backend.fetch_all)
+
+        return result
+
+    async def fetch_all(self, query: Any, values: Optional[Dict[str, Any]] = None) -> List[Any]:
+        return await self.observe(lambda: self.backend.fetch_all(query, values), query, values, len)
+
+    async def fetch_one(self, query: Any, values: Optional[Dict[str, Any]] = None) -> Any:
+        return await self.observe(lambda: self.backend.fetch_one(query, values), query, values, lambda record: int(record is not None))
+
+    async def fetch_val(self, query: Any, values: Optional[Dict[str, Any]] = None, column: Any = 0) -> Any:
+        return await self.observe(lambda: self.backend.fetch_val(query, values, column), query, values, lambda _: None)
+
+    async def execute(self, query: Any, values: Optional[Dict[str, Any]] = None) -> Any:
+        # The result is the new primary key or a row count depending on the
+        # backend, so it isn't counted as rows
+        return await self.observe(lambda: self.backend.execute(query, values), query, values, lambda _: None)
+
+    async def execute_many(self, query: Any, values: List[Dict[str, Any]]) -> None:
+        return await self.observe(lambda: self.backend.execute_many(query, values), query, None, lambda _: len(values))
+
+    async def iterate(self, query: Any, values: Optional[Dict[str, Any]] = None) -> AsyncIterator[Any]:
+        # Only the time spent waiting on the database counts, not the time
+        # the consumer takes between rows (an export streaming to a client)
+        rows, duration = 0, 0.0
+        iterator = self.backend.iterate(query, values).__aiter__()
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    row = await iterator.__anext__()
+                except StopAsyncIteration:
+                    break
+                finally:
+                    duration += time.perf_counter() - start
+
+                rows += 1
+                yield row
+        finally:
+            record_span("db", duration)
+
+        if self.stats is not None:
+            slow = self.stats.record(query, values, duration, rows)
+            if slow is not None:
+                await self.stats.report(slow, self.backend.fetch_all)
+
+database = InstrumentedDatabase()
+
+class CachedQuery:
+    # Compiles the statement once per dialect, callers only bind new values.
+    # Statements must not use expanding ("IN") bind parameters, since those
+    # are rendered into the SQL string at compile time. `dialect_statements`
+    # replace the statement on the dialects they name, for clauses such as
+    # ON CONFLICT that each dialect spells its own way.
+    def __init__(self, statement: sqlalchemy.sql.ClauseElement, dialect_statements: Optional[Dict[str, sqlalchemy.sql.ClauseElement]] = None) -> None:
+        self.statement = statement
+        self.dialect_statements = dialect_statements or {}
+        self._compiled: Dict[Tuple[type, str], Compiled] = {}
+
+    def compile(self, dialect: Dialect, **kwargs: Any) -> Compiled:
+        key = (type(dialect), dialect.paramstyle)
+        compiled = self._compiled.get(key)
+        if compiled is None:
+            statement = self.dialect_statements.get(dialect.name, self.statement)
+            compiled = self._compiled[key] = statement.compile(dialect=dialect, **kwargs)
+
+        return compiled
+
+    def bind(self, **values: Any) -> "BoundQuery":
+        return BoundQuery(self, values)
+
+    def to_statement(self, dialect_name: Optional[str] = None) -> Tuple[sqlalchemy.sql.ClauseElement, Dict[str, Any]]:
+        return self.dialect_statements.get(dialect_name, self.statement), {}
+
+    def __str__(self) -> str:
+        return str(self.statement)
+
+class BoundQuery:
+    def __init__(self, query: CachedQuery, values: Dict[str, Any]) -> None:
+        self.query = query
+        self.values = values
+
+    def compile(self, dialect: Dialect, **kwargs: Any) -> "BoundCompiled":
+        return BoundCompiled(self.query.compile(dialect, **kwargs), self.values)
+
+    def to_statement(self, dialect_name: Optional[str] = None) -> Tuple[sqlalchemy.sql.ClauseElement, Dict[str, Any]]:
+        return self.query.to_statement(dialect_name)[0], self.values
+
+    def __str__(self) -> str:
+        return str(self.query)
+
+class BoundCompiled:
+    def __init__(self, compiled: Compiled, values: Dict[str, Any]) -> None:
+        self._compiled = compiled
+        self._values = values
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._compiled, name)
+
+    def construct_params(self, params: Dict[str, Any] = None, **kwargs: Any) -> Dict[str, Any]:
+        return self._compiled.construct_params({**self._values, **(params or {})}, **kwargs)
+
+    @property
+    def params(self) -> Dict[str, Any]:
+        return self.construct_params()
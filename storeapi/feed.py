@@ -0,0 +1,95 @@
+import asyncio
+import logging
+from abc import ABC, abstractmethod
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Set
+from storeapi.config import config
+
+logger = logging.getLogger(__name__)
+
+Event = Dict[str, Any]
+
+class Subscription:
+    def __init__(self, buffer_size: int) -> None:
+        self.queue: asyncio.Queue[Optional[Event]] = asyncio.Queue(maxsize=buffer_size)
+        self.evicted = False
+
+    def push(self, event: Event) -> bool:
+        try:
+            self.queue.put_nowait(event)
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    def evict(self) -> None:
+        # Drop whatever is buffered and wake the consumer with the end marker
+        self.evicted = True
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(None)
+
+    async def get(self, timeout: Optional[float] = None) -> Optional[Event]:
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+class FeedBroker(ABC):
+    # Carries events between the hubs of every worker. A shared backend
+    # (e.g. Redis pub/sub) publishes to the channel and calls hub.dispatch
+    # for each message it receives.
+    @abstractmethod
+    def attach(self, hub: "FeedHub") -> None:
+        ...
+
+    @abstractmethod
+    def detach(self, hub: "FeedHub") -> None:
+        ...
+
+    @abstractmethod
+    async def publish(self, event: Event) -> None:
+        ...
+
+class InMemoryBroker(FeedBroker):
+    # Single process broker, hubs attached to the same instance behave like
+    # separate workers sharing one channel
+    def __init__(self) -> None:
+        self.hubs: List["FeedHub"] = []
+
+    def attach(self, hub: "FeedHub") -> None:
+        self.hubs.append(hub)
+
+    def detach(self, hub: "FeedHub") -> None:
+        self.hubs.remove(hub)
+
+    async def publish(self, event: Event) -> None:
+        for hub in self.hubs:
+            hub.dispatch(event)
+
+class FeedHub:
+    def __init__(self, broker: Optional[FeedBroker] = None, buffer_size: int = 100) -> None:
+        self.broker = broker or InMemoryBroker()
+        self.buffer_size = buffer_size
+        self.subscriptions: Set[Subscription] = set()
+        self.evictions = 0
+        self.broker.attach(self)
+
+    def subscribe(self) -> Subscription:
+        subscription = Subscription(self.buffer_size)
+        self.subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        self.subscriptions.discard(subscription)
+
+    async def publish(self, event_type: str, **data: Any) -> None:
+        await self.broker.publish({"type": event_type, **data})
+
+    def dispatch(self, event: Event) -> None:
+        for subscription in list(self.subscriptions):
+            if not subscription.push(event):
+                logger.warning("Evicting slow feed subscriber")
+                self.evictions += 1
+                self.unsubscribe(subscription)
+                subscription.evict()
+
+@lru_cache()
+def get_feed_hub() -> FeedHub:
+    return FeedHub(buffer_size=config.FEED_BUFFER_SIZE)
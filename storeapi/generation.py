@@ -0,0 +1,91 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+class GenerationScheduler:
+    # Runs at most max_concurrency generations at once, lowest priority value
+    # first. Concurrent calls with the same key share one in-flight call and
+    # successful results are cached for cache_ttl seconds.
+    def __init__(
+        self,
+        max_concurrency: int = 4,
+        cache_ttl: float = 3600,
+        cache_size: int = 256,
+        clock: Callable[[], float] = time.monotonic
+    ) -> None:
+        self.max_concurrency = max_concurrency
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+        self.clock = clock
+        self.running = 0
+        self.waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self.in_flight: Dict[Hashable, asyncio.Task] = {}
+        self.cache: OrderedDict[Hashable, Tuple[Any, float]] = OrderedDict()
+        self._counter = itertools.count()
+
+    async def run(self, key: Hashable, call: Callable[[], Awaitable[Any]], priority: int = 0) -> Any:
+        cached = self.cache.get(key)
+        if cached is not None:
+            if cached[1] > self.clock():
+                self.cache.move_to_end(key)
+                logger.debug("Using cached generation result")
+                return cached[0]
+
+            del self.cache[key]
+
+        task = self.in_flight.get(key)
+        if task is None:
+            task = self.in_flight[key] = asyncio.create_task(self._run(key, call, priority))
+        else:
+            logger.debug("Joining in-flight generation")
+
+        # One caller giving up must not cancel the call for everyone else
+        return await asyncio.shield(task)
+
+    async def _run(self, key: Hashable, call: Callable[[], Awaitable[Any]], priority: int) -> Any:
+        try:
+            await self._acquire(priority)
+            try:
+                result = await call()
+            finally:
+                self._release()
+
+            self.cache[key] = (result, self.clock() + self.cache_ttl)
+            self.cache.move_to_end(key)
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+            return result
+        finally:
+            del self.in_flight[key]
+
+    async def _acquire(self, priority: int) -> None:
+        if self.running < self.max_concurrency and not self.waiters:
+            self.running += 1
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiters, (priority, next(self._counter), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            # The slot was handed over just before the cancellation
+            if future.done() and not future.cancelled():
+                self._release()
+            raise
+
+    def _release(self) -> None:
+        while self.waiters:
+            _, _, future = heapq.heappop(self.waiters)
+            if not future.done():
+                # Hand the slot straight to the next waiter
+                future.set_result(None)
+                return
+
+        self.running -= 1
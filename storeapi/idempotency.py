@@ -0,0 +1,217 @@
+import asyncio
+import hashlib
+import logging
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Callable, Iterable, List, NamedTuple, Optional, Tuple
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from storeapi.config import config
+
+logger = logging.getLogger(__name__)
+
+MAX_KEY_LENGTH = 255
+
+class StoredResponse(NamedTuple):
+    status: int
+    headers: List[Tuple[bytes, bytes]]
+    body: bytes
+
+class IdempotencyEntry:
+    def __init__(self, expires_at: float) -> None:
+        self.expires_at = expires_at
+        self.fingerprint: Optional[str] = None
+        self.response: Optional[StoredResponse] = None
+        self.done = asyncio.Event()
+
+class IdempotencyStore(ABC):
+    @abstractmethod
+    async def reserve(self, key: str) -> Optional[IdempotencyEntry]:
+        # Claims `key` for a new request and returns None, or returns the entry
+        # of the request that claimed it first
+        ...
+
+    @abstractmethod
+    async def complete(self, key: str, fingerprint: Optional[str], response: StoredResponse) -> None:
+        ...
+
+    @abstractmethod
+    async def release(self, key: str) -> None:
+        # Forgets a request that failed, so a retry runs it again
+        ...
+
+class MemoryIdempotencyStore(IdempotencyStore):
+    def __init__(self, ttl: float, max_size: int, clock: Callable[[], float] = time.monotonic) -> None:
+        self.ttl = ttl
+        self.max_size = max_size
+        self.clock = clock
+        # Oldest first, so the front is what expires or gets evicted next
+        self.entries: "OrderedDict[str, IdempotencyEntry]" = OrderedDict()
+
+    async def reserve(self, key: str) -> Optional[IdempotencyEntry]:
+        now = self.clock()
+        entry = self.entries.get(key)
+        if entry is not None and (entry.expires_at > now or not entry.done.is_set()):
+            return entry
+
+        self.entries.pop(key, None)
+        # Requests still running keep their entry, or a retry would run them
+        # again, so the store goes over max_size while they are all in flight
+        for stale_key, stale in list(self.entries.items()):
+            if len(self.entries) < self.max_size and stale.expires_at > now:
+                break
+            if stale.done.is_set():
+                del self.entries[stale_key]
+
+        self.entries[key] = IdempotencyEntry(now + self.ttl)
+        return None
+
+    async def complete(self, key: str, fingerprint: Optional[str], response: StoredResponse) -> None:
+        entry = self.entries.pop(key, None) or IdempotencyEntry(self.clock() + self.ttl)
+        entry.fingerprint = fingerprint
+        entry.response = response
+        entry.expires_at = self.clock() + self.ttl
+        self.entries[key] = entry
+        entry.done.set()
+
+    async def release(self, key: str) -> None:
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            entry.done.set()
+
+    def clear(self) -> None:
+        self.entries.clear()
+
+def has_stable_body(headers: Headers) -> bool:
+    # Multipart boundaries are random, so a retried upload never has the same
+    # bytes and can't be checked against the original
+    return not headers.get("content-type", "").startswith("multipart/")
+
+def should_store(status: int) -> bool:
+    # Server errors and rate limiting are worth retrying, everything else is
+    # the final answer for that key
+    return status < 500 and status != 429
+
+class IdempotencyMiddleware:
+    # Runs a POST to one of `paths`, or to anything below one, at most once
+    # per Idempotency-Key. Retries get the stored response back, and a retry
+    # that arrives while the first request is still running waits for it
+    # instead of running in parallel. Keys are scoped to the path and to the
+    # caller's Authorization header or address.
+    def __init__(
+        self,
+        app: ASGIApp,
+        store: IdempotencyStore,
+        paths: Iterable[str],
+        wait_timeout: float = 30
+    ) -> None:
+        self.app = app
+        self.store = store
+        self.paths = tuple(paths)
+        self.wait_timeout = wait_timeout
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["method"] != "POST" or not self.covers(scope["path"]):
+            await self.app(scope, receive, send)
+            return
+
+        headers = Headers(scope=scope)
+        idempotency_key = headers.get("idempotency-key")
+        if idempotency_key is None:
+            await self.app(scope, receive, send)
+            return
+
+        if not idempotency_key or len(idempotency_key) > MAX_KEY_LENGTH:
+            response = JSONResponse({"detail": "Invalid Idempotency-Key"}, status_code=400)
+            await response(scope, receive, send)
+            return
+
+        key = self.store_key(scope, headers, idempotency_key)
+        deadline = time.monotonic() + self.wait_timeout
+        while (entry := await self.store.reserve(key)) is not None:
+            if entry.done.is_set():
+                await self.replay(entry, scope, receive, send)
+                return
+
+            try:
+                await asyncio.wait_for(entry.done.wait(), deadline - time.monotonic())
+            except asyncio.TimeoutError:
+                response = JSONResponse({"detail": "A request with this Idempotency-Key is still in progress"}, status_code=409)
+                await response(scope, receive, send)
+                return
+
+        await self.run(key, has_stable_body(headers), scope, receive, send)
+
+    def covers(self, path: str) -> bool:
+        return any(path == prefix or path.startswith(prefix + "/") for prefix in self.paths)
+
+    def store_key(self, scope: Scope, headers: Headers, idempotency_key: str) -> str:
+        caller = headers.get("authorization") or (scope["client"][0] if scope.get("client") else "")
+        caller_hash = hashlib.sha256(caller.encode()).hexdigest()
+        return f"{scope['path']}:{caller_hash}:{idempotency_key}"
+
+    async def run(self, key: str, fingerprinted: bool, scope: Scope, receive: Receive, send: Send) -> None:
+        fingerprint = hashlib.sha256()
+        status, response_headers, body = 500, [], []
+        completed = body_read = False
+
+        async def receive_and_hash() -> Message:
+            nonlocal body_read
+            message = await receive()
+            if message["type"] == "http.request":
+                fingerprint.update(message.get("body", b""))
+                body_read = not message.get("more_body", False)
+            return message
+
+        async def send_and_capture(message: Message) -> None:
+            nonlocal status, response_headers, completed
+            if message["type"] == "http.response.start":
+                status, response_headers = message["status"], list(message.get("headers", []))
+            elif message["type"] == "http.response.body":
+                body.append(message.get("body", b""))
+
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False) and should_store(status):
+                # Stored as soon as the response is sent, duplicates don't
+                # wait for the route's background tasks
+                # A route that doesn't read the body (only path parameters)
+                # leaves nothing to compare retries against
+                completed = True
+                await self.store.complete(key, fingerprint.hexdigest() if fingerprinted and body_read else None, StoredResponse(status, response_headers, b"".join(body)))
+
+        try:
+            await self.app(scope, receive_and_hash, send_and_capture)
+        finally:
+            if not completed:
+                await self.store.release(key)
+
+    async def body_fingerprint(self, receive: Receive) -> Optional[str]:
+        fingerprint = hashlib.sha256()
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message["type"] != "http.request":
+                return None
+            fingerprint.update(message.get("body", b""))
+            more_body = message.get("more_body", False)
+
+        return fingerprint.hexdigest()
+
+    async def replay(self, entry: IdempotencyEntry, scope: Scope, receive: Receive, send: Send) -> None:
+        # The retried body still has to match the one the key was first used with
+        if entry.fingerprint is not None and await self.body_fingerprint(receive) != entry.fingerprint:
+            logger.warning("Idempotency-Key reused with a different request body")
+            response = JSONResponse({"detail": "Idempotency-Key was already used with a different request"}, status_code=422)
+            await response(scope, receive, send)
+            return
+
+        stored = entry.response
+        await send({"type": "http.response.start", "status": stored.status, "headers": [*stored.headers, (b"idempotent-replayed", b"true")]})
+        await send({"type": "http.response.body", "body": stored.body})
+
+@lru_cache()
+def get_idempotency_store() -> IdempotencyStore:
+    return MemoryIdempotencyStore(config.IDEMPOTENCY_TTL, config.IDEMPOTENCY_MAX_KEYS)
@@ -1,10 +1,23 @@
+import io
 import logging
 import b2sdk.v2 as b2
 from functools import lru_cache
+from typing import Optional, Tuple
+from b2sdk.v2.exception import FileNotPresent
+from storeapi.circuitbreaker import CircuitBreaker
 from storeapi.config import config
 
 logger = logging.getLogger(__name__)
 
+@lru_cache()
+def b2_breaker() -> CircuitBreaker:
+    return CircuitBreaker(
+        "b2",
+        failure_rate=config.BREAKER_FAILURE_RATE,
+        min_calls=config.BREAKER_MIN_CALLS,
+        reset_timeout=config.BREAKER_RESET_TIMEOUT
+    )
+
 @lru_cache()
 def b2_api():
     logger.debug("Creating and Authorizing B2 API")
@@ -19,14 +32,66 @@ def b2_get_bucket(api: b2.B2Api):
     return api.get_bucket_by_name(config.B2_BUCKET_NAME)
 
 def b2_upload_file(local_file: str, file_name: str):
-    api = b2_api()
     logger.debug(f"Uploading {local_file} to B2 as {file_name}")
-    
-    uploaded_file = b2_get_bucket(api).upload_local_file(
-        local_file=local_file,
-        file_name=file_name
-    )
+    with b2_breaker().guard():
+        api = b2_api()
+        uploaded_file = b2_get_bucket(api).upload_local_file(
+            local_file=local_file,
+            file_name=file_name
+        )
 
     download_url = api.get_download_url_for_fileid(uploaded_file.id_)
     logger.debug(f"Uploaded {local_file} to B2 successfully and got download URL {download_url}")
     return download_url
+
+# Large files are uploaded in parts through the raw B2 session, so each part
+# can be sent by whichever request receives it
+def b2_start_large_file(file_name: str, content_type: str) -> str:
+    logger.debug(f"Starting B2 large file {file_name}")
+    with b2_breaker().guard():
+        api = b2_api()
+        large_file = api.session.start_large_file(b2_get_bucket(api).id_, file_name, content_type, {})
+
+    return large_file["fileId"]
+
+def b2_upload_part(file_id: str, part_number: int, data: bytes, sha1: str) -> None:
+    logger.debug(f"Uploading part {part_number} of B2 large file {file_id}")
+    with b2_breaker().guard():
+        b2_api().session.upload_part(file_id, part_number, len(data), sha1, io.BytesIO(data))
+
+def b2_finish_large_file(file_id: str, part_sha1s: list) -> str:
+    logger.debug(f"Finishing B2 large file {file_id}")
+    with b2_breaker().guard():
+        api = b2_api()
+        api.session.finish_large_file(file_id, part_sha1s)
+
+    return api.get_download_url_for_fileid(file_id)
+
+def b2_cancel_large_file(file_id: str) -> None:
+    logger.debug(f"Cancelling B2 large file {file_id}")
+    with b2_breaker().guard():
+        b2_api().session.cancel_large_file(file_id)
+
+def b2_get_upload_authorization() -> Tuple[str, str]:
+    # Upload URL and token a client can use to upload to the bucket directly
+    logger.debug("Getting a B2 upload URL")
+    with b2_breaker().guard():
+        api = b2_api()
+        upload = api.session.get_upload_url(b2_get_bucket(api).id_)
+
+    return upload["uploadUrl"], upload["authorizationToken"]
+
+def b2_get_uploaded_file(file_id: str) -> Optional[Tuple[str, str]]:
+    # File name and download URL of an uploaded file, None if it doesn't exist
+    logger.debug(f"Getting B2 file {file_id}")
+    with b2_breaker().guard():
+        api = b2_api()
+        try:
+            file_version = api.get_file_info(file_id)
+        except FileNotPresent:
+            return None
+
+    if file_version.bucket_id != b2_get_bucket(api).id_:
+        return None
+
+    return file_version.file_name, api.get_download_url_for_fileid(file_id)
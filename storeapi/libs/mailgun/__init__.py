@@ -0,0 +1,154 @@
+import asyncio
+import json
+import logging
+import httpx
+from contextlib import nullcontext
+from httpx import AsyncClient
+from string import Template
+from typing import Any, Dict, List, Optional, Tuple
+from storeapi.circuitbreaker import CircuitBreaker
+
+logger = logging.getLogger(__name__)
+
+MAILGUN_API_URL = "https://api.mailgun.net/v3"
+MAX_BATCH_SIZE = 1000
+
+class EmailTemplate:
+    # Body placeholders use string.Template syntax ($name). The batch text
+    # swaps them for Mailgun recipient variables once, at definition time.
+    def __init__(self, subject: str, body: str) -> None:
+        self.subject = subject
+        self.template = Template(body)
+        self.variables = tuple(self.template.get_identifiers())
+        self.batch_text = self.template.safe_substitute({name: f"%recipient.{name}%" for name in self.variables})
+
+    def render(self, **variables: Any) -> str:
+        return self.template.substitute(variables)
+
+Recipient = Tuple[str, Dict[str, Any], asyncio.Future]
+
+class MailgunDispatcher:
+    def __init__(
+        self,
+        api_key: Optional[str],
+        domain: Optional[str],
+        sender: str,
+        window: float = 0.5,
+        max_batch_size: int = MAX_BATCH_SIZE,
+        max_concurrency: int = 4,
+        timeout: float = 10,
+        api_url: str = MAILGUN_API_URL,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+        breaker: Optional[CircuitBreaker] = None
+    ) -> None:
+        self.api_key = api_key
+        self.domain = domain
+        self.sender = sender
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.api_url = api_url
+        self.transport = transport
+        self.breaker = breaker
+        self.pending: Dict[EmailTemplate, List[Recipient]] = {}
+        self._client: Optional[AsyncClient] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._flush_task: Optional[asyncio.Task] = None
+
+    @property
+    def client(self) -> AsyncClient:
+        if self._client is None:
+            # One pooled client for every batch instead of a connection per email
+            self._client = AsyncClient(
+                auth=("api", self.api_key or ""),
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=self.max_concurrency),
+                transport=self.transport
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        return self._client
+
+    async def send(self, template: EmailTemplate, to: str, **variables: Any) -> httpx.Response:
+        future = asyncio.get_running_loop().create_future()
+        recipients = self.pending.setdefault(template, [])
+        recipients.append((to, variables, future))
+
+        if len(recipients) >= self.max_batch_size:
+            await self.flush()
+        elif self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+        return await future
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(self.window)
+        self._flush_task = None
+        await self.flush()
+
+    async def flush(self) -> None:
+        pending, self.pending = self.pending, {}
+        batches = [
+            (template, batch)
+            for template, recipients in pending.items()
+            for batch in self._batches(recipients)
+        ]
+        await asyncio.gather(*(self._send_batch(template, batch) for template, batch in batches))
+
+    def _batches(self, recipients: List[Recipient]) -> List[List[Recipient]]:
+        # Recipient variables are keyed by address, so an address that is
+        # already in a batch starts a new one
+        batches, batch, addresses = [], [], set()
+        for recipient in recipients:
+            if len(batch) >= self.max_batch_size or recipient[0] in addresses:
+                batches.append(batch)
+                batch, addresses = [], set()
+
+            batch.append(recipient)
+            addresses.add(recipient[0])
+
+        if batch:
+            batches.append(batch)
+
+        return batches
+
+    async def _send_batch(self, template: EmailTemplate, batch: List[Recipient]) -> None:
+        client = self.client
+        logger.debug(f"Sending '{template.subject[:20]}' to {len(batch)} recipients")
+        try:
+            async with self._semaphore:
+                with self.breaker.guard() if self.breaker else nullcontext(self.timeout) as timeout:
+                    response = await client.post(
+                        f"{self.api_url}/{self.domain}/messages",
+                        data={
+                            "from": self.sender,
+                            "to": [to for to, _, _ in batch],
+                            "subject": template.subject,
+                            "text": template.batch_text,
+                            "recipient-variables": json.dumps({to: variables for to, variables, _ in batch})
+                        },
+                        timeout=timeout
+                    )
+
+                    response.raise_for_status()
+
+        except Exception as exception:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(exception)
+            return
+
+        for _, _, future in batch:
+            if not future.done():
+                future.set_result(response)
+
+    async def aclose(self) -> None:
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+
+        await self.flush()
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
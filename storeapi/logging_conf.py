@@ -1,15 +1,19 @@
 import logging
+from functools import lru_cache
 from logging.config import dictConfig
 from storeapi.config import DevConfig, config
 
-handlers = ["default", "rotating_file"]
-if isinstance(config, DevConfig):
-    handlers = ["default", "rotating_file", "logtail"]
+OBFUSCATION_CACHE_SIZE = 1024
 
+@lru_cache(maxsize=OBFUSCATION_CACHE_SIZE)
 def obfuscated(email: str, obfuscated_length: int) -> str:
-    characters = email[:obfuscated_length]
-    first, last = email.split("@")
-    return characters + ("*" * (len(first) - obfuscated_length)) + "@" + last
+    first, separator, last = email.rpartition("@")
+    if not separator:
+        # Not an email address, mask everything but the visible prefix
+        first, last = email, ""
+
+    characters = first[:obfuscated_length]
+    return characters + ("*" * (len(first) - len(characters))) + separator + last
 
 class EmailObfuscationFilter(logging.Filter):
     def __init__(self, name: str = "", obfuscated_length: int = 2) -> None:
@@ -17,12 +21,20 @@ class EmailObfuscationFilter(logging.Filter):
         self.obfuscated_length = obfuscated_length
 
     def filter(self, record: logging.LogRecord) -> bool:
-        if "email" in record.__dict__:
-            record.email = obfuscated(record.email, self.obfuscated_length)
+        # The same record goes through every handler, only mask it the first time
+        if "email" in record.__dict__ and not record.__dict__.get("_email_obfuscated"):
+            email = record.email if isinstance(record.email, str) else str(record.email)
+            record.email = obfuscated(email, self.obfuscated_length)
+            record._email_obfuscated = True
 
         return True
 
 def configure_logging() -> None:
+    is_dev = isinstance(config.resolve(), DevConfig)
+    handlers = ["default", "rotating_file"]
+    if is_dev:
+        handlers = ["default", "rotating_file", "logtail"]
+
     dictConfig(
         {
             "version": 1,
@@ -30,12 +42,12 @@ def configure_logging() -> None:
             "filters": {
                 "correlation_id":{
                     "()": "asgi_correlation_id.CorrelationIdFilter",
-                    "uuid_length": 8 if isinstance(config, DevConfig) else 32,
+                    "uuid_length": 8 if is_dev else 32,
                     "default_value": "-"
                 },
                 "email_obfuscation": {
                     "()": EmailObfuscationFilter,
-                    "obfuscated_length": 2 if isinstance(config, DevConfig) else 0
+                    "obfuscated_length": 2 if is_dev else 0
                 }
             },
             "formatters": {
@@ -85,7 +97,7 @@ def configure_logging() -> None:
                 },
                 "storeapi": {
                     "handlers": handlers,
-                    "level": "DEBUG" if isinstance(config, DevConfig) else "INFO",
+                    "level": "DEBUG" if is_dev else "INFO",
                     "propagate": False
                 },
                 "databases": {
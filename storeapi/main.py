@@ -1,15 +1,28 @@
+import asyncio
 import logging
 import sentry_sdk
 from contextlib import asynccontextmanager
 from asgi_correlation_id import CorrelationIdMiddleware
-from fastapi import FastAPI, HTTPException
+from fastapi import Depends, FastAPI, HTTPException
 from fastapi.exception_handlers import http_exception_handler
+from starlette.types import ASGIApp
 from storeapi.routers.post import router as post_router
 from storeapi.routers.user import router as user_router
-from storeapi.routers.upload import router as upload_router
+from storeapi.routers.upload import router as upload_router, sweep_upload_sessions_periodically
+from storeapi.routers.export import router as export_router
+from storeapi.routers.feed import router as feed_router
 from storeapi.database import database
 from storeapi.logging_conf import configure_logging
-from storeapi.config import config
+from storeapi.config import config, rebuild_runtime_settings
+from storeapi.circuitbreaker import breakers
+from storeapi.querystats import get_query_stats
+from storeapi.compression import CompressionMiddleware
+from storeapi.idempotency import IdempotencyMiddleware, get_idempotency_store
+from storeapi.responses import TimedJSONResponse
+from storeapi.security import require_metrics_token
+from storeapi.timing import ServerTimingMiddleware
+from storeapi.libs.b2 import b2_breaker
+from storeapi.tasks import get_deepai_breaker, get_email_dispatcher, get_mailgun_breaker
 
 def configure_sentry() -> None:
     sentry_sdk.init(
@@ -24,15 +37,50 @@ logger = logging.getLogger(__name__)
 async def lifespan(app: FastAPI):
     configure_sentry()
     configure_logging()
+    rebuild_runtime_settings()
     await database.connect()
+    sweeper = asyncio.create_task(sweep_upload_sessions_periodically(config.UPLOAD_SWEEP_INTERVAL))
     yield
+    sweeper.cancel()
+    await get_email_dispatcher().aclose()
     await database.disconnect()
 
-app = FastAPI(lifespan=lifespan)
+# Starlette builds the middleware stack on startup, so these read the config
+# then rather than at import
+def idempotency_middleware(app: ASGIApp) -> ASGIApp:
+    return IdempotencyMiddleware(
+        app,
+        store=get_idempotency_store(),
+        paths=["/post", "/comment", "/like", "/upload"],
+        wait_timeout=config.IDEMPOTENCY_WAIT_TIMEOUT
+    )
+
+def server_timing_middleware(app: ASGIApp) -> ASGIApp:
+    return ServerTimingMiddleware(app) if config.SERVER_TIMING_ENABLED else app
+
+def compression_middleware(app: ASGIApp) -> ASGIApp:
+    return CompressionMiddleware(
+        app,
+        minimum_size=config.COMPRESSION_MINIMUM_SIZE,
+        offload_size=config.COMPRESSION_OFFLOAD_SIZE,
+        gzip_level=config.COMPRESSION_GZIP_LEVEL,
+        brotli_quality=config.COMPRESSION_BROTLI_QUALITY,
+        zstd_level=config.COMPRESSION_ZSTD_LEVEL
+    )
+
+app = FastAPI(lifespan=lifespan, default_response_class=TimedJSONResponse)
+# Replays skip the routes, so this sits inside the correlation id and
+# compression middlewares and stores plain bodies
+app.add_middleware(idempotency_middleware)
+# Inside the correlation id middleware so the timing log line carries it
+app.add_middleware(server_timing_middleware)
 app.add_middleware(CorrelationIdMiddleware)
+app.add_middleware(compression_middleware)
 app.include_router(post_router)
 app.include_router(user_router)
 app.include_router(upload_router)
+app.include_router(export_router)
+app.include_router(feed_router)
 
 @app.exception_handler(HTTPException)
 async def http_exception_handle_logging(request, exec):
@@ -43,6 +91,18 @@ async def http_exception_handle_logging(request, exec):
 async def root():
     return {"message": "Hello, world!"}
 
+@app.get("/metrics/circuit-breakers", dependencies=[Depends(require_metrics_token)])
+async def circuit_breaker_metrics():
+    # Breakers are created on first use, list the unused ones too
+    for get_breaker in (get_mailgun_breaker, get_deepai_breaker, b2_breaker):
+        get_breaker()
+
+    return {name: breaker.metrics() for name, breaker in breakers.items()}
+
+@app.get("/metrics/queries", dependencies=[Depends(require_metrics_token)])
+async def query_metrics():
+    return get_query_stats().metrics()
+
 @app.get("/sentry-debug")
 async def trigger_error():
     division_by_zero = 1/0
@@ -0,0 +1,80 @@
+import logging
+import sqlalchemy
+from typing import List, Optional
+from sqlalchemy.schema import CreateColumn
+from storeapi.database import comment_table, get_engine, like_table, metadata, post_table
+
+logger = logging.getLogger(__name__)
+
+def count_for_post(table: sqlalchemy.Table):
+    return (
+        sqlalchemy.select(sqlalchemy.func.count(table.c.id))
+        .where(table.c.post_id == post_table.c.id)
+        .scalar_subquery()
+    )
+
+# Denormalized columns are filled from their source tables when added to an
+# existing database, otherwise old rows would keep the server default
+backfills = {
+    "posts.like_count": post_table.update().values(like_count=count_for_post(like_table)),
+    "posts.comment_count": post_table.update().values(comment_count=count_for_post(comment_table))
+}
+
+# Rows that would break a new unique index are cleaned up before it is
+# created, keeping the oldest like of each user and post
+duplicate_likes = like_table.delete().where(
+    like_table.c.id.not_in(
+        sqlalchemy.select(sqlalchemy.func.min(like_table.c.id)).group_by(like_table.c.post_id, like_table.c.user_id)
+    )
+)
+index_preparations = {
+    "ix_likes_post_id_user_id": [duplicate_likes, backfills["posts.like_count"]]
+}
+
+def migrate(engine: Optional[sqlalchemy.engine.Engine] = None) -> List[str]:
+    # Creates missing tables, then adds columns and indexes that were added
+    # to `metadata` after a table was first created. Returns what was applied.
+    engine = engine or get_engine()
+    applied = []
+    pending_backfills = []
+    with engine.begin() as connection:
+        inspector = sqlalchemy.inspect(connection)
+        existing_tables = set(inspector.get_table_names())
+        for table in metadata.sorted_tables:
+            if table.name not in existing_tables:
+                table.create(connection)
+                applied.append(f"create table {table.name}")
+                continue
+
+            existing_columns = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing_columns:
+                    column_ddl = CreateColumn(column).compile(dialect=connection.dialect)
+                    connection.execute(sqlalchemy.text(f"ALTER TABLE {table.name} ADD COLUMN {column_ddl}"))
+                    applied.append(f"add column {table.name}.{column.name}")
+                    if f"{table.name}.{column.name}" in backfills:
+                        pending_backfills.append(f"{table.name}.{column.name}")
+
+            existing_indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing_indexes:
+                    if index.name in index_preparations:
+                        for statement in index_preparations[index.name]:
+                            connection.execute(statement)
+                        applied.append(f"prepare index {index.name}")
+                    index.create(connection)
+                    applied.append(f"create index {index.name}")
+
+        # Source tables may only have been created further down the loop
+        for column in pending_backfills:
+            connection.execute(backfills[column])
+            applied.append(f"backfill {column}")
+
+    for step in applied:
+        logger.info(f"Migration applied: {step}")
+
+    return applied
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    migrate()
@@ -16,6 +16,7 @@ class UserPostWithLikes(UserPost):
     model_config = ConfigDict(from_attributes=True)
 
     likes: int
+    liked_by_me: bool = False
 
 class CommentIn(BaseModel):
     body: str
@@ -30,6 +31,8 @@ class Comment(CommentIn):
 class UserPostWithComments(BaseModel):
     post: UserPostWithLikes
     comments: List[Comment]
+    comment_count: int
+    next_cursor: Optional[int] = None
 
 class PostLikeIn(BaseModel):
     post_id: int
@@ -37,3 +40,7 @@ class PostLikeIn(BaseModel):
 class PostLike(PostLikeIn):
     id: int
     user_id: int
+
+class PostLikeToggle(PostLikeIn):
+    liked: bool
+    likes: int
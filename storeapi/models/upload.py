@@ -0,0 +1,38 @@
+from typing import Optional
+from pydantic import BaseModel, Field
+from pydantic.types import List
+
+class UploadSessionIn(BaseModel):
+    file_name: str = Field(min_length=1, max_length=1024)
+    size: int = Field(gt=0)
+    content_type: str = "b2/x-auto"
+
+class UploadSession(UploadSessionIn):
+    id: str
+    part_size: int
+    offset: int
+    parts: List[int]
+    file_url: Optional[str] = None
+    expires_at: float
+
+class UploadPart(BaseModel):
+    part_number: int
+    size: int
+    sha1: str
+    offset: int
+
+class UploadSessionComplete(BaseModel):
+    checksum: str
+
+class UploadAuthorizationIn(BaseModel):
+    file_name: str = Field(min_length=1, max_length=255)
+
+class UploadAuthorization(BaseModel):
+    id: str
+    file_name: str
+    upload_url: str
+    authorization_token: str
+    expires_at: float
+
+class UploadAuthorizationComplete(BaseModel):
+    file_id: str
@@ -0,0 +1,64 @@
+import asyncio
+import logging
+import sqlalchemy
+from contextlib import asynccontextmanager
+from typing import Any, AsyncGenerator, List, Tuple
+from storeapi.config import config
+from storeapi.database import CachedQuery, database
+
+logger = logging.getLogger(__name__)
+
+QUERY_CANCELED = "57014"
+
+class QueryTimeoutError(Exception):
+    pass
+
+class ResultTooLargeError(Exception):
+    def __init__(self, max_rows: int) -> None:
+        super().__init__(f"Result has more than {max_rows} rows")
+        self.max_rows = max_rows
+
+def is_query_canceled(error: Exception) -> bool:
+    # asyncpg raises QueryCanceledError, SQLAlchemy wraps it and keeps the code
+    return QUERY_CANCELED in (getattr(error, "sqlstate", None), getattr(getattr(error, "orig", None), "sqlstate", None))
+
+@asynccontextmanager
+async def statement_timeout(seconds: float) -> AsyncGenerator[None, None]:
+    # On PostgreSQL the server cancels the statement, so the pooled connection
+    # is released as soon as the limit is hit. Other databases can't cancel a
+    # running query, the request just stops waiting for it.
+    if config.DATABASE_URL.startswith("postgresql"):
+        try:
+            async with database.transaction():
+                await database.execute(sqlalchemy.text(f"SET LOCAL statement_timeout = {int(seconds * 1000)}"))
+                yield
+        except Exception as e:
+            if is_query_canceled(e):
+                raise QueryTimeoutError() from e
+            raise
+    else:
+        try:
+            async with asyncio.timeout(seconds):
+                yield
+        except TimeoutError as e:
+            raise QueryTimeoutError() from e
+
+async def fetch_all_limited(query: CachedQuery, max_rows: int, timeout: float, **values: Any) -> List[Any]:
+    # `query` must take a `limit` bind parameter; one extra row is fetched to
+    # tell a full page from a result that is over the cap
+    async with statement_timeout(timeout):
+        records = await database.fetch_all(query.bind(limit=max_rows + 1, **values))
+
+    if len(records) > max_rows:
+        logger.warning(f"Query returned more than {max_rows} rows")
+        raise ResultTooLargeError(max_rows)
+
+    return records
+
+async def fetch_page(query: CachedQuery, page_size: int, timeout: float, **values: Any) -> Tuple[List[Any], bool]:
+    # Like fetch_all_limited, but a result past `page_size` is the start of
+    # the next page rather than an error. Returns the page and whether more follow.
+    async with statement_timeout(timeout):
+        records = await database.fetch_all(query.bind(limit=page_size + 1, **values))
+
+    return records[:page_size], len(records) > page_size
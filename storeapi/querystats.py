@@ -0,0 +1,168 @@
+import logging
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional
+from sqlalchemy.sql import ClauseElement
+from storeapi.config import config
+from storeapi.sqlalchemy_database import to_statement
+
+logger = logging.getLogger(__name__)
+
+# Values of these types are safe to log as they are, anything else (emails,
+# password hashes, post bodies, ...) is replaced by its type name
+SHOWN_TYPES = (bool, int, float)
+
+def redact(params: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        name: value if value is None or isinstance(value, SHOWN_TYPES) else f"<{type(value).__name__}>"
+        for name, value in params.items()
+    }
+
+def shape_key(statement: ClauseElement) -> Hashable:
+    # SQLAlchemy's cache key leaves the bound values out, so every call of a
+    # statement with different values lands on the same shape
+    cache_key = statement._generate_cache_key()
+    return str(statement) if cache_key is None else cache_key.key
+
+def explain_prefix(database_url: str) -> Optional[str]:
+    if database_url.startswith("postgresql"):
+        return "EXPLAIN"
+    if database_url.startswith("sqlite"):
+        return "EXPLAIN QUERY PLAN"
+    return None
+
+def is_explainable(statement: ClauseElement) -> bool:
+    if getattr(statement, "is_select", False) or getattr(statement, "is_dml", False):
+        return True
+
+    # text() queries don't say what they are
+    return getattr(statement, "text", "").lstrip()[:6].upper() == "SELECT"
+
+class ShapeStats:
+    __slots__ = ("sql", "calls", "errors", "slow", "rows", "total", "max", "plan", "planned_at")
+
+    def __init__(self, sql: str) -> None:
+        self.sql = sql
+        self.calls = 0
+        self.errors = 0
+        self.slow = 0
+        self.rows = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.plan: Optional[str] = None
+        self.planned_at: Optional[float] = None
+
+    def metrics(self) -> Dict:
+        return {
+            "sql": self.sql,
+            "calls": self.calls,
+            "errors": self.errors,
+            "slow": self.slow,
+            "rows": self.rows,
+            "total_ms": round(self.total * 1000, 3),
+            "mean_ms": round(self.total * 1000 / self.calls, 3) if self.calls else 0.0,
+            "max_ms": round(self.max * 1000, 3),
+            "plan": self.plan
+        }
+
+class SlowQuery:
+    def __init__(self, stats: ShapeStats, statement: ClauseElement, values: Dict[str, Any], duration: float, rows: Optional[int]) -> None:
+        self.stats = stats
+        self.statement = statement
+        self.values = values
+        self.duration = duration
+        self.rows = rows
+
+class QueryStats:
+    # Aggregates every query by shape (the SQL without its values). Queries
+    # slower than `slow_threshold` are logged, and the plan of a slow shape is
+    # captured at most once per `plan_interval` seconds. Only the `max_shapes`
+    # most recently seen shapes are kept.
+    def __init__(
+        self,
+        slow_threshold: float,
+        plan_interval: float = 300,
+        max_shapes: int = 1000,
+        clock: Callable[[], float] = time.monotonic
+    ) -> None:
+        self.slow_threshold = slow_threshold
+        self.plan_interval = plan_interval
+        self.max_shapes = max_shapes
+        self.clock = clock
+        self.shapes: "OrderedDict[Hashable, ShapeStats]" = OrderedDict()
+
+    def shape(self, statement: ClauseElement) -> ShapeStats:
+        key = shape_key(statement)
+        stats = self.shapes.get(key)
+        if stats is None:
+            stats = self.shapes[key] = ShapeStats(" ".join(str(statement).split()))
+            if len(self.shapes) > self.max_shapes:
+                self.shapes.popitem(last=False)
+        else:
+            self.shapes.move_to_end(key)
+
+        return stats
+
+    def record(self, query: Any, values: Optional[Dict[str, Any]], duration: float, rows: Optional[int], failed: bool = False) -> Optional[SlowQuery]:
+        statement, values = to_statement(query, values)
+        stats = self.shape(statement)
+        stats.calls += 1
+        stats.total += duration
+        stats.max = max(stats.max, duration)
+        if failed:
+            stats.errors += 1
+        elif rows is not None:
+            stats.rows += rows
+
+        if duration < self.slow_threshold:
+            return None
+
+        stats.slow += 1
+        return SlowQuery(stats, statement, values, duration, rows)
+
+    def wants_plan(self, slow: SlowQuery) -> bool:
+        planned_at = slow.stats.planned_at
+        return is_explainable(slow.statement) and (planned_at is None or self.clock() - planned_at >= self.plan_interval)
+
+    async def report(self, slow: SlowQuery, fetch_all: Callable[[str, Dict[str, Any]], Awaitable[List[Any]]], explain: bool = True) -> None:
+        # The statement is rendered with named parameters, which both backends
+        # take back as text together with the values
+        compiled = slow.statement.compile()
+        params = compiled.construct_params(slow.values)
+        prefix = explain_prefix(config.DATABASE_URL)
+        if explain and prefix is not None and self.wants_plan(slow):
+            slow.stats.planned_at = self.clock()
+            try:
+                slow.stats.plan = format_plan(await fetch_all(f"{prefix} {compiled}", params))
+            except Exception as e:
+                logger.debug(f"Could not explain query: {e}")
+
+        duration_ms = round(slow.duration * 1000, 3)
+        logger.warning(
+            f"Slow query ({duration_ms}ms, {slow.rows} rows): {slow.stats.sql}",
+            extra={
+                "sql": slow.stats.sql,
+                "params": redact(params),
+                "duration_ms": duration_ms,
+                "rows": slow.rows,
+                "plan": slow.stats.plan
+            }
+        )
+
+    def metrics(self) -> List[Dict]:
+        # Where the database time goes, most first
+        shapes = sorted(self.shapes.values(), key=lambda stats: stats.total, reverse=True)
+        return [stats.metrics() for stats in shapes]
+
+    def clear(self) -> None:
+        self.shapes.clear()
+
+def format_plan(records: List[Any]) -> str:
+    # PostgreSQL returns one "QUERY PLAN" line per row, SQLite the plan step
+    # in the last column ("detail")
+    return "\n".join(str(list(record._mapping.values())[-1]) for record in records)
+
+@lru_cache()
+def get_query_stats() -> QueryStats:
+    return QueryStats(config.QUERY_SLOW_THRESHOLD, config.QUERY_PLAN_INTERVAL, config.QUERY_STATS_MAX_SHAPES)
@@ -0,0 +1,22 @@
+import math
+from datetime import datetime, UTC
+from typing import Optional
+
+# Trending scores are kept as log2 of sum(2 ** ((liked_at - TRENDING_EPOCH) / half_life)).
+# Every score decays by the same factor as time passes, so the stored values
+# never need rewriting and ordering by them always ranks by decayed likes.
+TRENDING_EPOCH = datetime(2024, 1, 1, tzinfo=UTC).timestamp()
+
+def trending_score(current: Optional[float], liked_at: float, half_life: float) -> float:
+    like = (liked_at - TRENDING_EPOCH) / half_life
+    if current is None:
+        return like
+
+    high, low = max(current, like), min(current, like)
+    return high + math.log2(1 + 2 ** (low - high))
+
+def decayed_likes(score: Optional[float], at: float, half_life: float) -> float:
+    if score is None:
+        return 0.0
+
+    return 2 ** (score - (at - TRENDING_EPOCH) / half_life)
@@ -0,0 +1,99 @@
+import logging
+import math
+import time
+from abc import ABC, abstractmethod
+from functools import lru_cache
+from typing import Annotated, Callable, Dict, NamedTuple, Optional, Tuple
+from fastapi import Depends, HTTPException, Request, status
+from storeapi.config import RATE_LIMIT_PERIODS, check_rate_limit_format, config
+from storeapi.models.user import User
+from storeapi.security import get_current_user
+
+logger = logging.getLogger(__name__)
+
+class RateLimit(NamedTuple):
+    capacity: int
+    period: float
+
+    @property
+    def rate(self) -> float:
+        return self.capacity / self.period
+
+@lru_cache()
+def parse_rate_limit(value: Optional[str]) -> Optional[RateLimit]:
+    # "10/minute" -> bucket of 10 tokens refilled over one minute
+    if not check_rate_limit_format(value):
+        return None
+
+    capacity, _, period = value.partition("/")
+    return RateLimit(int(capacity), RATE_LIMIT_PERIODS[period.strip() or "second"])
+
+class RateLimitStore(ABC):
+    @abstractmethod
+    async def hit(self, key: str, limit: RateLimit) -> float:
+        # Takes a token from the bucket and returns 0, or the seconds to wait
+        ...
+
+class MemoryRateLimitStore(RateLimitStore):
+    def __init__(self, clock: Callable[[], float] = time.monotonic, sweep_interval: float = 60) -> None:
+        self.clock = clock
+        self.sweep_interval = sweep_interval
+        self.next_sweep = clock() + sweep_interval
+        # key -> (tokens, updated at, full again at)
+        self.buckets: Dict[str, Tuple[float, float, float]] = {}
+
+    async def hit(self, key: str, limit: RateLimit) -> float:
+        now = self.clock()
+        if now >= self.next_sweep:
+            self.sweep(now)
+
+        bucket = self.buckets.get(key)
+        tokens = limit.capacity if bucket is None else min(limit.capacity, bucket[0] + (now - bucket[1]) * limit.rate)
+        retry_after = 0.0
+        if tokens < 1:
+            retry_after = (1 - tokens) / limit.rate
+        else:
+            tokens -= 1
+
+        self.buckets[key] = (tokens, now, now + (limit.capacity - tokens) / limit.rate)
+        return retry_after
+
+    def sweep(self, now: float) -> None:
+        # Buckets that have refilled completely hold no state worth keeping
+        self.buckets = {key: bucket for key, bucket in self.buckets.items() if bucket[2] > now}
+        self.next_sweep = now + self.sweep_interval
+
+    def clear(self) -> None:
+        self.buckets.clear()
+
+rate_limit_store: RateLimitStore = MemoryRateLimitStore()
+
+def client_ip(request: Request) -> str:
+    return request.client.host if request.client else "unknown"
+
+async def check_rate_limit(name: str, key: str) -> None:
+    limit = parse_rate_limit(getattr(config, f"RATE_LIMIT_{name.upper()}", None))
+    if not config.RATE_LIMIT_ENABLED or limit is None:
+        return
+
+    retry_after = await rate_limit_store.hit(f"{name}:{key}", limit)
+    if retry_after:
+        logger.warning(f"Rate limit exceeded for {name}")
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many requests",
+            headers={"Retry-After": str(math.ceil(retry_after))}
+        )
+
+def limit_by_ip(name: str):
+    async def dependency(request: Request) -> None:
+        await check_rate_limit(name, f"ip:{client_ip(request)}")
+
+    return dependency
+
+def limit_by_user(name: str):
+    # get_current_user is cached per request, so the route reuses the same lookup
+    async def dependency(current_user: Annotated[User, Depends(get_current_user)]) -> None:
+        await check_rate_limit(name, f"user:{current_user.id}")
+
+    return dependency
@@ -0,0 +1,70 @@
+import logging
+import orjson
+import sqlalchemy
+from typing import Annotated, AsyncIterator, Optional
+from fastapi import APIRouter, Depends
+from fastapi.responses import StreamingResponse
+from storeapi.models.user import User
+from storeapi.database import comment_table, post_table, database
+from storeapi.security import get_current_user
+
+router = APIRouter()
+logger = logging.getLogger(__name__)
+
+# One row per (post, comment), ordered by post so each post can be written
+# as soon as its last comment has been read. The likes come from the
+# like_count column rather than being counted for every row.
+select_posts_with_comments = (
+    sqlalchemy.select(
+        post_table,
+        comment_table.c.id.label("comment_id"),
+        comment_table.c.body.label("comment_body"),
+        comment_table.c.user_id.label("comment_user_id")
+    )
+    .select_from(post_table.outerjoin(comment_table))
+    .order_by(post_table.c.id, comment_table.c.id)
+)
+
+def export_query(min_id: Optional[int], max_id: Optional[int], user_id: Optional[int]):
+    query = select_posts_with_comments
+    if min_id is not None:
+        query = query.where(post_table.c.id >= min_id)
+
+    if max_id is not None:
+        query = query.where(post_table.c.id <= max_id)
+
+    if user_id is not None:
+        query = query.where(post_table.c.user_id == user_id)
+
+    return query
+
+def export_line(post: dict, comments: list) -> bytes:
+    return orjson.dumps({"post": post, "comments": comments}) + b"\n"
+
+async def export_posts(query) -> AsyncIterator[bytes]:
+    post, comments = None, []
+    async for row in database.iterate(query):
+        if post is None or post["id"] != row.id:
+            if post is not None:
+                yield export_line(post, comments)
+
+            post = {"id": row.id, "body": row.body, "user_id": row.user_id, "image_url": row.image_url, "likes": row.like_count}
+            comments = []
+
+        if row.comment_id is not None:
+            comments.append({"id": row.comment_id, "body": row.comment_body, "post_id": row.id, "user_id": row.comment_user_id})
+
+    if post is not None:
+        yield export_line(post, comments)
+
+@router.get("/export/posts")
+async def export(
+    current_user: Annotated[User, Depends(get_current_user)],
+    min_id: Optional[int] = None,
+    max_id: Optional[int] = None,
+    user_id: Optional[int] = None
+):
+    logger.info("Exporting posts")
+    query = export_query(min_id, max_id, user_id)
+    logger.debug(query)
+    return StreamingResponse(export_posts(query), media_type="application/x-ndjson")
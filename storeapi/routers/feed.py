@@ -0,0 +1,70 @@
+import asyncio
+import logging
+import orjson
+from typing import AsyncIterator
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, status
+from fastapi.responses import StreamingResponse
+from storeapi.config import config
+from storeapi.feed import FeedHub, Subscription, get_feed_hub
+
+router = APIRouter()
+logger = logging.getLogger(__name__)
+
+async def sse_events(hub: FeedHub, subscription: Subscription, keepalive: float) -> AsyncIterator[bytes]:
+    try:
+        while True:
+            try:
+                event = await subscription.get(timeout=keepalive)
+            except asyncio.TimeoutError:
+                yield b": keepalive\n\n"
+                continue
+
+            if event is None:
+                yield b"event: evicted\ndata: {}\n\n"
+                return
+
+            yield b"event: " + event["type"].encode() + b"\ndata: " + orjson.dumps(event) + b"\n\n"
+    finally:
+        hub.unsubscribe(subscription)
+
+@router.get("/feed/events")
+async def feed_events():
+    logger.info("Opening feed event stream")
+    feed_hub = get_feed_hub()
+    subscription = feed_hub.subscribe()
+    return StreamingResponse(
+        sse_events(feed_hub, subscription, config.FEED_KEEPALIVE),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+async def wait_for_disconnect(websocket: WebSocket) -> None:
+    while (await websocket.receive())["type"] != "websocket.disconnect":
+        pass
+
+@router.websocket("/feed/ws")
+async def feed_websocket(websocket: WebSocket):
+    await websocket.accept()
+    logger.info("Opening feed websocket")
+    feed_hub = get_feed_hub()
+    subscription = feed_hub.subscribe()
+    disconnected = asyncio.create_task(wait_for_disconnect(websocket))
+    try:
+        while True:
+            next_event = asyncio.create_task(subscription.get())
+            await asyncio.wait({next_event, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+            if disconnected.done():
+                next_event.cancel()
+                return
+
+            event = next_event.result()
+            if event is None:
+                await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER, reason="Subscriber too slow")
+                return
+
+            await websocket.send_text(orjson.dumps(event).decode())
+    except WebSocketDisconnect:
+        pass
+    finally:
+        disconnected.cancel()
+        feed_hub.unsubscribe(subscription)
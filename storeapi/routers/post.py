@@ -1,51 +1,164 @@
 import logging
+import time
 import sqlalchemy
+from contextlib import contextmanager
 from enum import Enum
-from typing import Annotated
+from typing import Annotated, Any, Iterable, NamedTuple, Optional, Set
 from pydantic.types import List
-from fastapi import APIRouter, BackgroundTasks, HTTPException, Request, status, Depends
-from storeapi.models.post import Comment, CommentIn, UserPost, UserPostIn, PostLike, PostLikeIn, UserPostWithLikes
+from fastapi import APIRouter, BackgroundTasks, HTTPException, Query, Request, Response, status, Depends
+from sqlalchemy.dialects import postgresql, sqlite
+from storeapi.models.post import Comment, CommentIn, UserPost, UserPostIn, PostLike, PostLikeIn, PostLikeToggle, UserPostWithComments, UserPostWithLikes
 from storeapi.models.user import User
-from storeapi.database import like_table, post_table, comment_table, database
-from storeapi.security import get_current_user
+from storeapi.config import config
+from storeapi.ranking import trending_score
+from storeapi.responses import RecordsJSONResponse
+from storeapi.database import CachedQuery, like_table, post_table, comment_table, database
+from storeapi.feed import get_feed_hub
+from storeapi.querylimits import QueryTimeoutError, ResultTooLargeError, fetch_all_limited, fetch_page
+from storeapi.security import get_current_user, get_optional_current_user
+from storeapi.ratelimit import limit_by_user
 from storeapi.tasks import generate_and_add_to_post
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
-select_post_likes = (
-    sqlalchemy.select(post_table, sqlalchemy.func.count(like_table.c.id).label("likes"))
-    .select_from(post_table.outerjoin(like_table))
-    .group_by(post_table.c.id)
-)
+# Every listing reads the like count kept on the post row, so none of them
+# joins likes and the sorted ones walk an index
+select_post_likes = sqlalchemy.select(post_table, post_table.c.like_count.label("likes"))
 
 class PostSorting(str, Enum):
     new = "new"
     old = "old"
     most_likes = "most_likes"
+    trending = "trending"
+
+class CommentSorting(str, Enum):
+    new = "new"
+    old = "old"
+
+# Listings take a `limit` so the result size cap is enforced by the database
+row_limit = sqlalchemy.bindparam("limit", type_=sqlalchemy.Integer)
+
+select_sorted_post_likes = {
+    PostSorting.new: CachedQuery(select_post_likes.order_by(post_table.c.id.desc()).limit(row_limit)),
+    PostSorting.old: CachedQuery(select_post_likes.order_by(post_table.c.id.asc()).limit(row_limit)),
+    PostSorting.most_likes: CachedQuery(select_post_likes.order_by(post_table.c.like_count.desc(), post_table.c.id.desc()).limit(row_limit)),
+    PostSorting.trending: CachedQuery(select_post_likes.order_by(post_table.c.trending_score.desc(), post_table.c.id.desc()).limit(row_limit))
+}
+select_post_likes_by_id = CachedQuery(select_post_likes.where(post_table.c.id == sqlalchemy.bindparam("post_id")))
+select_post = CachedQuery(post_table.select().where(post_table.c.id == sqlalchemy.bindparam("post_id")))
+select_post_for_update = CachedQuery(
+    post_table.select().where(post_table.c.id == sqlalchemy.bindparam("post_id")).with_for_update()
+)
+update_post_like_stats = CachedQuery(
+    post_table.update()
+    .where(post_table.c.id == sqlalchemy.bindparam("post_id"))
+    .values(like_count=post_table.c.like_count + 1, trending_score=sqlalchemy.bindparam("score"))
+)
+decrement_post_like_count = CachedQuery(
+    post_table.update()
+    .where(post_table.c.id == sqlalchemy.bindparam("post_id"))
+    .values(like_count=post_table.c.like_count - 1)
+)
+increment_post_comment_count = CachedQuery(
+    post_table.update()
+    .where(post_table.c.id == sqlalchemy.bindparam("post_id"))
+    .values(comment_count=post_table.c.comment_count + 1)
+)
+
+# Keyset pages over the (post_id, id) index, keyed by sorting and whether
+# the request continues after a cursor
+select_post_comments = comment_table.select().where(comment_table.c.post_id == sqlalchemy.bindparam("post_id"))
+after_comment = sqlalchemy.bindparam("after", type_=sqlalchemy.Integer)
+select_post_comment_pages = {
+    (CommentSorting.new, False): CachedQuery(select_post_comments.order_by(comment_table.c.id.desc()).limit(row_limit)),
+    (CommentSorting.new, True): CachedQuery(select_post_comments.where(comment_table.c.id < after_comment).order_by(comment_table.c.id.desc()).limit(row_limit)),
+    (CommentSorting.old, False): CachedQuery(select_post_comments.order_by(comment_table.c.id.asc()).limit(row_limit)),
+    (CommentSorting.old, True): CachedQuery(select_post_comments.where(comment_table.c.id > after_comment).order_by(comment_table.c.id.asc()).limit(row_limit))
+}
+
+# One author's posts, newest first, read through the (user_id, id) index so
+# only the posts on the page are joined with their likes
+select_user_post_likes = select_post_likes.where(post_table.c.user_id == sqlalchemy.bindparam("user_id"))
+after_post = sqlalchemy.bindparam("after", type_=sqlalchemy.Integer)
+select_user_post_pages = {
+    False: CachedQuery(select_user_post_likes.order_by(post_table.c.id.desc()).limit(row_limit)),
+    True: CachedQuery(select_user_post_likes.where(post_table.c.id < after_post).order_by(post_table.c.id.desc()).limit(row_limit))
+}
+
+# A user likes a post at most once, enforced by the unique (post_id, user_id)
+# index. change_like checks under the post's row lock, but SQLite has no row
+# locks, so the insert also skips a like that is already there on the
+# dialects that have ON CONFLICT. The dialect is the one the query runs on.
+like_key = (like_table.c.post_id == sqlalchemy.bindparam("post_id")) & (like_table.c.user_id == sqlalchemy.bindparam("user_id"))
+like_values = {"post_id": sqlalchemy.bindparam("post_id"), "user_id": sqlalchemy.bindparam("user_id")}
+like_conflict = [like_table.c.post_id, like_table.c.user_id]
+select_like = CachedQuery(like_table.select().where(like_key))
+insert_like = CachedQuery(
+    like_table.insert().values(like_values),
+    {
+        "postgresql": postgresql.insert(like_table).values(like_values).on_conflict_do_nothing(index_elements=like_conflict),
+        "sqlite": sqlite.insert(like_table).values(like_values).on_conflict_do_nothing(index_elements=like_conflict)
+    }
+)
+delete_like = CachedQuery(like_table.delete().where(like_key))
+
+class LikeChange(NamedTuple):
+    like: Optional[Any]
+    likes: int
+    changed: bool
+
+def page_size(limit: Optional[int], default: int, maximum: int, items: str) -> int:
+    limit = limit or default
+    if limit > maximum:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Pages can't have more than {maximum} {items}"
+        )
+
+    return limit
+
+@contextmanager
+def query_limit_errors():
+    try:
+        yield
+    except QueryTimeoutError:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="The query took too long, please try again later"
+        )
+    except ResultTooLargeError as e:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"The result has more than {e.max_rows} rows"
+        )
+
+async def find_liked_post_ids(user: Optional[User], post_ids: Iterable[int]) -> Set[int]:
+    # One lookup for a whole page instead of one per post. The IN list is
+    # expanded per call, so this statement can't be a CachedQuery.
+    post_ids = list(post_ids)
+    if user is None or not post_ids:
+        return set()
+
+    query = sqlalchemy.select(like_table.c.post_id).where(like_table.c.user_id == user.id, like_table.c.post_id.in_(post_ids))
+    return {record.post_id for record in await database.fetch_all(query)}
 
 async def find_post(post_id: int):
     logger.info(f"Finding post with id {post_id}")
-    query = post_table.select().where(post_table.c.id == post_id)
+    query = select_post.bind(post_id=post_id)
     logger.debug(query, extra={"email": "wesley@fullstacklabs.co"})
     return await database.fetch_one(query)
 
 @router.get("/post", response_model=List[UserPostWithLikes])
-async def get_posts(sorting: PostSorting = PostSorting.new):
+async def get_posts(current_user: Annotated[Optional[User], Depends(get_optional_current_user)], sorting: PostSorting = PostSorting.new):
     logger.info("Getting all the posts")
-
-    match sorting:
-        case PostSorting.new:
-            query = select_post_likes.order_by(post_table.c.id.desc())
-
-        case PostSorting.old:
-            query = select_post_likes.order_by(post_table.c.id.asc())
-
-        case PostSorting.most_likes:
-            query = select_post_likes.order_by(sqlalchemy.desc("likes"))        
-    
+    query = select_sorted_post_likes[sorting]
     logger.debug(query)
-    return await database.fetch_all(query)
+    with query_limit_errors():
+        posts = await fetch_all_limited(query, config.POSTS_MAX_RESULTS, config.POSTS_QUERY_TIMEOUT)
+
+    liked = await find_liked_post_ids(current_user, (post.id for post in posts))
+    return RecordsJSONResponse(posts, model=UserPostWithLikes, computed={"liked_by_me": lambda post: post.id in liked})
 
 @router.post("/post", response_model=UserPost, status_code=status.HTTP_201_CREATED)
 async def create_post(post: UserPostIn, current_user: Annotated[User, Depends(get_current_user)], background_tasks: BackgroundTasks, request: Request, prompt: str = None):
@@ -56,27 +169,69 @@ async def create_post(post: UserPostIn, current_user: Annotated[User, Depends(ge
     last_record_id = await database.execute(query)
     if prompt:
         background_tasks.add_task(generate_and_add_to_post, current_user.email, last_record_id, request.url_for("get_post_comments", post_id=last_record_id), database, prompt)
-    return {**data, "id": last_record_id}
 
-@router.get("/post/{post_id}", response_model=UserPostWithLikes)
-async def get_post_comments(post_id: int):
+    post = {**data, "id": last_record_id, "image_url": None}
+    await get_feed_hub().publish("post_created", post=post)
+    return post
+
+@router.get("/post/{post_id}", response_model=UserPostWithComments)
+async def get_post_comments(post_id: int, current_user: Annotated[Optional[User], Depends(get_optional_current_user)]):
     logger.info(f"Getting the comments of a post with id {post_id}")
-    query = select_post_likes.where(post_table.c.id == post_id)
+    query = select_post_likes_by_id.bind(post_id=post_id)
     logger.debug(query)
     post = await database.fetch_one(query)
     if not post:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Post not found")
     
+    comments, next_cursor = await find_post_comments(post_id)
+    liked = await find_liked_post_ids(current_user, [post_id])
     return {
-        "post": post,
-        "comments": await get_post_comment(post_id)
+        "post": {**post._mapping, "liked_by_me": post_id in liked},
+        "comments": comments,
+        "comment_count": post.comment_count,
+        "next_cursor": next_cursor
     }
 
+async def find_post_comments(post_id: int, sorting: CommentSorting = CommentSorting.old, after: Optional[int] = None, limit: Optional[int] = None):
+    # Returns one page of comments and the cursor for the next one, if any
+    limit = page_size(limit, config.COMMENTS_PAGE_SIZE, config.COMMENTS_MAX_RESULTS, "comments")
+    query = select_post_comment_pages[sorting, after is not None]
+    values = {"post_id": post_id} if after is None else {"post_id": post_id, "after": after}
+    logger.debug(query)
+    with query_limit_errors():
+        comments, has_more = await fetch_page(query, limit, config.COMMENTS_QUERY_TIMEOUT, **values)
+
+    return comments, comments[-1].id if has_more else None
+
 @router.get("/post/{post_id}/comment", response_model=List[Comment])
-async def get_post_comment(post_id: int):
-    query = comment_table.select().where(comment_table.c.post_id == post_id)
+async def get_post_comment(
+    post_id: int,
+    sorting: CommentSorting = CommentSorting.old,
+    after: Optional[int] = None,
+    limit: Annotated[Optional[int], Query(ge=1)] = None
+):
+    comments, next_cursor = await find_post_comments(post_id, sorting, after, limit)
+    headers = {"X-Next-Cursor": str(next_cursor)} if next_cursor is not None else None
+    return RecordsJSONResponse(comments, model=Comment, headers=headers)
+
+@router.get("/user/{user_id}/posts", response_model=List[UserPostWithLikes])
+async def get_user_posts(
+    user_id: int,
+    current_user: Annotated[Optional[User], Depends(get_optional_current_user)],
+    after: Optional[int] = None,
+    limit: Annotated[Optional[int], Query(ge=1)] = None
+):
+    logger.info(f"Getting the posts of user {user_id}")
+    limit = page_size(limit, config.POSTS_PAGE_SIZE, config.POSTS_MAX_RESULTS, "posts")
+    query = select_user_post_pages[after is not None]
+    values = {"user_id": user_id} if after is None else {"user_id": user_id, "after": after}
     logger.debug(query)
-    return await database.fetch_all(query)
+    with query_limit_errors():
+        posts, has_more = await fetch_page(query, limit, config.POSTS_QUERY_TIMEOUT, **values)
+
+    headers = {"X-Next-Cursor": str(posts[-1].id)} if has_more else None
+    liked = await find_liked_post_ids(current_user, (post.id for post in posts))
+    return RecordsJSONResponse(posts, model=UserPostWithLikes, computed={"liked_by_me": lambda post: post.id in liked}, headers=headers)
 
 @router.post("/comment", response_model=Comment, status_code=status.HTTP_201_CREATED)
 async def create_comment(comment: CommentIn, current_user: Annotated[User, Depends(get_current_user)]):
@@ -88,18 +243,60 @@ async def create_comment(comment: CommentIn, current_user: Annotated[User, Depen
     data = {**comment.model_dump(), "user_id": current_user.id}
     query = comment_table.insert().values(data)
     logger.debug(query)
-    last_record_id = await database.execute(query)
+    async with database.transaction():
+        last_record_id = await database.execute(query)
+        await database.execute(increment_post_comment_count.bind(post_id=comment.post_id))
+
+    await get_feed_hub().publish("comment_created", comment={**data, "id": last_record_id})
     return {**data, "id": last_record_id}
 
-@router.post("/like", response_model=PostLike, status_code=status.HTTP_201_CREATED)
-async def like_post(like: PostLikeIn, current_user: Annotated[User, Depends(get_current_user)]):
+async def change_like(post_id: int, user: User, liked: Optional[bool]) -> LikeChange:
+    # Sets whether `user` likes the post, or flips it when `liked` is None.
+    # The post row is locked first, so concurrent changes to its likes are
+    # applied one at a time and like_count stays in step with the likes table.
+    values = {"post_id": post_id, "user_id": user.id}
+    async with database.transaction():
+        post = await database.fetch_one(select_post_for_update.bind(post_id=post_id))
+        if not post:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Post not found")
+
+        like = await database.fetch_one(select_like.bind(**values))
+        liked = like is None if liked is None else liked
+        if liked and like is None:
+            await database.execute(insert_like.bind(**values))
+            like = await database.fetch_one(select_like.bind(**values))
+            score = trending_score(post.trending_score, time.time(), config.TRENDING_HALF_LIFE)
+            await database.execute(update_post_like_stats.bind(post_id=post_id, score=score))
+            change = LikeChange(like, post.like_count + 1, True)
+        elif not liked and like is not None:
+            # The trending score keeps the like, it decays away like any other
+            await database.execute(delete_like.bind(**values))
+            await database.execute(decrement_post_like_count.bind(post_id=post_id))
+            change = LikeChange(None, post.like_count - 1, True)
+        else:
+            change = LikeChange(like, post.like_count, False)
+
+    if change.changed:
+        await get_feed_hub().publish("post_liked" if liked else "post_unliked", post_id=post_id, likes=change.likes)
+
+    return change
+
+@router.post("/like", response_model=PostLike, status_code=status.HTTP_201_CREATED, dependencies=[Depends(limit_by_user("like"))])
+async def like_post(like: PostLikeIn, current_user: Annotated[User, Depends(get_current_user)], response: Response):
     logger.info("Liking post")
-    post = await find_post(like.post_id)
-    if not post:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Post not found")
-    
-    data = {**like.model_dump(), "user_id": current_user.id}
-    query = like_table.insert().values(data)
-    logger.debug(query)
-    last_record_id = await database.execute(query)
-    return {**data, "id": last_record_id}
+    change = await change_like(like.post_id, current_user, True)
+    if not change.changed:
+        response.status_code = status.HTTP_200_OK
+
+    return {"id": change.like.id, "post_id": like.post_id, "user_id": current_user.id}
+
+@router.delete("/like/{post_id}", status_code=status.HTTP_204_NO_CONTENT, dependencies=[Depends(limit_by_user("like"))])
+async def unlike_post(post_id: int, current_user: Annotated[User, Depends(get_current_user)]):
+    logger.info("Unliking post")
+    await change_like(post_id, current_user, False)
+
+@router.post("/like/toggle", response_model=PostLikeToggle, dependencies=[Depends(limit_by_user("like"))])
+async def toggle_like(like: PostLikeIn, current_user: Annotated[User, Depends(get_current_user)]):
+    logger.info("Toggling post like")
+    change = await change_like(like.post_id, current_user, None)
+    return {"post_id": like.post_id, "liked": change.like is not None, "likes": change.likes}
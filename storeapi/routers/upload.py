@@ -1,21 +1,37 @@
+import asyncio
+import hashlib
 import logging
+import math
+import pathlib
 import tempfile
+import time
+import uuid
 import aiofiles
-from fastapi import APIRouter, HTTPException, UploadFile, status
-from storeapi.libs.b2 import b2_upload_file
+from types import SimpleNamespace
+from typing import Annotated, Any, Callable, List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Request, UploadFile, status
+from fastapi.concurrency import run_in_threadpool
+from storeapi.circuitbreaker import CircuitOpenError
+from storeapi.config import config
+from storeapi.database import database, upload_authorization_table, upload_part_table, upload_session_table
+from storeapi.libs.b2 import b2_cancel_large_file, b2_finish_large_file, b2_get_upload_authorization, b2_get_uploaded_file, b2_start_large_file, b2_upload_file, b2_upload_part
+from storeapi.models.upload import UploadAuthorization, UploadAuthorizationComplete, UploadAuthorizationIn, UploadPart, UploadSession, UploadSessionComplete, UploadSessionIn
+from storeapi.models.user import User
+from storeapi.ratelimit import limit_by_ip
+from storeapi.security import get_current_user
 
 logger = logging.getLogger(__name__)
 router  = APIRouter()
 
 CHUNK_SIZE = 1024 * 1024
 
-@router.post("/upload", status_code=status.HTTP_201_CREATED)
+@router.post("/upload", status_code=status.HTTP_201_CREATED, dependencies=[Depends(limit_by_ip("upload"))])
 async def upload_file(file: UploadFile):
     file.read(CHUNK_SIZE)
 
     try:
-        with tempfile.NamedTemporaryFile() as tempfile:
-            filename = tempfile.name
+        with tempfile.NamedTemporaryFile() as temp_file:
+            filename = temp_file.name
             logger.info("Saving uploaded file temporarily to {filename}")
 
             async with aiofiles.open(filename, "wb") as f:
@@ -24,6 +40,12 @@ async def upload_file(file: UploadFile):
 
             file_url = b2_upload_file(local_file=filename, file_name=filename)
 
+    except CircuitOpenError:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="File storage is currently unavailable"
+        )
+
     except Exception:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -31,3 +53,313 @@ async def upload_file(file: UploadFile):
         )
     
     return {"detail": f"Successfully uploaded {file.filename}", "file_url": file_url}
+
+def composite_checksum(part_sha1s: List[str]) -> str:
+    # SHA-1 over the concatenated binary SHA-1 of every part, in part order.
+    # Clients compute the same while splitting the file, so the server can
+    # check the whole file without ever holding it.
+    return hashlib.sha1(b"".join(bytes.fromhex(sha1) for sha1 in part_sha1s)).hexdigest()
+
+def received_offset(size: int, part_size: int, part_numbers: List[int]) -> int:
+    # Bytes received without gaps from the start, where a client resumes
+    contiguous = 0
+    for part_number in part_numbers:
+        if part_number != contiguous + 1:
+            break
+        contiguous = part_number
+
+    return min(contiguous * part_size, size)
+
+async def call_b2(func: Callable, *args: Any) -> Any:
+    # b2sdk is blocking, so B2 calls run in the thread pool
+    try:
+        return await run_in_threadpool(func, *args)
+    except CircuitOpenError:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="File storage is currently unavailable"
+        )
+    except Exception:
+        logger.exception("B2 call failed")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="There was an error uploading the file"
+        )
+
+async def find_upload_session(session_id: str, user: User, allow_expired: bool = False):
+    query = upload_session_table.select().where(
+        (upload_session_table.c.id == session_id) & (upload_session_table.c.user_id == user.id)
+    )
+    logger.debug(query)
+    session = await database.fetch_one(query)
+    if not session:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Upload session not found")
+
+    if not allow_expired and session.file_url is None and time.time() > session.expires_at:
+        raise HTTPException(status_code=status.HTTP_410_GONE, detail="The upload session has expired")
+
+    return session
+
+async def lock_upload_session(session_id: str):
+    # Called inside a transaction. Part uploads and completion of one session
+    # run one after the other, B2 calls included, and see what the previous
+    # one left.
+    query = upload_session_table.select().where(upload_session_table.c.id == session_id).with_for_update()
+    logger.debug(query)
+    return await database.fetch_one(query)
+
+async def delete_upload_session(session_id: str) -> None:
+    async with database.transaction():
+        await database.execute(upload_part_table.delete().where(upload_part_table.c.session_id == session_id))
+        await database.execute(upload_session_table.delete().where(upload_session_table.c.id == session_id))
+
+async def sweep_upload_sessions(now: Optional[float] = None) -> int:
+    # Cancels the B2 large files of unfinished sessions past their expiry,
+    # then deletes the sessions. Files B2 fails to cancel are left for the
+    # next sweep.
+    now = time.time() if now is None else now
+    query = upload_session_table.select().where(upload_session_table.c.file_url.is_(None) & (upload_session_table.c.expires_at < now))
+    logger.debug(query)
+    swept = 0
+    for session in await database.fetch_all(query):
+        try:
+            await run_in_threadpool(b2_cancel_large_file, session.b2_file_id)
+        except Exception:
+            logger.exception(f"Could not cancel the B2 large file of upload session {session.id}")
+            continue
+
+        await delete_upload_session(session.id)
+        swept += 1
+
+    if swept:
+        logger.info(f"Swept {swept} expired upload sessions")
+
+    return swept
+
+async def sweep_upload_sessions_periodically(interval: float) -> None:
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await sweep_upload_sessions()
+        except Exception:
+            logger.exception("Sweeping upload sessions failed")
+
+async def find_upload_parts(session_id: str):
+    query = upload_part_table.select().where(upload_part_table.c.session_id == session_id).order_by(upload_part_table.c.part_number)
+    logger.debug(query)
+    return await database.fetch_all(query)
+
+def upload_session_response(session, parts) -> dict:
+    part_numbers = [part.part_number for part in parts]
+    return {
+        "id": session.id,
+        "file_name": session.file_name,
+        "content_type": session.content_type,
+        "size": session.size,
+        "part_size": session.part_size,
+        "offset": received_offset(session.size, session.part_size, part_numbers),
+        "parts": part_numbers,
+        "file_url": session.file_url,
+        "expires_at": session.expires_at
+    }
+
+async def read_chunk(request: Request, expected_size: int) -> bytes:
+    data = bytearray()
+    async for chunk in request.stream():
+        data.extend(chunk)
+        if len(data) > expected_size:
+            raise HTTPException(
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                detail=f"The chunk at this offset must be {expected_size} bytes"
+            )
+
+    if len(data) != expected_size:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"The chunk at this offset must be {expected_size} bytes"
+        )
+
+    return bytes(data)
+
+@router.post("/upload/sessions", response_model=UploadSession, status_code=status.HTTP_201_CREATED, dependencies=[Depends(limit_by_ip("upload"))])
+async def create_upload_session(upload: UploadSessionIn, current_user: Annotated[User, Depends(get_current_user)]):
+    logger.info("Creating an upload session")
+    part_size = config.UPLOAD_PART_SIZE
+    if upload.size <= part_size:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Files up to {part_size} bytes must be sent to /upload in one request"
+        )
+
+    if math.ceil(upload.size / part_size) > config.UPLOAD_MAX_PARTS:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Files can't have more than {config.UPLOAD_MAX_PARTS} parts of {part_size} bytes"
+        )
+
+    file_id = await call_b2(b2_start_large_file, upload.file_name, upload.content_type)
+    session = {
+        **upload.model_dump(),
+        "id": uuid.uuid4().hex,
+        "user_id": current_user.id,
+        "part_size": part_size,
+        "b2_file_id": file_id,
+        "file_url": None,
+        "expires_at": time.time() + config.UPLOAD_SESSION_TTL
+    }
+    query = upload_session_table.insert().values(session)
+    logger.debug(query)
+    await database.execute(query)
+    return upload_session_response(SimpleNamespace(**session), [])
+
+@router.get("/upload/sessions/{session_id}", response_model=UploadSession)
+async def get_upload_session(session_id: str, current_user: Annotated[User, Depends(get_current_user)]):
+    session = await find_upload_session(session_id, current_user)
+    return upload_session_response(session, await find_upload_parts(session_id))
+
+@router.put("/upload/sessions/{session_id}", response_model=UploadPart)
+async def upload_chunk(session_id: str, offset: int, request: Request, current_user: Annotated[User, Depends(get_current_user)]):
+    session = await find_upload_session(session_id, current_user)
+    if session.file_url:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="The upload is already complete")
+
+    if offset < 0 or offset >= session.size or offset % session.part_size:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"The offset must be a multiple of {session.part_size} below {session.size}"
+        )
+
+    # Each chunk is exactly one B2 part, so a chunk sent again just replaces it
+    part_number = offset // session.part_size + 1
+    data = await read_chunk(request, min(session.part_size, session.size - offset))
+    sha1 = hashlib.sha1(data).hexdigest()
+
+    # The part goes to B2 under the session lock, so the sha1 recorded for a
+    # part sent twice at the same time is the one B2 kept. Every part pushes
+    # the expiry back.
+    part = {"session_id": session_id, "part_number": part_number, "size": len(data), "sha1": sha1}
+    async with database.transaction():
+        session = await lock_upload_session(session_id)
+        if session is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Upload session not found")
+
+        if session.file_url:
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="The upload is already complete")
+
+        await database.execute(upload_session_table.update().where(upload_session_table.c.id == session_id).values(expires_at=time.time() + config.UPLOAD_SESSION_TTL))
+        await call_b2(b2_upload_part, session.b2_file_id, part_number, data, sha1)
+        await database.execute(upload_part_table.delete().where(
+            (upload_part_table.c.session_id == session_id) & (upload_part_table.c.part_number == part_number)
+        ))
+        await database.execute(upload_part_table.insert().values(part))
+
+    parts = await find_upload_parts(session_id)
+    return {
+        "part_number": part_number,
+        "size": len(data),
+        "sha1": sha1,
+        "offset": received_offset(session.size, session.part_size, [part.part_number for part in parts])
+    }
+
+@router.post("/upload/sessions/{session_id}/complete")
+async def complete_upload_session(session_id: str, complete: UploadSessionComplete, current_user: Annotated[User, Depends(get_current_user)]):
+    session = await find_upload_session(session_id, current_user)
+    if session.file_url:
+        return {"detail": f"Successfully uploaded {session.file_name}", "file_url": session.file_url}
+
+    # A complete sent twice at the same time waits here, then returns what
+    # the first one stored instead of finishing the B2 file again
+    async with database.transaction():
+        session = await lock_upload_session(session_id)
+        if session is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Upload session not found")
+
+        if session.file_url:
+            return {"detail": f"Successfully uploaded {session.file_name}", "file_url": session.file_url}
+
+        parts = await find_upload_parts(session_id)
+        part_count = math.ceil(session.size / session.part_size)
+        missing = sorted(set(range(1, part_count + 1)) - {part.part_number for part in parts})
+        if missing:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail=f"Parts {missing} have not been uploaded"
+            )
+
+        part_sha1s = [part.sha1 for part in parts]
+        if composite_checksum(part_sha1s) != complete.checksum.lower():
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail="The checksum doesn't match the uploaded parts"
+            )
+
+        file_url = await call_b2(b2_finish_large_file, session.b2_file_id, part_sha1s)
+        query = upload_session_table.update().where(upload_session_table.c.id == session_id).values(file_url=file_url)
+        logger.debug(query)
+        await database.execute(query)
+
+    return {"detail": f"Successfully uploaded {session.file_name}", "file_url": file_url}
+
+@router.delete("/upload/sessions/{session_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def cancel_upload_session(session_id: str, current_user: Annotated[User, Depends(get_current_user)]):
+    session = await find_upload_session(session_id, current_user, allow_expired=True)
+    if session.file_url:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="The upload is already complete")
+
+    await call_b2(b2_cancel_large_file, session.b2_file_id)
+    await delete_upload_session(session_id)
+
+# Direct uploads: the client gets a B2 upload URL and token, sends the file
+# straight to B2 under the name handed out here, then reports the file id back
+@router.post("/upload/authorizations", response_model=UploadAuthorization, status_code=status.HTTP_201_CREATED, dependencies=[Depends(limit_by_ip("upload"))])
+async def create_upload_authorization(upload: UploadAuthorizationIn, current_user: Annotated[User, Depends(get_current_user)]):
+    logger.info("Creating an upload authorization")
+    authorization_id = uuid.uuid4().hex
+    file_name = f"uploads/{current_user.id}/{authorization_id}/{pathlib.PurePosixPath(upload.file_name).name}"
+    upload_url, authorization_token = await call_b2(b2_get_upload_authorization)
+    authorization = {
+        "id": authorization_id,
+        "user_id": current_user.id,
+        "file_name": file_name,
+        "expires_at": time.time() + config.UPLOAD_AUTHORIZATION_TTL
+    }
+    query = upload_authorization_table.insert().values(authorization)
+    logger.debug(query)
+    await database.execute(query)
+    return {**authorization, "upload_url": upload_url, "authorization_token": authorization_token}
+
+@router.post("/upload/authorizations/{authorization_id}/complete")
+async def complete_upload_authorization(authorization_id: str, complete: UploadAuthorizationComplete, current_user: Annotated[User, Depends(get_current_user)]):
+    query = upload_authorization_table.select().where(
+        (upload_authorization_table.c.id == authorization_id) & (upload_authorization_table.c.user_id == current_user.id)
+    )
+    logger.debug(query)
+    authorization = await database.fetch_one(query)
+    if not authorization:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Upload authorization not found")
+
+    if authorization.file_url:
+        if authorization.file_id != complete.file_id:
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="The upload was completed with another file")
+
+        return {"detail": f"Successfully uploaded {authorization.file_name}", "file_url": authorization.file_url}
+
+    if time.time() > authorization.expires_at:
+        raise HTTPException(status_code=status.HTTP_410_GONE, detail="The upload authorization has expired")
+
+    uploaded_file = await call_b2(b2_get_uploaded_file, complete.file_id)
+    if uploaded_file is None or uploaded_file[0] != authorization.file_name:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="No file was uploaded with this authorization"
+        )
+
+    file_url = uploaded_file[1]
+    query = (
+        upload_authorization_table.update()
+        .where(upload_authorization_table.c.id == authorization_id)
+        .values(file_id=complete.file_id, file_url=file_url)
+    )
+    logger.debug(query)
+    await database.execute(query)
+    return {"detail": f"Successfully uploaded {authorization.file_name}", "file_url": file_url}
@@ -1,15 +1,18 @@
 import logging
-from fastapi import APIRouter, BackgroundTasks, HTTPException, status, Request
+from typing import Annotated
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, status, Request
 from storeapi.models.user import UserIn
+from storeapi.config import RuntimeSettings, get_runtime_settings
 from storeapi.security import authenticate_user, create_access_token, create_confirmation_token, get_user, get_password_hash, get_subject_for_token_type
 from storeapi.database import database, user_table
+from storeapi.ratelimit import limit_by_ip
 from storeapi import tasks
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
-@router.post("/register", status_code=status.HTTP_201_CREATED)
-async def register(user: UserIn, background_tasks: BackgroundTasks, request: Request):
+@router.post("/register", status_code=status.HTTP_201_CREATED, dependencies=[Depends(limit_by_ip("register"))])
+async def register(user: UserIn, background_tasks: BackgroundTasks, request: Request, settings: Annotated[RuntimeSettings, Depends(get_runtime_settings)]):
     if await get_user(user.email):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -24,19 +27,19 @@ async def register(user: UserIn, background_tasks: BackgroundTasks, request: Req
     background_tasks.add_task(
             tasks.send_user_registration_email,
             user.email, 
-            confirmation_url=request.url_for("confirm_email", token=create_confirmation_token(user.email))
+            confirmation_url=request.url_for("confirm_email", token=create_confirmation_token(user.email, settings))
         )
     return {"detail": "User created. Please confirm your email."}
 
-@router.post("/token", status_code=status.HTTP_200_OK)
-async def login(user: UserIn):
+@router.post("/token", status_code=status.HTTP_200_OK, dependencies=[Depends(limit_by_ip("token"))])
+async def login(user: UserIn, settings: Annotated[RuntimeSettings, Depends(get_runtime_settings)]):
     user = await authenticate_user(user.email, user.password)
-    access_token = create_access_token(user.email)
+    access_token = create_access_token(user.email, settings)
     return {"access_token": access_token, "token_type": "bearer"}
 
 @router.get("/confirm/{token}")
-async def confirm_email(token: str):
-    email = get_subject_for_token_type(token, "confirmation")
+async def confirm_email(token: str, settings: Annotated[RuntimeSettings, Depends(get_runtime_settings)]):
+    email = get_subject_for_token_type(token, "confirmation", settings)
     query = (
         user_table.update().where(user_table.c.email == email).values(confirmed=True)
     )
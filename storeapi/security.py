@@ -1,16 +1,22 @@
 import logging
-from typing import Annotated, Literal
-from datetime import datetime, timedelta, UTC
+import secrets
+import sqlalchemy
+from typing import Annotated, Literal, Optional
+from datetime import datetime, UTC
 from jose import ExpiredSignatureError, JWTError, jwt
 from passlib.context import CryptContext
 from fastapi import HTTPException, status, Depends
-from fastapi.security import OAuth2PasswordBearer
-from storeapi.database import database, user_table
-from storeapi.config import config
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer, OAuth2PasswordBearer
+from storeapi.database import CachedQuery, database, user_table
+from storeapi.config import RuntimeSettings, config, get_runtime_settings
+from storeapi.timing import span
 
 logger = logging.getLogger(__name__)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token", auto_error=False)
+metrics_token_scheme = HTTPBearer(auto_error=False)
 pwd_context = CryptContext(schemes=["bcrypt"])
+select_user_by_email = CachedQuery(user_table.select().where(user_table.c.email == sqlalchemy.bindparam("email")))
 
 def create_credentials_exception(detail: str) -> HTTPException:
     return HTTPException(
@@ -19,29 +25,26 @@ def create_credentials_exception(detail: str) -> HTTPException:
         headers={"www-Authenticate": "Bearer"}
     )
 
-def access_token_expire_minutes() -> int:
-    return config.EXPIRATION
-
-def confirm_token_expire_minutes() -> int:
-    return config.CONFIRM_EXPIRATION
-
-def create_access_token(email: str):
+def create_access_token(email: str, settings: RuntimeSettings = None):
     logger.debug("Creating access token", extra={"email": email})
-    expire = datetime.now(UTC.utc) + timedelta(minutes=access_token_expire_minutes())
+    settings = settings or get_runtime_settings()
+    expire = datetime.now(UTC) + settings.access_token_expiration
     jwt_data = {"sub": email, "exp": expire, "access_type": "access"}
-    encoded_jwt = jwt.encode(jwt_data, key=config.SECRET_KEY, algorithm=config.ALGORITHM)
+    encoded_jwt = jwt.encode(jwt_data, key=settings.signing_key, algorithm=settings.algorithm)
     return encoded_jwt
 
-def create_confirmation_token(email: str):
+def create_confirmation_token(email: str, settings: RuntimeSettings = None):
     logger.debug("Creating confirmation token", extra={"email": email})
-    expire = datetime.now(UTC.utc) + timedelta(minutes=confirm_token_expire_minutes())
+    settings = settings or get_runtime_settings()
+    expire = datetime.now(UTC) + settings.confirmation_token_expiration
     jwt_data = {"sub": email, "exp": expire, "access_type": "confirmation"}
-    encoded_jwt = jwt.encode(jwt_data, key=config.SECRET_KEY, algorithm=config.ALGORITHM)
+    encoded_jwt = jwt.encode(jwt_data, key=settings.signing_key, algorithm=settings.algorithm)
     return encoded_jwt
 
-def get_subject_for_token_type(token: str, access_type: Literal["access", "confirmation"]) -> str:
+def get_subject_for_token_type(token: str, access_type: Literal["access", "confirmation"], settings: RuntimeSettings = None) -> str:
+    settings = settings or get_runtime_settings()
     try:
-        payload = jwt.decode(token, key=config.SECRET_KEY, algorithms=[config.ALGORITHM])
+        payload = jwt.decode(token, key=settings.signing_key, algorithms=settings.algorithms)
     
     except ExpiredSignatureError as exception:
         raise create_credentials_exception("Token has expired") from exception
@@ -66,8 +69,8 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
 async def get_user(email: str):
-    logger.debug("Fetching user from the database", extra={"email", email})
-    query = user_table.select().where(user_table.c.email == email)
+    logger.debug("Fetching user from the database", extra={"email": email})
+    query = select_user_by_email.bind(email=email)
     result = await database.fetch_one(query)
     
     if result:
@@ -87,10 +90,28 @@ async def authenticate_user(email: str, password: str):
 
     return user
 
-async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)]):
-    email = get_subject_for_token_type(token, "access")
-    user = await get_user(email=email)
-    if user is None:
-        raise create_credentials_exception("Could not find 'user' for this token")
-    
+async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)], settings: Annotated[RuntimeSettings, Depends(get_runtime_settings)] = None):
+    with span("auth"):
+        email = get_subject_for_token_type(token, "access", settings)
+        user = await get_user(email=email)
+        if user is None:
+            raise create_credentials_exception("Could not find 'user' for this token")
+
     return user
+
+async def get_optional_current_user(token: Annotated[Optional[str], Depends(optional_oauth2_scheme)], settings: Annotated[RuntimeSettings, Depends(get_runtime_settings)] = None):
+    # Public routes that personalize their response for a signed in caller;
+    # a token that is sent must still be valid
+    if token is None:
+        return None
+
+    return await get_current_user(token, settings)
+
+def require_metrics_token(credentials: Annotated[Optional[HTTPAuthorizationCredentials], Depends(metrics_token_scheme)]) -> None:
+    # The metrics show SQL text and query plans, so they don't exist until a
+    # METRICS_TOKEN is configured and then need it as a bearer token
+    if not config.METRICS_TOKEN:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+
+    if credentials is None or not secrets.compare_digest(credentials.credentials, config.METRICS_TOKEN):
+        raise create_credentials_exception("Invalid metrics token")
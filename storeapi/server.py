@@ -0,0 +1,77 @@
+import argparse
+import importlib.util
+import logging
+import os
+from typing import Any, Dict, List, Optional
+import uvicorn
+from storeapi.config import GlobalConfig, config
+
+logger = logging.getLogger(__name__)
+
+def available_cpus() -> int:
+    # Respects CPU affinity and container cpusets where the platform exposes them
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+
+    return os.cpu_count() or 1
+
+def worker_count(settings: GlobalConfig, requested: Optional[int] = None) -> int:
+    # The app is async, so one worker per core keeps every core busy
+    workers = requested or settings.SERVER_WORKERS or int(os.environ.get("WEB_CONCURRENCY", 0))
+    return max(1, workers or available_cpus())
+
+def pool_max_size(settings: GlobalConfig, workers: int) -> int:
+    # DB_MAX_CONNECTIONS is a budget for the whole server, split across workers
+    if settings.DB_MAX_CONNECTIONS is None:
+        return settings.DB_POOL_MAX_SIZE
+
+    return max(settings.DB_POOL_MIN_SIZE, settings.DB_MAX_CONNECTIONS // workers)
+
+def event_loop() -> str:
+    return "uvloop" if importlib.util.find_spec("uvloop") else "asyncio"
+
+def http_protocol() -> str:
+    return "httptools" if importlib.util.find_spec("httptools") else "h11"
+
+def worker_environment(settings: GlobalConfig, workers: int) -> Dict[str, str]:
+    # Workers are separate processes that rebuild the config from the environment
+    prefix = settings.model_config.get("env_prefix", "")
+    return {f"{prefix}DB_POOL_MAX_SIZE": str(pool_max_size(settings, workers))}
+
+def uvicorn_options(settings: GlobalConfig, args: argparse.Namespace) -> Dict[str, Any]:
+    workers = worker_count(settings, args.workers)
+    return {
+        "host": args.host or settings.SERVER_HOST,
+        "port": args.port or settings.SERVER_PORT,
+        "workers": workers,
+        "loop": event_loop(),
+        "http": http_protocol(),
+        "lifespan": "on",
+        "timeout_keep_alive": settings.SERVER_KEEPALIVE,
+        "timeout_graceful_shutdown": settings.SERVER_GRACEFUL_TIMEOUT,
+        "backlog": settings.SERVER_BACKLOG,
+        "proxy_headers": True
+    }
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="python -m storeapi", description="Serve the storeapi application")
+    parser.add_argument("--host", help="Interface to bind, defaults to SERVER_HOST")
+    parser.add_argument("--port", type=int, help="Port to bind, defaults to SERVER_PORT")
+    parser.add_argument("--workers", type=int, help="Worker processes, defaults to SERVER_WORKERS or one per CPU")
+    parser.add_argument("--migrate", action="store_true", help="Apply schema migrations before serving")
+    return parser.parse_args(argv)
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = parse_args(argv)
+    options = uvicorn_options(config, args)
+    # In-process for a single worker, through the environment for spawned ones
+    config.DB_POOL_MAX_SIZE = pool_max_size(config, options["workers"])
+    os.environ.update(worker_environment(config, options["workers"]))
+
+    if args.migrate:
+        # Imported after the pool size is set, since it creates `database`
+        from storeapi.migrations import migrate
+        migrate()
+
+    logger.info(f"Starting {options['workers']} workers with {options['loop']} and {options['http']}")
+    uvicorn.run("storeapi.main:app", **options)
@@ -0,0 +1,189 @@
+import asyncio
+import sqlalchemy
+from collections.abc import Mapping
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Any, AsyncGenerator, AsyncIterator, Dict, Iterator, List, Optional, Tuple
+from sqlalchemy.engine import Row, make_url
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine, create_async_engine
+
+ASYNC_DRIVERS = {"postgresql": "postgresql+asyncpg", "sqlite": "sqlite+aiosqlite"}
+
+class Record(Mapping):
+    # Gives SQLAlchemy rows the interface of a `databases` record, so routers,
+    # response models and RecordsJSONResponse can't tell the backends apart
+    __slots__ = ("_row",)
+
+    def __init__(self, row: Row) -> None:
+        self._row = row
+
+    @property
+    def _mapping(self) -> Mapping:
+        return self._row._mapping
+
+    def __getitem__(self, key: Any) -> Any:
+        if isinstance(key, int):
+            return self._row[key]
+
+        return self._row._mapping[key]
+
+    def __getattr__(self, name: str) -> Any:
+        try:
+            return self._row._mapping[name]
+        except KeyError as e:
+            raise AttributeError(name) from e
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._row._mapping)
+
+    def __len__(self) -> int:
+        return len(self._row)
+
+    def __repr__(self) -> str:
+        return f"Record({dict(self._row._mapping)!r})"
+
+def async_url(url: str, statement_cache_size: int) -> sqlalchemy.engine.URL:
+    parsed = make_url(url)
+    backend = parsed.get_backend_name()
+    parsed = parsed.set(drivername=ASYNC_DRIVERS.get(backend, parsed.drivername))
+    if backend == "postgresql":
+        # asyncpg's own cache of server-side prepared statements, per connection
+        parsed = parsed.update_query_dict({"prepared_statement_cache_size": str(statement_cache_size)})
+
+    return parsed
+
+def to_statement(query: Any, values: Optional[Dict[str, Any]], dialect_name: Optional[str] = None) -> Tuple[Any, Dict[str, Any]]:
+    if hasattr(query, "to_statement"):
+        query, bound = query.to_statement(dialect_name)
+        values = {**bound, **(values or {})}
+    elif isinstance(query, str):
+        query = sqlalchemy.text(query)
+
+    return query, values or {}
+
+class SQLAlchemyDatabase:
+    # Same calls as `databases.Database`, but queries run on SQLAlchemy's async
+    # engine. Compiled statements are reused through the engine's query cache
+    # and, on PostgreSQL, asyncpg keeps the prepared statements per connection.
+    def __init__(
+        self,
+        url: str,
+        force_rollback: bool = False,
+        min_size: int = 1,
+        max_size: int = 3,
+        statement_cache_size: int = 500
+    ) -> None:
+        self.url = async_url(url, statement_cache_size)
+        self.dialect_name = self.url.get_backend_name()
+        self._force_rollback = force_rollback
+        self._engine_args: Dict[str, Any] = {"query_cache_size": statement_cache_size}
+        if self.url.get_backend_name() == "postgresql":
+            self._engine_args.update(pool_size=max_size, max_overflow=0)
+
+        self.engine: Optional[AsyncEngine] = None
+        self.is_connected = False
+        self._connection: ContextVar[Optional[AsyncConnection]] = ContextVar("connection", default=None)
+        self._global_connection: Optional[AsyncConnection] = None
+        self._global_transaction = None
+        self._query_lock = asyncio.Lock()
+
+    async def connect(self) -> None:
+        if self.is_connected:
+            return
+
+        self.engine = create_async_engine(self.url, **self._engine_args)
+        if self._force_rollback:
+            # Every query shares one connection inside a transaction that is
+            # rolled back on disconnect, as `databases` does for tests
+            self._global_connection = await self.engine.connect()
+            self._global_transaction = await self._global_connection.begin()
+
+        self.is_connected = True
+
+    async def disconnect(self) -> None:
+        if not self.is_connected:
+            return
+
+        if self._global_connection is not None:
+            await self._global_transaction.rollback()
+            await self._global_connection.close()
+            self._global_connection = self._global_transaction = None
+
+        await self.engine.dispose()
+        self.is_connected = False
+
+    async def __aenter__(self) -> "SQLAlchemyDatabase":
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *args: Any) -> None:
+        await self.disconnect()
+
+    @asynccontextmanager
+    async def connection(self) -> AsyncGenerator[AsyncConnection, None]:
+        connection = self._connection.get()
+        if connection is not None:
+            yield connection
+        elif self._global_connection is not None:
+            async with self._query_lock:
+                yield self._global_connection
+        else:
+            async with self.engine.begin() as connection:
+                yield connection
+
+    @asynccontextmanager
+    async def transaction(self) -> AsyncGenerator[AsyncConnection, None]:
+        connection = self._connection.get() or self._global_connection
+        if connection is not None:
+            async with connection.begin_nested():
+                token = self._connection.set(connection)
+                try:
+                    yield connection
+                finally:
+                    self._connection.reset(token)
+            return
+
+        async with self.engine.begin() as connection:
+            token = self._connection.set(connection)
+            try:
+                yield connection
+            finally:
+                self._connection.reset(token)
+
+    async def fetch_all(self, query: Any, values: Optional[Dict[str, Any]] = None) -> List[Record]:
+        statement, params = to_statement(query, values, self.dialect_name)
+        async with self.connection() as connection:
+            result = await connection.execute(statement, params)
+            return [Record(row) for row in result.fetchall()]
+
+    async def fetch_one(self, query: Any, values: Optional[Dict[str, Any]] = None) -> Optional[Record]:
+        statement, params = to_statement(query, values, self.dialect_name)
+        async with self.connection() as connection:
+            result = await connection.execute(statement, params)
+            row = result.first()
+            return None if row is None else Record(row)
+
+    async def fetch_val(self, query: Any, values: Optional[Dict[str, Any]] = None, column: Any = 0) -> Any:
+        record = await self.fetch_one(query, values)
+        return None if record is None else record[column]
+
+    async def execute(self, query: Any, values: Optional[Dict[str, Any]] = None) -> Any:
+        statement, params = to_statement(query, values, self.dialect_name)
+        async with self.connection() as connection:
+            result = await connection.execute(statement, params)
+            if result.context.isinsert:
+                return result.inserted_primary_key[0]
+
+            return result.rowcount
+
+    async def execute_many(self, query: Any, values: List[Dict[str, Any]]) -> None:
+        statement, _ = to_statement(query, None, self.dialect_name)
+        async with self.connection() as connection:
+            await connection.execute(statement, values)
+
+    async def iterate(self, query: Any, values: Optional[Dict[str, Any]] = None) -> AsyncIterator[Record]:
+        statement, params = to_statement(query, values, self.dialect_name)
+        async with self.connection() as connection:
+            result = await connection.stream(statement, params)
+            async for row in result:
+                yield Record(row)
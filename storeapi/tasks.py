@@ -1,61 +1,132 @@
 import logging
 import httpx
+from functools import lru_cache
 from json import JSONDecodeError
 from databases import Database
+from storeapi.circuitbreaker import CircuitBreaker, CircuitOpenError
 from storeapi.config import config
 from storeapi.database import post_table
+from storeapi.feed import get_feed_hub
+from storeapi.generation import GenerationScheduler
+from storeapi.libs.mailgun import EmailTemplate, MailgunDispatcher
 
 logger = logging.getLogger(__name__)
 
 class APIResponseError(Exception):
     pass
 
+@lru_cache()
+def get_mailgun_breaker() -> CircuitBreaker:
+    return CircuitBreaker(
+        "mailgun",
+        failure_rate=config.BREAKER_FAILURE_RATE,
+        min_calls=config.BREAKER_MIN_CALLS,
+        reset_timeout=config.BREAKER_RESET_TIMEOUT,
+        max_timeout=config.MAILGUN_TIMEOUT
+    )
+
+@lru_cache()
+def get_deepai_breaker() -> CircuitBreaker:
+    return CircuitBreaker(
+        "deepai",
+        failure_rate=config.BREAKER_FAILURE_RATE,
+        min_calls=config.BREAKER_MIN_CALLS,
+        reset_timeout=config.BREAKER_RESET_TIMEOUT,
+        max_timeout=config.DEEPAI_TIMEOUT
+    )
+
+@lru_cache()
+def get_email_dispatcher() -> MailgunDispatcher:
+    return MailgunDispatcher(
+        api_key=config.MAILGUN_API_KEY,
+        domain=config.MAILGUN_API_DOMAIN,
+        sender=f"Jose Salvatierra <mailgun@{config.MAILGUN_API_DOMAIN}>",
+        window=config.MAILGUN_BATCH_WINDOW,
+        max_concurrency=config.MAILGUN_MAX_CONCURRENCY,
+        timeout=config.MAILGUN_TIMEOUT,
+        breaker=get_mailgun_breaker()
+    )
+
+@lru_cache()
+def get_generation_scheduler() -> GenerationScheduler:
+    return GenerationScheduler(
+        max_concurrency=config.DEEPAI_MAX_CONCURRENCY,
+        cache_ttl=config.DEEPAI_CACHE_TTL,
+        cache_size=config.DEEPAI_CACHE_SIZE
+    )
+
+registration_email = EmailTemplate(
+    "Successfully signed up",
+    """Hi $email, you have successfully signed up to the Stores REST API.
+Please, confirm your email by clicking on the following link: $confirmation_url
+"""
+)
+
+image_generation_failed_email = EmailTemplate(
+    "Error generating image",
+    """Hi $email! Unfortunately there was an error generating an image
+for your post."""
+)
+
+image_generation_completed_email = EmailTemplate(
+    "Image generation completed",
+    """Hi $email! Your image has been generated and added to your post.
+Please click on the following link to view it: $post_url"""
+)
+
 async def send_simple_email(to: str, subject: str, body: str):
     logger.debug(f"Sending email to '{to[:3]}' with subject '{subject[:20]}'")
     async with httpx.AsyncClient() as async_client:
         try:
-            response = await async_client.post(
-                f"https://api.mailgun.net/v3/{config.MAILGUN_API_DOMAIN}/message",
-                auth=("api", config.MAILGUN_API_KEY),
-                data={
-                    "from": f"Jose Salvatierra <mailgun@{config.MAILGUN_API_DOMAIN}>",
-                    "to": [to],
-                    "subject": subject,
-                    "text": body
-                }
-            )
-
-            response.raise_for_status()
+            with get_mailgun_breaker().guard() as timeout:
+                response = await async_client.post(
+                    f"https://api.mailgun.net/v3/{config.MAILGUN_API_DOMAIN}/messages",
+                    auth=("api", config.MAILGUN_API_KEY),
+                    data={
+                        "from": f"Jose Salvatierra <mailgun@{config.MAILGUN_API_DOMAIN}>",
+                        "to": [to],
+                        "subject": subject,
+                        "text": body
+                    },
+                    timeout=timeout
+                )
+
+                response.raise_for_status()
+
             logger.debug(response.content)
             return response
         except httpx.HTTPStatusError as exception:
             raise APIResponseError(f"API request failed with status code: {exception.response.status_code}") from exception
+        except (httpx.TransportError, CircuitOpenError) as exception:
+            raise APIResponseError(f"API request failed: {exception}") from exception
+
+async def send_template_email(to: str, template: EmailTemplate, **variables):
+    logger.debug(f"Queueing email to '{to[:3]}' with subject '{template.subject[:20]}'")
+    try:
+        return await get_email_dispatcher().send(template, to, email=to, **variables)
+    except httpx.HTTPStatusError as exception:
+        raise APIResponseError(f"API request failed with status code: {exception.response.status_code}") from exception
+    except (httpx.TransportError, CircuitOpenError) as exception:
+        raise APIResponseError(f"API request failed: {exception}") from exception
 
 async def send_user_registration_email(email: str, confirmation_url: str):
-    return await send_simple_email(
-        email,
-        "Successfully signed up",
-        (
-            f"""Hi {email}, you have successfully signed up to the Stores REST API.
-            Please, confirm your email by clicking on the following link: {confirmation_url}
-            """
-        )
-    )
+    return await send_template_email(email, registration_email, confirmation_url=str(confirmation_url))
 
 async def _generate_cute_creature_api(prompt: str):
     logger.debug("Generating cute creature")
 
     async with httpx.AsyncClient() as client:
         try:
-            response = await client.post(
-                "https://api.deepai.org/api/cute-creature-generator",
-                data={"text": prompt},
-                headers={"api-key": config.DEEPAI_API_KEY},
-                timeout=60,
-            )
+            with get_deepai_breaker().guard() as timeout:
+                response = await client.post(
+                    "https://api.deepai.org/api/cute-creature-generator",
+                    data={"text": prompt},
+                    headers={"api-key": config.DEEPAI_API_KEY},
+                    timeout=timeout,
+                )
 
-            logger.debug(response)
-            response.raise_for_status()
+                logger.debug(response)
+                response.raise_for_status()
 
             return response.json()
         
@@ -63,22 +134,19 @@ async def _generate_cute_creature_api(prompt: str):
             raise APIResponseError(
                 f"API request failed with status code {err.response.status_code}"
             ) from err
+        except (httpx.TransportError, CircuitOpenError) as err:
+            raise APIResponseError(f"API request failed: {err}") from err
         except (JSONDecodeError, TypeError) as err:
             raise APIResponseError("API response parsing failed") from err
 
+async def generate_cute_creature(prompt: str, priority: int = 0):
+    return await get_generation_scheduler().run(prompt, lambda: _generate_cute_creature_api(prompt), priority)
 
-async def generate_and_add_to_post(email: str, post_id: int, post_url: str, database: Database, prompt: str = "A blue british shorthair cat is sitting on a couch"):
+async def generate_and_add_to_post(email: str, post_id: int, post_url: str, database: Database, prompt: str = "A blue british shorthair cat is sitting on a couch", priority: int = 0):
     try:
-        response = await _generate_cute_creature_api(prompt)
+        response = await generate_cute_creature(prompt, priority)
     except APIResponseError:
-        return await send_simple_email(
-            email,
-            "Error generating image",
-            (
-                f"""Hi {email}! Unfortunately there was an error generating an image
-                for your post."""
-            ),
-        )
+        return await send_template_email(email, image_generation_failed_email)
 
     logger.debug("Connecting to database to update post")
     query = (
@@ -90,13 +158,7 @@ async def generate_and_add_to_post(email: str, post_id: int, post_url: str, data
     logger.debug(query)
     await database.execute(query)
     logger.debug("Database connection in background task closed")
-    await send_simple_email(
-        email,
-        "Image generation completed",
-        (
-            f"""Hi {email}! Your image has been generated and added to your post.
-            Please click on the following link to view it: {post_url}"""
-        ),
-    )
+    await get_feed_hub().publish("post_image_generated", post_id=post_id, image_url=response["output_url"])
+    await send_template_email(email, image_generation_completed_email, post_url=str(post_url))
 
     return response
\ No newline at end of file
@@ -1,18 +1,48 @@
 import os
 os.environ["ENV_STATE"] = "test"
 
+from storeapi.tests.worker_database import configure_worker_database, create_worker_database, harness_sqlite_file
+configure_worker_database()
+
+import httpx
 import pytest
 from typing import AsyncGenerator, Dict, Generator
 from fastapi.testclient import TestClient
 from httpx import AsyncClient, Request, Response
 from unittest.mock import AsyncMock, Mock
 from storeapi.main import app
-from storeapi.database import database, user_table
+from storeapi.config import config, rebuild_runtime_settings
+from storeapi.database import database, get_engine, user_table
+from storeapi.migrations import migrate
+from storeapi.circuitbreaker import breakers
+from storeapi.generation import GenerationScheduler
+from storeapi.idempotency import get_idempotency_store
+from storeapi.querystats import get_query_stats
+from storeapi.libs.mailgun import MailgunDispatcher
+from storeapi.tests.fake_b2 import FakeB2
+from storeapi.tests.fake_clock import FakeClock
+from storeapi.tests.fake_deepai import FakeDeepAI
+from storeapi.tests.fake_mailgun import FakeMailgun
 
 @pytest.fixture(scope="session")
 def anyio_backend():
     return "asyncio"
 
+@pytest.fixture(scope="session", autouse=True)
+def database_schema():
+    # A leftover file from an interrupted run would carry its rows over
+    sqlite_file = harness_sqlite_file(config.DATABASE_URL)
+    if sqlite_file is not None:
+        sqlite_file.unlink(missing_ok=True)
+    else:
+        create_worker_database(config.DATABASE_URL)
+
+    migrate()
+    yield
+    get_engine().dispose()
+    if sqlite_file is not None:
+        sqlite_file.unlink(missing_ok=True)
+
 @pytest.fixture()
 def client() -> Generator:
     yield TestClient(app)
@@ -48,6 +78,24 @@ async def logged_in_token(async_client: AsyncClient, confirmed_user: Dict) -> st
     response = await async_client.post("/token", json=confirmed_user)
     return response.json()["access_token"]
 
+@pytest.fixture()
+def clock() -> FakeClock:
+    return FakeClock()
+
+@pytest.fixture()
+def metrics_headers(mocker) -> Dict[str, str]:
+    mocker.patch.object(config, "METRICS_TOKEN", "test-metrics-token")
+    return {"Authorization": "Bearer test-metrics-token"}
+
+@pytest.fixture()
+async def second_logged_in_token(async_client: AsyncClient) -> str:
+    user_details = {"email": "second@example.net", "password": "1234"}
+    await async_client.post("/register", json=user_details)
+    query = user_table.update().where(user_table.c.email == user_details["email"]).values(confirmed=True)
+    await database.execute(query)
+    response = await async_client.post("/token", json=user_details)
+    return response.json()["access_token"]
+
 @pytest.fixture(autouse=True)
 async def mock_httpx_client(mocker):
     mocked_client = mocker.patch("storeapi.tasks.httpx.AsyncClient")
@@ -58,6 +106,64 @@ async def mock_httpx_client(mocker):
 
     return mocked_async_client
 
+@pytest.fixture(autouse=True)
+async def fake_mailgun(mocker) -> AsyncGenerator:
+    fake_mailgun = FakeMailgun()
+    dispatcher = MailgunDispatcher(
+        api_key="test",
+        domain="example.net",
+        sender="Test <mailgun@example.net>",
+        window=0,
+        transport=httpx.ASGITransport(app=fake_mailgun.app)
+    )
+    mocker.patch("storeapi.tasks.get_email_dispatcher", return_value=dispatcher)
+    yield fake_mailgun
+    await dispatcher.aclose()
+
+@pytest.fixture()
+async def fake_deepai(mocker, mock_httpx_client) -> AsyncGenerator:
+    # Replaces the mocked httpx client for the DeepAI calls in storeapi.tasks
+    # with real clients talking to the fake
+    fake_deepai = FakeDeepAI()
+    transport = httpx.ASGITransport(app=fake_deepai.app)
+    mocker.patch("storeapi.tasks.httpx.AsyncClient", side_effect=lambda **kwargs: AsyncClient(transport=transport, **kwargs))
+    mocker.patch.object(config, "DEEPAI_API_KEY", "test")
+    yield fake_deepai
+
+@pytest.fixture()
+def fake_b2(mocker) -> FakeB2:
+    fake_b2 = FakeB2()
+    mocker.patch("storeapi.libs.b2.b2_api", return_value=fake_b2.api)
+    mocker.patch.object(config, "B2_BUCKET_NAME", fake_b2.bucket.name)
+    return fake_b2
+
+@pytest.fixture(autouse=True)
+def runtime_settings():
+    yield
+    rebuild_runtime_settings()
+
+@pytest.fixture(autouse=True)
+def reset_idempotency_store():
+    yield
+    get_idempotency_store().clear()
+
+@pytest.fixture(autouse=True)
+def reset_query_stats():
+    yield
+    get_query_stats().clear()
+
+@pytest.fixture(autouse=True)
+def reset_circuit_breakers():
+    yield
+    for breaker in breakers.values():
+        breaker.reset()
+
+@pytest.fixture(autouse=True)
+def generation_scheduler(mocker) -> GenerationScheduler:
+    scheduler = GenerationScheduler()
+    mocker.patch("storeapi.tasks.get_generation_scheduler", return_value=scheduler)
+    return scheduler
+
 @pytest.fixture()
 def mock_generate_cute_creature_api(mocker):
     return mocker.patch(
@@ -0,0 +1,24 @@
+import b2sdk.v2 as b2
+from typing import List
+
+class FakeB2:
+    # A real B2Api whose HTTP layer is b2sdk's in-memory RawSimulator, so the
+    # calls in storeapi.libs.b2 run unchanged without touching the network
+    def __init__(self, bucket_name: str = "storeapi-test") -> None:
+        self.api = b2.B2Api(
+            b2.InMemoryAccountInfo(),
+            api_config=b2.B2HttpApiConfig(_raw_api_class=b2.RawSimulator)
+        )
+        self.api.authorize_account("production", *self.api.session.raw_api.create_account())
+        self.bucket = self.api.create_bucket(bucket_name, "allPrivate")
+
+    def upload(self, data: bytes, file_name: str) -> str:
+        # What a client holding an upload authorization would do
+        return self.bucket.upload_bytes(data, file_name).id_
+
+    def download(self, file_id: str) -> bytes:
+        return self.api.session.raw_api.bucket_id_to_bucket[self.bucket.id_].file_id_to_file[file_id].data_bytes
+
+    @property
+    def file_names(self) -> List[str]:
+        return [file_version.file_name for file_version, _ in self.bucket.ls(recursive=True)]
@@ -0,0 +1,7 @@
+class FakeClock:
+    # Stands in for time.monotonic, tests move it forward by setting `now`
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
@@ -0,0 +1,28 @@
+from typing import Dict, List
+from fastapi import FastAPI, Request, Response
+
+class FakeDeepAI:
+    # Stands in for DeepAI's generator API. Mount it with
+    # httpx.ASGITransport(app=fake_deepai.app) and inspect the prompts sent.
+    def __init__(self) -> None:
+        self.requests: List[Dict] = []
+        self.status_code = 200
+        self.app = FastAPI()
+        self.app.post("/api/{generator}")(self.generate)
+
+    async def generate(self, generator: str, request: Request):
+        form = await request.form()
+        self.requests.append({
+            "generator": generator,
+            "text": form["text"],
+            "api-key": request.headers.get("api-key")
+        })
+        if self.status_code != 200:
+            return Response(status_code=self.status_code)
+
+        job_id = len(self.requests)
+        return {"id": str(job_id), "output_url": f"https://api.deepai.org/job-view-file/{job_id}/outputs/output.jpg"}
+
+    @property
+    def prompts(self) -> List[str]:
+        return [request["text"] for request in self.requests]
@@ -0,0 +1,43 @@
+import json
+import re
+from typing import Dict, List
+from fastapi import FastAPI, Request, Response
+
+RECIPIENT_VARIABLE = re.compile(r"%recipient\.(\w+)%")
+
+class FakeMailgun:
+    # Stands in for the Mailgun messages API. Mount it with
+    # httpx.ASGITransport(app=fake_mailgun.app) and inspect what was sent.
+    def __init__(self) -> None:
+        self.requests: List[Dict] = []
+        self.status_code = 200
+        self.app = FastAPI()
+        self.app.post("/v3/{domain}/messages")(self.messages)
+
+    async def messages(self, domain: str, request: Request) -> Response:
+        form = await request.form()
+        self.requests.append({
+            "domain": domain,
+            "from": form["from"],
+            "to": form.getlist("to"),
+            "subject": form["subject"],
+            "text": form["text"],
+            "recipient-variables": json.loads(form.get("recipient-variables", "{}"))
+        })
+        return Response(status_code=self.status_code, content=json.dumps({"message": "Queued. Thank you."}))
+
+    @property
+    def emails(self) -> List[Dict]:
+        # One entry per recipient, with the recipient variables filled in
+        return [
+            {
+                "to": to,
+                "subject": request["subject"],
+                "text": RECIPIENT_VARIABLE.sub(
+                    lambda match: str(request["recipient-variables"][to][match.group(1)]),
+                    request["text"]
+                )
+            }
+            for request in self.requests
+            for to in request["to"]
+        ]
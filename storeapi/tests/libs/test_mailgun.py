@@ -0,0 +1,70 @@
+import asyncio
+import httpx
+import pytest
+from typing import AsyncGenerator
+from storeapi.libs.mailgun import EmailTemplate, MailgunDispatcher
+from storeapi.tests.fake_mailgun import FakeMailgun
+
+@pytest.mark.anyio
+class TestMailgun:
+
+    @pytest.fixture()
+    def template(self) -> EmailTemplate:
+        return EmailTemplate("Hello", "Hi $email, welcome to $site")
+
+    @pytest.fixture()
+    async def dispatcher(self, fake_mailgun: FakeMailgun) -> AsyncGenerator:
+        dispatcher = MailgunDispatcher(
+            api_key="test",
+            domain="example.net",
+            sender="Test <mailgun@example.net>",
+            window=0.01,
+            max_batch_size=3,
+            transport=httpx.ASGITransport(app=fake_mailgun.app)
+        )
+        yield dispatcher
+        await dispatcher.aclose()
+
+    def test_template(self, template: EmailTemplate):
+        assert template.variables == ("email", "site")
+        assert template.batch_text == "Hi %recipient.email%, welcome to %recipient.site%"
+        assert template.render(email="a@example.net", site="storeapi") == "Hi a@example.net, welcome to storeapi"
+
+    async def test_send_batches_recipients(self, dispatcher: MailgunDispatcher, template: EmailTemplate, fake_mailgun: FakeMailgun):
+        responses = await asyncio.gather(
+            dispatcher.send(template, "a@example.net", email="a@example.net", site="one"),
+            dispatcher.send(template, "b@example.net", email="b@example.net", site="two")
+        )
+
+        assert [response.status_code for response in responses] == [200, 200]
+        assert len(fake_mailgun.requests) == 1
+        assert fake_mailgun.requests[0]["domain"] == "example.net"
+        assert fake_mailgun.emails == [
+            {"to": "a@example.net", "subject": "Hello", "text": "Hi a@example.net, welcome to one"},
+            {"to": "b@example.net", "subject": "Hello", "text": "Hi b@example.net, welcome to two"}
+        ]
+
+    async def test_send_splits_full_batches(self, dispatcher: MailgunDispatcher, template: EmailTemplate, fake_mailgun: FakeMailgun):
+        await asyncio.gather(*(
+            dispatcher.send(template, f"{index}@example.net", email=f"{index}@example.net", site="site")
+            for index in range(5)
+        ))
+
+        assert [len(request["to"]) for request in fake_mailgun.requests] == [3, 2]
+
+    async def test_send_splits_repeated_recipient(self, dispatcher: MailgunDispatcher, template: EmailTemplate, fake_mailgun: FakeMailgun):
+        await asyncio.gather(
+            dispatcher.send(template, "a@example.net", email="a@example.net", site="one"),
+            dispatcher.send(template, "a@example.net", email="a@example.net", site="two")
+        )
+
+        assert [email["text"] for email in fake_mailgun.emails] == [
+            "Hi a@example.net, welcome to one",
+            "Hi a@example.net, welcome to two"
+        ]
+
+    async def test_send_api_error(self, dispatcher: MailgunDispatcher, template: EmailTemplate, fake_mailgun: FakeMailgun):
+        fake_mailgun.status_code = 500
+
+        with pytest.raises(httpx.HTTPStatusError):
+            await dispatcher.send(template, "a@example.net", email="a@example.net", site="one")
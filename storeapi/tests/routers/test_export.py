@@ -0,0 +1,66 @@
+import json
+import pytest
+from typing import Dict, List
+from httpx import AsyncClient
+
+@pytest.mark.anyio
+class TestExport:
+
+    async def create_post(self, body: str, async_client: AsyncClient, logged_in_token: str) -> Dict:
+        response = await async_client.post(
+            "/post",
+            json={"body": body},
+            headers={"Authorization": f"Bearer {logged_in_token}"}
+        )
+        return response.json()
+
+    async def create_comment(self, body: str, post_id: int, async_client: AsyncClient, logged_in_token: str) -> Dict:
+        response = await async_client.post(
+            "/comment",
+            json={"body": body, "post_id": post_id},
+            headers={"Authorization": f"Bearer {logged_in_token}"}
+        )
+        return response.json()
+
+    async def export(self, async_client: AsyncClient, logged_in_token: str, **params) -> List[Dict]:
+        response = await async_client.get(
+            "/export/posts",
+            params=params,
+            headers={"Authorization": f"Bearer {logged_in_token}"}
+        )
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/x-ndjson"
+        return [json.loads(line) for line in response.text.splitlines()]
+
+    async def test_export_requires_authentication(self, async_client: AsyncClient):
+        response = await async_client.get("/export/posts")
+
+        assert response.status_code == 401
+
+    async def test_export_posts(self, async_client: AsyncClient, logged_in_token: str):
+        first = await self.create_post("Test Post 1", async_client, logged_in_token)
+        second = await self.create_post("Test Post 2", async_client, logged_in_token)
+        comments = [
+            await self.create_comment("Test Comment 1", first["id"], async_client, logged_in_token),
+            await self.create_comment("Test Comment 2", first["id"], async_client, logged_in_token)
+        ]
+        await async_client.post("/like", json={"post_id": first["id"]}, headers={"Authorization": f"Bearer {logged_in_token}"})
+
+        assert await self.export(async_client, logged_in_token) == [
+            {"post": {**first, "likes": 1}, "comments": comments},
+            {"post": {**second, "likes": 0}, "comments": []}
+        ]
+
+    async def test_export_posts_id_range(self, async_client: AsyncClient, logged_in_token: str):
+        for index in range(4):
+            await self.create_post(f"Test Post {index}", async_client, logged_in_token)
+
+        lines = await self.export(async_client, logged_in_token, min_id=2, max_id=3)
+
+        assert [line["post"]["id"] for line in lines] == [2, 3]
+
+    async def test_export_posts_by_user(self, async_client: AsyncClient, logged_in_token: str, confirmed_user: Dict):
+        await self.create_post("Test Post", async_client, logged_in_token)
+
+        assert len(await self.export(async_client, logged_in_token, user_id=confirmed_user["id"])) == 1
+        assert await self.export(async_client, logged_in_token, user_id=confirmed_user["id"] + 1) == []
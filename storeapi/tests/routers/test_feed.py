@@ -0,0 +1,74 @@
+import functools
+import json
+import pytest
+from fastapi.testclient import TestClient
+from httpx import AsyncClient
+from storeapi.feed import FeedHub, get_feed_hub
+from storeapi.routers.feed import sse_events
+
+@pytest.mark.anyio
+class TestFeed:
+
+    @pytest.fixture()
+    def subscription(self):
+        subscription = get_feed_hub().subscribe()
+        yield subscription
+        get_feed_hub().unsubscribe(subscription)
+
+    async def test_create_post_publishes_event(self, async_client: AsyncClient, logged_in_token: str, subscription):
+        response = await async_client.post(
+            "/post",
+            json={"body": "Test Post"},
+            headers={"Authorization": f"Bearer {logged_in_token}"}
+        )
+
+        assert await subscription.get(timeout=1) == {"type": "post_created", "post": response.json()}
+
+    async def test_create_comment_publishes_event(self, async_client: AsyncClient, logged_in_token: str, subscription):
+        headers = {"Authorization": f"Bearer {logged_in_token}"}
+        post = (await async_client.post("/post", json={"body": "Test Post"}, headers=headers)).json()
+        comment = (await async_client.post("/comment", json={"body": "Test Comment", "post_id": post["id"]}, headers=headers)).json()
+
+        await subscription.get(timeout=1)
+        assert await subscription.get(timeout=1) == {"type": "comment_created", "comment": comment}
+
+    async def test_like_post_publishes_count(self, async_client: AsyncClient, logged_in_token: str, second_logged_in_token: str, subscription):
+        headers = {"Authorization": f"Bearer {logged_in_token}"}
+        post = (await async_client.post("/post", json={"body": "Test Post"}, headers=headers)).json()
+        await async_client.post("/like", json={"post_id": post["id"]}, headers=headers)
+        await async_client.post("/like", json={"post_id": post["id"]}, headers=headers)
+        await async_client.post("/like", json={"post_id": post["id"]}, headers={"Authorization": f"Bearer {second_logged_in_token}"})
+        await async_client.delete(f"/like/{post['id']}", headers=headers)
+
+        events = [await subscription.get(timeout=1) for _ in range(4)]
+
+        assert events[1:] == [
+            {"type": "post_liked", "post_id": post["id"], "likes": 1},
+            {"type": "post_liked", "post_id": post["id"], "likes": 2},
+            {"type": "post_unliked", "post_id": post["id"], "likes": 1}
+        ]
+
+    async def test_sse_events(self):
+        hub = FeedHub(buffer_size=1)
+        subscription = hub.subscribe()
+        stream = sse_events(hub, subscription, keepalive=0.01)
+
+        assert await stream.__anext__() == b": keepalive\n\n"
+
+        await hub.publish("post_liked", post_id=1, likes=1)
+        assert await stream.__anext__() == b'event: post_liked\ndata: {"type":"post_liked","post_id":1,"likes":1}\n\n'
+
+        await hub.publish("post_liked", post_id=1, likes=2)
+        await hub.publish("post_liked", post_id=1, likes=3)
+        assert await stream.__anext__() == b"event: evicted\ndata: {}\n\n"
+        with pytest.raises(StopAsyncIteration):
+            await stream.__anext__()
+
+        assert hub.subscriptions == set()
+
+    def test_websocket(self, client: TestClient):
+        with client.websocket_connect("/feed/ws") as websocket:
+            publish = functools.partial(get_feed_hub().publish, "post_image_generated", post_id=1, image_url="https://example.net")
+            websocket.portal.call(publish)
+
+            assert json.loads(websocket.receive_text()) == {"type": "post_image_generated", "post_id": 1, "image_url": "https://example.net"}
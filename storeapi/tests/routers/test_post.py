@@ -1,7 +1,11 @@
+import asyncio
 import pytest
 from pydantic.types import Dict, List
 from httpx import AsyncClient
 from storeapi import security
+from storeapi.config import config, rebuild_runtime_settings
+from storeapi.database import database, like_table
+from storeapi.routers.post import insert_like
 
 @pytest.mark.anyio
 class TestPost:
@@ -38,8 +42,8 @@ class TestPost:
     async def created_comment(self, async_client: AsyncClient, created_post: Dict, logged_in_token: str):
         return await self.create_comment("Test Comment", created_post["id"], async_client, logged_in_token)
     
-    async def test_create_post_expired_token(self, async_client: AsyncClient, confirmed_user: Dict, mocker):
-        mocker.patch("storeapi.security.access_token_expire_minutes", return_value=-1)
+    async def test_create_post_expired_token(self, async_client: AsyncClient, confirmed_user: Dict):
+        rebuild_runtime_settings(EXPIRATION=-1)
         token = security.create_access_token(confirmed_user["email"])
         response = await async_client.post(
             "/post", 
@@ -81,6 +85,15 @@ class TestPost:
 
         mock_generate_cute_creature_api.assert_called()
 
+    async def test_create_post_idempotency_key(self, async_client: AsyncClient, logged_in_token: str):
+        headers = {"Authorization": f"Bearer {logged_in_token}", "Idempotency-Key": "create-post"}
+        first = await async_client.post("/post", json={"body": "Test Post"}, headers=headers)
+        second = await async_client.post("/post", json={"body": "Test Post"}, headers=headers)
+
+        assert second.status_code == 201
+        assert second.json() == first.json()
+        assert len((await async_client.get("/post")).json()) == 1
+
     async def test_create_post_missing_data(self, async_client: AsyncClient, logged_in_token: str):
         response = await async_client.post(
             "/post", 
@@ -95,7 +108,7 @@ class TestPost:
         response = await async_client.get("/post")
 
         assert response.status_code == 200
-        assert response.json() == [{**created_post, "likes": 0}]
+        assert response.json() == [{**created_post, "likes": 0, "liked_by_me": False}]
 
     @pytest.mark.parametrize(
             "sorting, expected_order",
@@ -126,11 +139,83 @@ class TestPost:
         assert response.status_code == 200
         assert post_ids == expected_order
 
+    async def test_get_posts_most_likes_counts(self, async_client: AsyncClient, logged_in_token: str, second_logged_in_token: str):
+        await self.create_post("Test Post 1", async_client, logged_in_token)
+        await self.create_post("Test Post 2", async_client, logged_in_token)
+        for post_id, token in [(2, logged_in_token), (2, second_logged_in_token), (1, logged_in_token)]:
+            await self.like_post(post_id, async_client, token)
+
+        response = await async_client.get("/post", params={"sorting": "most_likes"})
+
+        assert [(post["id"], post["likes"]) for post in response.json()] == [(2, 2), (1, 1)]
+
+    async def test_get_posts_trending(self, async_client: AsyncClient, logged_in_token: str, second_logged_in_token: str, mocker):
+        mocked_time = mocker.patch("storeapi.routers.post.time").time
+        mocked_time.return_value = 1_800_000_000
+        await self.create_post("Test Post 1", async_client, logged_in_token)
+        await self.create_post("Test Post 2", async_client, logged_in_token)
+        await self.create_post("Test Post 3", async_client, logged_in_token)
+        await self.like_post(1, async_client, logged_in_token)
+        await self.like_post(1, async_client, second_logged_in_token)
+        mocked_time.return_value += 3 * config.TRENDING_HALF_LIFE
+        await self.like_post(2, async_client, logged_in_token)
+
+        response = await async_client.get("/post", params={"sorting": "trending"})
+
+        assert [post["id"] for post in response.json()] == [2, 1, 3]
+
     async def test_get_posts_wrong_sorting(self, async_client: AsyncClient):
         response = await async_client.get("/post", params={"sorting": "wrong"})
         
         assert response.status_code == 422
 
+    async def test_get_posts_too_many_results(self, async_client: AsyncClient, logged_in_token: str, mocker):
+        mocker.patch.object(config, "POSTS_MAX_RESULTS", 1)
+        for body in ("First", "Second"):
+            await self.create_post(body, async_client, logged_in_token)
+
+        response = await async_client.get("/post")
+
+        assert response.status_code == 413
+
+    async def test_get_posts_query_timeout(self, async_client: AsyncClient, created_post: Dict, mocker):
+        async def slow_fetch_all(query):
+            await asyncio.sleep(1)
+
+        mocker.patch.object(config, "POSTS_QUERY_TIMEOUT", 0.01)
+        mocker.patch("storeapi.querylimits.database.fetch_all", side_effect=slow_fetch_all)
+        response = await async_client.get("/post")
+
+        assert response.status_code == 503
+
+    async def test_get_user_posts(self, async_client: AsyncClient, confirmed_user: Dict, logged_in_token: str):
+        for body in ("First", "Second", "Third"):
+            await self.create_post(body, async_client, logged_in_token)
+        await self.like_post(2, async_client, logged_in_token)
+
+        pages, params = [], {"limit": 2}
+        while True:
+            response = await async_client.get(f"/user/{confirmed_user['id']}/posts", params=params)
+            pages.append([(post["id"], post["likes"]) for post in response.json()])
+            if "X-Next-Cursor" not in response.headers:
+                break
+
+            params["after"] = response.headers["X-Next-Cursor"]
+
+        assert pages == [[(3, 0), (2, 1)], [(1, 0)]]
+
+    async def test_get_user_posts_other_user(self, async_client: AsyncClient, created_post: Dict):
+        response = await async_client.get(f"/user/{created_post['user_id'] + 1}/posts")
+
+        assert response.status_code == 200
+        assert response.json() == []
+
+    async def test_get_user_posts_page_too_large(self, async_client: AsyncClient, confirmed_user: Dict, mocker):
+        mocker.patch.object(config, "POSTS_MAX_RESULTS", 1)
+        response = await async_client.get(f"/user/{confirmed_user['id']}/posts", params={"limit": 2})
+
+        assert response.status_code == 413
+
     async def test_create_comment(self, async_client: AsyncClient, created_post: Dict, confirmed_user: Dict, logged_in_token: str):
         body = "Test Comment"
         response = await async_client.post(
@@ -159,11 +244,44 @@ class TestPost:
         assert response.status_code == 200
         assert response.json() == []
 
+    @pytest.mark.parametrize("sorting, expected_pages", [("old", [[1, 2], [3]]), ("new", [[3, 2], [1]])])
+    async def test_get_comments_pages(self, async_client: AsyncClient, created_post: Dict, logged_in_token: str, sorting: str, expected_pages: List[List[int]]):
+        for body in ("First", "Second", "Third"):
+            await self.create_comment(body, created_post["id"], async_client, logged_in_token)
+
+        pages, params = [], {"sorting": sorting, "limit": 2}
+        while True:
+            response = await async_client.get(f"/post/{created_post['id']}/comment", params=params)
+            pages.append([comment["id"] for comment in response.json()])
+            if "X-Next-Cursor" not in response.headers:
+                break
+
+            params["after"] = response.headers["X-Next-Cursor"]
+
+        assert pages == expected_pages
+
+    async def test_get_comments_page_too_large(self, async_client: AsyncClient, created_post: Dict, mocker):
+        mocker.patch.object(config, "COMMENTS_MAX_RESULTS", 1)
+        response = await async_client.get(f"/post/{created_post['id']}/comment", params={"limit": 2})
+
+        assert response.status_code == 413
+
     async def test_get_post_comments(self, async_client: AsyncClient, created_post: Dict, created_comment: Dict):
         response = await async_client.get(f"/post/{created_post['id']}")
 
         assert response.status_code == 200
-        assert response.json() == {"post": {**created_post, "likes": 0}, "comments": [created_comment],}
+        assert response.json() == {"post": {**created_post, "likes": 0, "liked_by_me": False}, "comments": [created_comment], "comment_count": 1, "next_cursor": None}
+
+    async def test_get_post_comments_first_page(self, async_client: AsyncClient, created_post: Dict, logged_in_token: str, mocker):
+        mocker.patch.object(config, "COMMENTS_PAGE_SIZE", 2)
+        for body in ("First", "Second", "Third"):
+            await self.create_comment(body, created_post["id"], async_client, logged_in_token)
+
+        response = await async_client.get(f"/post/{created_post['id']}")
+
+        assert [comment["id"] for comment in response.json()["comments"]] == [1, 2]
+        assert response.json()["comment_count"] == 3
+        assert response.json()["next_cursor"] == 2
 
     async def test_get_post_comments_with_missing_data(self, async_client: AsyncClient, created_post: Dict, created_comment: Dict):
         response = await async_client.get("/post/2")
@@ -178,3 +296,90 @@ class TestPost:
         )
 
         assert response.status_code == 201
+
+    async def test_like_post_twice(self, async_client: AsyncClient, created_post: Dict, logged_in_token: str):
+        first = await self.like_post(created_post["id"], async_client, logged_in_token)
+        response = await async_client.post(
+            "/like",
+            json={"post_id": created_post["id"]},
+            headers={"Authorization": f"Bearer {logged_in_token}"}
+        )
+        post = await async_client.get(f"/post/{created_post['id']}")
+
+        assert response.status_code == 200
+        assert response.json() == first
+        assert post.json()["post"]["likes"] == 1
+
+    async def test_insert_like_skips_existing(self, created_post: Dict, confirmed_user: Dict):
+        # What a like that lost the race with a concurrent one runs
+        for _ in range(2):
+            await database.execute(insert_like.bind(post_id=created_post["id"], user_id=confirmed_user["id"]))
+
+        assert len(await database.fetch_all(like_table.select())) == 1
+
+    async def test_like_missing_post(self, async_client: AsyncClient, logged_in_token: str):
+        response = await async_client.post(
+            "/like",
+            json={"post_id": 1},
+            headers={"Authorization": f"Bearer {logged_in_token}"}
+        )
+
+        assert response.status_code == 404
+
+    async def test_unlike_post(self, async_client: AsyncClient, created_post: Dict, logged_in_token: str):
+        headers = {"Authorization": f"Bearer {logged_in_token}"}
+        await self.like_post(created_post["id"], async_client, logged_in_token)
+
+        for _ in range(2):
+            response = await async_client.delete(f"/like/{created_post['id']}", headers=headers)
+            assert response.status_code == 204
+
+        response = await async_client.get("/post", params={"sorting": "most_likes"})
+        assert response.json()[0]["likes"] == 0
+
+    async def test_unlike_missing_post(self, async_client: AsyncClient, logged_in_token: str):
+        response = await async_client.delete("/like/1", headers={"Authorization": f"Bearer {logged_in_token}"})
+
+        assert response.status_code == 404
+
+    async def test_toggle_like(self, async_client: AsyncClient, created_post: Dict, logged_in_token: str):
+        toggles = []
+        for _ in range(3):
+            response = await async_client.post(
+                "/like/toggle",
+                json={"post_id": created_post["id"]},
+                headers={"Authorization": f"Bearer {logged_in_token}"}
+            )
+            assert response.status_code == 200
+            toggles.append((response.json()["liked"], response.json()["likes"]))
+
+        assert toggles == [(True, 1), (False, 0), (True, 1)]
+
+    async def test_toggle_like_idempotency_key(self, async_client: AsyncClient, created_post: Dict, logged_in_token: str):
+        headers = {"Authorization": f"Bearer {logged_in_token}", "Idempotency-Key": "toggle"}
+        for _ in range(2):
+            response = await async_client.post("/like/toggle", json={"post_id": created_post["id"]}, headers=headers)
+            assert (response.json()["liked"], response.json()["likes"]) == (True, 1)
+
+        assert response.headers["idempotent-replayed"] == "true"
+
+    async def test_liked_by_me(self, async_client: AsyncClient, logged_in_token: str, second_logged_in_token: str, confirmed_user: Dict):
+        for body in ("First", "Second", "Third"):
+            await self.create_post(body, async_client, logged_in_token)
+        await self.like_post(2, async_client, logged_in_token)
+        await self.like_post(3, async_client, second_logged_in_token)
+
+        mine = await async_client.get("/post", headers={"Authorization": f"Bearer {logged_in_token}"})
+        theirs = await async_client.get(f"/user/{confirmed_user['id']}/posts", headers={"Authorization": f"Bearer {second_logged_in_token}"})
+        anonymous = await async_client.get("/post")
+        single = await async_client.get("/post/2", headers={"Authorization": f"Bearer {logged_in_token}"})
+
+        assert [(post["id"], post["liked_by_me"]) for post in mine.json()] == [(3, False), (2, True), (1, False)]
+        assert [(post["id"], post["liked_by_me"]) for post in theirs.json()] == [(3, True), (2, False), (1, False)]
+        assert not any(post["liked_by_me"] for post in anonymous.json())
+        assert single.json()["post"]["liked_by_me"] is True
+
+    async def test_liked_by_me_invalid_token(self, async_client: AsyncClient, created_post: Dict):
+        response = await async_client.get("/post", headers={"Authorization": "Bearer invalid"})
+
+        assert response.status_code == 401
@@ -1,9 +1,18 @@
 import contextlib
+import hashlib
 import os
 import pathlib
 import tempfile
+import time
 import pytest
+from typing import Dict
 from httpx import AsyncClient
+from storeapi.circuitbreaker import CircuitOpenError
+from storeapi.config import config
+from storeapi.database import database, upload_session_table
+from storeapi.routers.upload import composite_checksum, received_offset, sweep_upload_sessions
+
+DATA = b"0123456789"
 
 @pytest.mark.anyio
 class TestUpload:
@@ -56,3 +65,387 @@ class TestUpload:
 
         assert response.status_code == 201
         assert not os.path.exists(created_temp_file.name)        
+
+    async def test_upload_idempotency_key(self, async_client: AsyncClient, logged_in_token: str, sample_image: pathlib.Path, mock_b2_upload_file):
+        headers = {"Authorization": f"Bearer {logged_in_token}", "Idempotency-Key": "upload"}
+        for _ in range(2):
+            response = await async_client.post("/upload", files={"file": open(sample_image, "rb")}, headers=headers)
+            assert response.status_code == 201
+
+        assert mock_b2_upload_file.call_count == 1
+
+@pytest.mark.anyio
+class TestUploadSessions:
+
+    @pytest.fixture(autouse=True)
+    def part_size(self, mocker) -> int:
+        mocker.patch.object(config, "UPLOAD_PART_SIZE", 4)
+        return 4
+
+    @pytest.fixture(autouse=True)
+    def mock_b2(self, mocker) -> Dict:
+        return {
+            "start": mocker.patch("storeapi.routers.upload.b2_start_large_file", return_value="b2-file-id"),
+            "part": mocker.patch("storeapi.routers.upload.b2_upload_part"),
+            "finish": mocker.patch("storeapi.routers.upload.b2_finish_large_file", return_value="https://fakeurl.com"),
+            "cancel": mocker.patch("storeapi.routers.upload.b2_cancel_large_file")
+        }
+
+    def headers(self, token: str) -> Dict:
+        return {"Authorization": f"Bearer {token}"}
+
+    async def create_session(self, async_client: AsyncClient, token: str, size: int = len(DATA)):
+        return await async_client.post(
+            "/upload/sessions",
+            json={"file_name": "myfile.bin", "size": size},
+            headers=self.headers(token)
+        )
+
+    async def put_chunk(self, async_client: AsyncClient, token: str, session_id: str, offset: int, data: bytes = None):
+        return await async_client.put(
+            f"/upload/sessions/{session_id}",
+            params={"offset": offset},
+            content=DATA[offset:offset + 4] if data is None else data,
+            headers=self.headers(token)
+        )
+
+    async def complete(self, async_client: AsyncClient, token: str, session_id: str, checksum: str):
+        return await async_client.post(
+            f"/upload/sessions/{session_id}/complete",
+            json={"checksum": checksum},
+            headers=self.headers(token)
+        )
+
+    def checksum(self) -> str:
+        return composite_checksum([hashlib.sha1(DATA[offset:offset + 4]).hexdigest() for offset in (0, 4, 8)])
+
+    @pytest.fixture()
+    async def session(self, async_client: AsyncClient, logged_in_token: str) -> Dict:
+        return (await self.create_session(async_client, logged_in_token)).json()
+
+    def test_received_offset(self):
+        assert received_offset(10, 4, []) == 0
+        assert received_offset(10, 4, [1, 3]) == 4
+        assert received_offset(10, 4, [1, 2, 3]) == 10
+
+    async def test_create_session(self, async_client: AsyncClient, logged_in_token: str, mock_b2: Dict):
+        response = await self.create_session(async_client, logged_in_token)
+
+        assert response.status_code == 201
+        assert {"file_name": "myfile.bin", "size": 10, "part_size": 4, "offset": 0, "parts": [], "file_url": None}.items() <= response.json().items()
+        mock_b2["start"].assert_called_once_with("myfile.bin", "b2/x-auto")
+
+    async def test_create_session_idempotency_key(self, async_client: AsyncClient, logged_in_token: str, mock_b2: Dict):
+        headers = {**self.headers(logged_in_token), "Idempotency-Key": "create-session"}
+        first = await async_client.post("/upload/sessions", json={"file_name": "myfile.bin", "size": 10}, headers=headers)
+        second = await async_client.post("/upload/sessions", json={"file_name": "myfile.bin", "size": 10}, headers=headers)
+
+        assert second.json() == first.json()
+        mock_b2["start"].assert_called_once()
+
+    async def test_create_session_requires_authentication(self, async_client: AsyncClient):
+        response = await async_client.post("/upload/sessions", json={"file_name": "myfile.bin", "size": 10})
+
+        assert response.status_code == 401
+
+    async def test_create_session_small_file(self, async_client: AsyncClient, logged_in_token: str):
+        response = await self.create_session(async_client, logged_in_token, size=4)
+
+        assert response.status_code == 400
+
+    async def test_create_session_too_many_parts(self, async_client: AsyncClient, logged_in_token: str, mocker):
+        mocker.patch.object(config, "UPLOAD_MAX_PARTS", 2)
+        response = await self.create_session(async_client, logged_in_token)
+
+        assert response.status_code == 413
+
+    async def test_create_session_storage_unavailable(self, async_client: AsyncClient, logged_in_token: str, mock_b2: Dict):
+        mock_b2["start"].side_effect = CircuitOpenError("b2", 30)
+        response = await self.create_session(async_client, logged_in_token)
+
+        assert response.status_code == 503
+
+    async def test_resumable_upload(self, async_client: AsyncClient, logged_in_token: str, session: Dict, mock_b2: Dict):
+        assert (await self.put_chunk(async_client, logged_in_token, session["id"], 0)).json()["offset"] == 4
+        assert (await self.put_chunk(async_client, logged_in_token, session["id"], 8)).json()["offset"] == 4
+
+        # The connection dropped here, the client asks where to resume
+        response = await async_client.get(f"/upload/sessions/{session['id']}", headers=self.headers(logged_in_token))
+        assert response.json()["offset"] == 4
+        assert response.json()["parts"] == [1, 3]
+
+        response = await self.put_chunk(async_client, logged_in_token, session["id"], 4)
+        assert response.json() == {"part_number": 2, "size": 4, "sha1": hashlib.sha1(b"4567").hexdigest(), "offset": 10}
+
+        response = await self.complete(async_client, logged_in_token, session["id"], self.checksum())
+        assert response.status_code == 200
+        assert response.json()["file_url"] == "https://fakeurl.com"
+        mock_b2["part"].assert_any_call("b2-file-id", 3, b"89", hashlib.sha1(b"89").hexdigest())
+        mock_b2["finish"].assert_called_once_with("b2-file-id", [hashlib.sha1(DATA[offset:offset + 4]).hexdigest() for offset in (0, 4, 8)])
+
+    async def test_chunk_sent_again(self, async_client: AsyncClient, logged_in_token: str, session: Dict):
+        for offset in (0, 0, 4, 8):
+            await self.put_chunk(async_client, logged_in_token, session["id"], offset)
+
+        response = await async_client.get(f"/upload/sessions/{session['id']}", headers=self.headers(logged_in_token))
+        assert response.json()["parts"] == [1, 2, 3]
+
+    @pytest.mark.parametrize("offset", [-4, 2, 12])
+    async def test_chunk_invalid_offset(self, async_client: AsyncClient, logged_in_token: str, session: Dict, offset: int):
+        response = await self.put_chunk(async_client, logged_in_token, session["id"], offset, data=b"0123")
+
+        assert response.status_code == 400
+
+    async def test_chunk_wrong_size(self, async_client: AsyncClient, logged_in_token: str, session: Dict):
+        assert (await self.put_chunk(async_client, logged_in_token, session["id"], 0, data=b"012")).status_code == 400
+        assert (await self.put_chunk(async_client, logged_in_token, session["id"], 8, data=b"0123")).status_code == 413
+
+    async def test_complete_missing_parts(self, async_client: AsyncClient, logged_in_token: str, session: Dict):
+        await self.put_chunk(async_client, logged_in_token, session["id"], 0)
+        response = await self.complete(async_client, logged_in_token, session["id"], self.checksum())
+
+        assert response.status_code == 409
+        assert "[2, 3]" in response.json()["detail"]
+
+    async def test_complete_wrong_checksum(self, async_client: AsyncClient, logged_in_token: str, session: Dict, mock_b2: Dict):
+        for offset in (0, 4, 8):
+            await self.put_chunk(async_client, logged_in_token, session["id"], offset)
+
+        response = await self.complete(async_client, logged_in_token, session["id"], "0" * 40)
+
+        assert response.status_code == 422
+        mock_b2["finish"].assert_not_called()
+
+    async def test_complete_twice(self, async_client: AsyncClient, logged_in_token: str, session: Dict, mock_b2: Dict):
+        for offset in (0, 4, 8):
+            await self.put_chunk(async_client, logged_in_token, session["id"], offset)
+
+        await self.complete(async_client, logged_in_token, session["id"], self.checksum())
+        response = await self.complete(async_client, logged_in_token, session["id"], self.checksum())
+
+        assert response.json()["file_url"] == "https://fakeurl.com"
+        assert mock_b2["finish"].call_count == 1
+        assert (await self.put_chunk(async_client, logged_in_token, session["id"], 0)).status_code == 409
+
+    async def test_chunk_after_concurrent_complete(self, async_client: AsyncClient, logged_in_token: str, session: Dict, mock_b2: Dict, mocker):
+        # The session was read before another request completed the upload
+        stale = await database.fetch_one(upload_session_table.select().where(upload_session_table.c.id == session["id"]))
+        mocker.patch("storeapi.routers.upload.find_upload_session", return_value=stale)
+        await database.execute(upload_session_table.update().where(upload_session_table.c.id == session["id"]).values(file_url="https://fakeurl.com"))
+
+        response = await self.put_chunk(async_client, logged_in_token, session["id"], 0)
+
+        assert response.status_code == 409
+        mock_b2["part"].assert_not_called()
+
+    async def test_complete_after_concurrent_complete(self, async_client: AsyncClient, logged_in_token: str, session: Dict, mock_b2: Dict, mocker):
+        for offset in (0, 4, 8):
+            await self.put_chunk(async_client, logged_in_token, session["id"], offset)
+        stale = await database.fetch_one(upload_session_table.select().where(upload_session_table.c.id == session["id"]))
+        mocker.patch("storeapi.routers.upload.find_upload_session", return_value=stale)
+        await database.execute(upload_session_table.update().where(upload_session_table.c.id == session["id"]).values(file_url="https://stored.com"))
+
+        response = await self.complete(async_client, logged_in_token, session["id"], self.checksum())
+
+        assert response.json()["file_url"] == "https://stored.com"
+        mock_b2["finish"].assert_not_called()
+
+    async def test_cancel_session(self, async_client: AsyncClient, logged_in_token: str, session: Dict, mock_b2: Dict):
+        await self.put_chunk(async_client, logged_in_token, session["id"], 0)
+        response = await async_client.delete(f"/upload/sessions/{session['id']}", headers=self.headers(logged_in_token))
+
+        assert response.status_code == 204
+        mock_b2["cancel"].assert_called_once_with("b2-file-id")
+        response = await async_client.get(f"/upload/sessions/{session['id']}", headers=self.headers(logged_in_token))
+        assert response.status_code == 404
+
+    async def test_session_not_found(self, async_client: AsyncClient, logged_in_token: str):
+        response = await async_client.get("/upload/sessions/missing", headers=self.headers(logged_in_token))
+
+        assert response.status_code == 404
+
+    async def expire(self, session_id: str) -> None:
+        await database.execute(upload_session_table.update().where(upload_session_table.c.id == session_id).values(expires_at=time.time() - 1))
+
+    async def test_session_expires(self, session: Dict):
+        assert time.time() < session["expires_at"] <= time.time() + config.UPLOAD_SESSION_TTL
+
+    async def test_chunk_extends_expiry(self, async_client: AsyncClient, logged_in_token: str, session: Dict):
+        await database.execute(upload_session_table.update().where(upload_session_table.c.id == session["id"]).values(expires_at=time.time() + 1))
+        await self.put_chunk(async_client, logged_in_token, session["id"], 0)
+
+        response = await async_client.get(f"/upload/sessions/{session['id']}", headers=self.headers(logged_in_token))
+        assert response.json()["expires_at"] > time.time() + config.UPLOAD_SESSION_TTL - 60
+
+    async def test_expired_session(self, async_client: AsyncClient, logged_in_token: str, session: Dict, mock_b2: Dict):
+        await self.expire(session["id"])
+
+        assert (await async_client.get(f"/upload/sessions/{session['id']}", headers=self.headers(logged_in_token))).status_code == 410
+        assert (await self.put_chunk(async_client, logged_in_token, session["id"], 0)).status_code == 410
+        assert (await async_client.delete(f"/upload/sessions/{session['id']}", headers=self.headers(logged_in_token))).status_code == 204
+        mock_b2["cancel"].assert_called_once_with("b2-file-id")
+
+    async def test_sweep_expired_sessions(self, async_client: AsyncClient, logged_in_token: str, session: Dict, mock_b2: Dict):
+        active = (await self.create_session(async_client, logged_in_token)).json()
+        await self.expire(session["id"])
+
+        assert await sweep_upload_sessions() == 1
+        mock_b2["cancel"].assert_called_once_with("b2-file-id")
+        assert (await async_client.get(f"/upload/sessions/{session['id']}", headers=self.headers(logged_in_token))).status_code == 404
+        assert (await async_client.get(f"/upload/sessions/{active['id']}", headers=self.headers(logged_in_token))).status_code == 200
+
+    async def test_sweep_keeps_completed_sessions(self, async_client: AsyncClient, logged_in_token: str, session: Dict, mock_b2: Dict):
+        for offset in (0, 4, 8):
+            await self.put_chunk(async_client, logged_in_token, session["id"], offset)
+        await self.complete(async_client, logged_in_token, session["id"], self.checksum())
+        await self.expire(session["id"])
+
+        assert await sweep_upload_sessions() == 0
+        response = await async_client.get(f"/upload/sessions/{session['id']}", headers=self.headers(logged_in_token))
+        assert response.json()["file_url"] == "https://fakeurl.com"
+
+    async def test_sweep_retries_failed_cancel(self, async_client: AsyncClient, logged_in_token: str, session: Dict, mock_b2: Dict):
+        await self.expire(session["id"])
+        mock_b2["cancel"].side_effect = CircuitOpenError("Circuit breaker 'b2' is open")
+
+        assert await sweep_upload_sessions() == 0
+
+        mock_b2["cancel"].side_effect = None
+        assert await sweep_upload_sessions() == 1
+
+@pytest.mark.anyio
+class TestUploadAuthorizations:
+
+    @pytest.fixture(autouse=True)
+    def mock_b2(self, mocker) -> Dict:
+        return {
+            "authorize": mocker.patch(
+                "storeapi.routers.upload.b2_get_upload_authorization",
+                return_value=("https://upload.example.net", "upload-token")
+            ),
+            "file": mocker.patch("storeapi.routers.upload.b2_get_uploaded_file")
+        }
+
+    def headers(self, token: str) -> Dict:
+        return {"Authorization": f"Bearer {token}"}
+
+    async def complete(self, async_client: AsyncClient, token: str, authorization_id: str, file_id: str = "b2-file-id"):
+        return await async_client.post(
+            f"/upload/authorizations/{authorization_id}/complete",
+            json={"file_id": file_id},
+            headers=self.headers(token)
+        )
+
+    @pytest.fixture()
+    async def authorization(self, async_client: AsyncClient, logged_in_token: str, mock_b2: Dict) -> Dict:
+        response = await async_client.post(
+            "/upload/authorizations",
+            json={"file_name": "../photos/myfile.png"},
+            headers=self.headers(logged_in_token)
+        )
+        authorization = response.json()
+        mock_b2["file"].return_value = (authorization["file_name"], "https://fakeurl.com")
+        return authorization
+
+    async def test_create_authorization(self, authorization: Dict, confirmed_user: Dict):
+        assert authorization["upload_url"] == "https://upload.example.net"
+        assert authorization["authorization_token"] == "upload-token"
+        assert authorization["file_name"] == f"uploads/{confirmed_user['id']}/{authorization['id']}/myfile.png"
+
+    async def test_create_authorization_requires_authentication(self, async_client: AsyncClient):
+        response = await async_client.post("/upload/authorizations", json={"file_name": "myfile.png"})
+
+        assert response.status_code == 401
+
+    async def test_create_authorization_storage_unavailable(self, async_client: AsyncClient, logged_in_token: str, mock_b2: Dict):
+        mock_b2["authorize"].side_effect = CircuitOpenError("b2", 30)
+        response = await async_client.post("/upload/authorizations", json={"file_name": "myfile.png"}, headers=self.headers(logged_in_token))
+
+        assert response.status_code == 503
+
+    async def test_complete(self, async_client: AsyncClient, logged_in_token: str, authorization: Dict, mock_b2: Dict):
+        response = await self.complete(async_client, logged_in_token, authorization["id"])
+
+        assert response.status_code == 200
+        assert response.json()["file_url"] == "https://fakeurl.com"
+        mock_b2["file"].assert_called_once_with("b2-file-id")
+
+    async def test_complete_twice(self, async_client: AsyncClient, logged_in_token: str, authorization: Dict, mock_b2: Dict):
+        await self.complete(async_client, logged_in_token, authorization["id"])
+        response = await self.complete(async_client, logged_in_token, authorization["id"])
+
+        assert response.json()["file_url"] == "https://fakeurl.com"
+        assert mock_b2["file"].call_count == 1
+        assert (await self.complete(async_client, logged_in_token, authorization["id"], "other-file-id")).status_code == 409
+
+    async def test_complete_other_file(self, async_client: AsyncClient, logged_in_token: str, authorization: Dict, mock_b2: Dict):
+        mock_b2["file"].return_value = ("uploads/other.png", "https://fakeurl.com")
+        response = await self.complete(async_client, logged_in_token, authorization["id"])
+
+        assert response.status_code == 400
+
+    async def test_complete_missing_file(self, async_client: AsyncClient, logged_in_token: str, authorization: Dict, mock_b2: Dict):
+        mock_b2["file"].return_value = None
+        response = await self.complete(async_client, logged_in_token, authorization["id"])
+
+        assert response.status_code == 400
+
+    async def test_complete_expired(self, async_client: AsyncClient, logged_in_token: str, authorization: Dict, mocker):
+        mocker.patch("storeapi.routers.upload.time", **{"time.return_value": authorization["expires_at"] + 1})
+        response = await self.complete(async_client, logged_in_token, authorization["id"])
+
+        assert response.status_code == 410
+
+    async def test_complete_not_found(self, async_client: AsyncClient, logged_in_token: str):
+        response = await self.complete(async_client, logged_in_token, "missing")
+
+        assert response.status_code == 404
+
+@pytest.mark.anyio
+class TestUploadWithFakeB2:
+
+    def headers(self, token: str) -> Dict:
+        return {"Authorization": f"Bearer {token}"}
+
+    async def test_resumable_upload(self, async_client: AsyncClient, logged_in_token: str, fake_b2, mocker):
+        mocker.patch.object(config, "UPLOAD_PART_SIZE", 4)
+        session = (await async_client.post(
+            "/upload/sessions",
+            json={"file_name": "myfile.bin", "size": len(DATA)},
+            headers=self.headers(logged_in_token)
+        )).json()
+        for offset in (0, 4, 8):
+            await async_client.put(
+                f"/upload/sessions/{session['id']}",
+                params={"offset": offset},
+                content=DATA[offset:offset + 4],
+                headers=self.headers(logged_in_token)
+            )
+
+        checksum = composite_checksum([hashlib.sha1(DATA[offset:offset + 4]).hexdigest() for offset in (0, 4, 8)])
+        response = await async_client.post(
+            f"/upload/sessions/{session['id']}/complete",
+            json={"checksum": checksum},
+            headers=self.headers(logged_in_token)
+        )
+
+        assert response.status_code == 200
+        assert fake_b2.file_names == ["myfile.bin"]
+
+    async def test_direct_upload(self, async_client: AsyncClient, logged_in_token: str, fake_b2):
+        authorization = (await async_client.post(
+            "/upload/authorizations",
+            json={"file_name": "myfile.png"},
+            headers=self.headers(logged_in_token)
+        )).json()
+        file_id = fake_b2.upload(DATA, authorization["file_name"])
+
+        response = await async_client.post(
+            f"/upload/authorizations/{authorization['id']}/complete",
+            json={"file_id": file_id},
+            headers=self.headers(logged_in_token)
+        )
+
+        assert response.status_code == 200
+        assert file_id in response.json()["file_url"]
+        assert fake_b2.download(file_id) == DATA
@@ -3,6 +3,7 @@ from typing import Dict
 from httpx import AsyncClient
 from fastapi import BackgroundTasks
 from storeapi import tasks
+from storeapi.config import rebuild_runtime_settings
 
 @pytest.mark.anyio
 class TestUser:
@@ -21,13 +22,21 @@ class TestUser:
         assert response.status_code == 200
         assert "User confirmed" in response.json()["detail"]
 
+    async def test_register_user_sends_confirmation_email(self, async_client: AsyncClient, fake_mailgun, mocker):
+        spy = mocker.spy(BackgroundTasks, "add_task")
+        await self.register_user(async_client, "test@example.com", "1234")
+        confirmation_url = str(spy.call_args[1]["confirmation_url"])
+
+        assert [(email["to"], email["subject"]) for email in fake_mailgun.emails] == [("test@example.com", "Successfully signed up")]
+        assert confirmation_url in fake_mailgun.emails[0]["text"]
+
     async def test_confirm_user_invalid_token(self, async_client: AsyncClient):
         response = await async_client.get("/confim/invalid_token")
 
         assert response.status_code == 401
 
     async def test_confirm_user_expired_token(self, async_client: AsyncClient, mocker):
-        mocker.patch("storeapi.security.confirm_token_expire_minutes", return_value=-1)
+        rebuild_runtime_settings(CONFIRM_EXPIRATION=-1)
         spy = mocker.spy(BackgroundTasks, "add_task")
         await self.register_user(async_client, "test@example.com", "1234")
         confirmation_url = str(spy.call_args[1]["confirmation_url"])
@@ -0,0 +1,119 @@
+import pytest
+from contextlib import ExitStack
+from typing import Dict
+from httpx import AsyncClient
+from storeapi.circuitbreaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError
+from storeapi.tests.fake_clock import FakeClock
+
+@pytest.mark.anyio
+class TestCircuitBreaker:
+
+    @pytest.fixture()
+    def breaker(self, clock: FakeClock) -> CircuitBreaker:
+        return CircuitBreaker("test", failure_rate=0.5, min_calls=4, window=10, reset_timeout=30, min_timeout=1, max_timeout=60, clock=clock)
+
+    def call(self, breaker: CircuitBreaker, clock: FakeClock, latency: float = 0.1, fail: bool = False):
+        with breaker.guard():
+            clock.now += latency
+            if fail:
+                raise ValueError("failed")
+
+    def fail(self, breaker: CircuitBreaker, clock: FakeClock, times: int = 1):
+        for _ in range(times):
+            with pytest.raises(ValueError):
+                self.call(breaker, clock, fail=True)
+
+    def test_opens_after_failure_rate(self, breaker: CircuitBreaker, clock: FakeClock):
+        self.call(breaker, clock)
+        self.fail(breaker, clock, 2)
+        assert breaker.state == CLOSED
+
+        self.fail(breaker, clock)
+        assert breaker.state == OPEN
+
+        with pytest.raises(CircuitOpenError):
+            self.call(breaker, clock)
+
+        assert breaker.rejected == 1
+
+    def test_half_open_trial_closes(self, breaker: CircuitBreaker, clock: FakeClock):
+        self.fail(breaker, clock, 4)
+        clock.now += 30
+
+        self.call(breaker, clock)
+
+        assert breaker.state == CLOSED
+        assert breaker.current_failure_rate == 0
+
+    def test_half_open_trial_reopens(self, breaker: CircuitBreaker, clock: FakeClock):
+        self.fail(breaker, clock, 4)
+        clock.now += 30
+        self.fail(breaker, clock)
+
+        assert breaker.state == OPEN
+        with pytest.raises(CircuitOpenError):
+            self.call(breaker, clock)
+
+    def test_half_open_allows_single_trial(self, breaker: CircuitBreaker, clock: FakeClock):
+        self.fail(breaker, clock, 4)
+        clock.now += 30
+
+        with breaker.guard():
+            assert breaker.state == HALF_OPEN
+            with pytest.raises(CircuitOpenError):
+                self.call(breaker, clock)
+
+    def test_stale_outcome_is_ignored(self, breaker: CircuitBreaker, clock: FakeClock):
+        with pytest.raises(ValueError):
+            with breaker.guard():
+                self.fail(breaker, clock, 4)
+                clock.now += 30
+                with breaker.guard():
+                    assert breaker.trial_in_progress is True
+
+                assert breaker.state == CLOSED
+                raise ValueError("failed")
+
+        assert breaker.state == CLOSED
+        assert breaker.current_failure_rate == 0
+
+    def test_stale_call_does_not_release_trial(self, breaker: CircuitBreaker, clock: FakeClock):
+        with ExitStack() as trial:
+            with breaker.guard():
+                self.fail(breaker, clock, 4)
+                clock.now += 30
+                trial.enter_context(breaker.guard())
+
+            # The call admitted while closed finished during the trial
+            assert breaker.trial_in_progress is True
+            with pytest.raises(CircuitOpenError):
+                self.call(breaker, clock)
+
+        assert breaker.state == CLOSED
+        assert breaker.trial_in_progress is False
+
+    def test_adaptive_timeout(self, breaker: CircuitBreaker, clock: FakeClock):
+        assert breaker.timeout == 60
+
+        for latency in [0.1, 0.2, 0.3, 2]:
+            self.call(breaker, clock, latency)
+
+        assert breaker.timeout == pytest.approx(6)
+
+    def test_adaptive_timeout_minimum(self, breaker: CircuitBreaker, clock: FakeClock):
+        for _ in range(4):
+            self.call(breaker, clock, 0.01)
+
+        assert breaker.timeout == 1
+
+    async def test_metrics_endpoint(self, async_client: AsyncClient, metrics_headers: Dict[str, str]):
+        response = await async_client.get("/metrics/circuit-breakers", headers=metrics_headers)
+
+        assert response.status_code == 200
+        assert {"mailgun", "deepai", "b2"} <= response.json().keys()
+        assert response.json()["deepai"]["state"] == CLOSED
+
+    async def test_metrics_endpoint_requires_token(self, async_client: AsyncClient, metrics_headers: Dict[str, str]):
+        response = await async_client.get("/metrics/circuit-breakers")
+
+        assert response.status_code == 401
@@ -0,0 +1,115 @@
+import pytest
+import zstandard
+from typing import AsyncGenerator
+from fastapi import FastAPI
+from fastapi.responses import Response, StreamingResponse
+from httpx import ASGITransport, AsyncClient
+from storeapi import compression
+from storeapi.compression import CompressionMiddleware, available_encoders, choose_encoder, parse_accept_encoding
+
+BODY = b'{"id": 1, "body": "Test Post", "user_id": 1, "likes": 0}' * 100
+
+def create_app(**kwargs) -> FastAPI:
+    app = FastAPI()
+    app.add_middleware(CompressionMiddleware, **kwargs)
+
+    @app.get("/json")
+    async def json():
+        return Response(BODY, media_type="application/json")
+
+    @app.get("/small")
+    async def small():
+        return Response(b'{"id": 1}', media_type="application/json")
+
+    @app.get("/image")
+    async def image():
+        return Response(BODY, media_type="image/png")
+
+    @app.get("/stream")
+    async def stream():
+        async def lines():
+            for _ in range(10):
+                yield BODY
+
+        return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+    return app
+
+@pytest.mark.anyio
+class TestCompression:
+
+    @pytest.fixture()
+    async def client(self) -> AsyncGenerator:
+        async with AsyncClient(transport=ASGITransport(app=create_app(minimum_size=500)), base_url="http://test") as client:
+            yield client
+
+    def test_parse_accept_encoding(self):
+        assert parse_accept_encoding("gzip, br;q=0.8, *;q=0") == {"gzip": 1.0, "br": 0.8, "*": 0.0}
+        assert parse_accept_encoding("") == {}
+
+    @pytest.mark.parametrize("accept_encoding, expected", [
+        ("gzip", "gzip"),
+        ("gzip, br", "br"),
+        ("gzip, br, zstd", "zstd"),
+        ("gzip, br;q=0.5", "gzip"),
+        ("*", "zstd"),
+        ("identity", None),
+        ("gzip;q=0", None)
+    ])
+    def test_choose_encoder(self, accept_encoding: str, expected: str):
+        encoder = choose_encoder(available_encoders(6, 4, 3), accept_encoding)
+        assert (encoder and encoder.name) == expected
+
+    def test_without_optional_encoders(self, mocker):
+        mocker.patch.object(compression, "brotli", None)
+        mocker.patch.object(compression, "zstandard", None)
+
+        assert [encoder.name for encoder in available_encoders(6, 4, 3)] == ["gzip"]
+
+    async def test_gzip(self, client: AsyncClient):
+        response = await client.get("/json", headers={"Accept-Encoding": "gzip"})
+
+        assert response.headers["content-encoding"] == "gzip"
+        assert response.headers["vary"] == "Accept-Encoding"
+        assert int(response.headers["content-length"]) < len(BODY)
+        assert response.content == BODY
+
+    async def test_zstd(self, client: AsyncClient):
+        response = await client.get("/json", headers={"Accept-Encoding": "zstd"})
+
+        assert response.headers["content-encoding"] == "zstd"
+        assert zstandard.ZstdDecompressor().decompress(response.content) == BODY
+
+    async def test_below_minimum_size(self, client: AsyncClient):
+        response = await client.get("/small", headers={"Accept-Encoding": "gzip"})
+
+        assert "content-encoding" not in response.headers
+        assert response.content == b'{"id": 1}'
+
+    async def test_skips_compressed_media(self, client: AsyncClient):
+        response = await client.get("/image", headers={"Accept-Encoding": "gzip"})
+
+        assert "content-encoding" not in response.headers
+        assert response.content == BODY
+
+    async def test_not_accepted(self, client: AsyncClient):
+        response = await client.get("/json", headers={"Accept-Encoding": "identity"})
+
+        assert "content-encoding" not in response.headers
+        assert response.content == BODY
+
+    async def test_streaming(self, client: AsyncClient):
+        response = await client.get("/stream", headers={"Accept-Encoding": "gzip"})
+
+        assert response.headers["content-encoding"] == "gzip"
+        assert "content-length" not in response.headers
+        assert response.content == BODY * 10
+
+    async def test_large_bodies_are_offloaded(self, mocker):
+        run_sync = mocker.spy(compression.anyio.to_thread, "run_sync")
+        app = create_app(minimum_size=500, offload_size=len(BODY))
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+            response = await client.get("/json", headers={"Accept-Encoding": "gzip"})
+
+        assert run_sync.call_count == 1
+        assert response.content == BODY
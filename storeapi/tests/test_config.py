@@ -0,0 +1,49 @@
+import pytest
+import subprocess
+import sys
+from datetime import timedelta
+from storeapi.config import GlobalConfig, RuntimeSettings, config, get_runtime_settings, rebuild_runtime_settings, reset_config
+
+@pytest.mark.anyio
+class TestConfig:
+
+    def test_runtime_settings_from_config(self):
+        settings = RuntimeSettings.from_config(config.resolve())
+        assert settings.algorithms == (config.ALGORITHM,)
+        assert settings.access_token_expiration == timedelta(minutes=config.EXPIRATION)
+        assert settings.confirmation_token_expiration == timedelta(minutes=config.CONFIRM_EXPIRATION)
+
+    def test_runtime_settings_is_frozen(self):
+        with pytest.raises(ValueError):
+            get_runtime_settings().algorithm = "none"
+
+    def test_get_runtime_settings_is_built_once(self):
+        assert get_runtime_settings() is get_runtime_settings()
+
+    def test_rebuild_runtime_settings_with_overrides(self):
+        settings = rebuild_runtime_settings(EXPIRATION=-1)
+        assert get_runtime_settings() is settings
+        assert settings.access_token_expiration == timedelta(minutes=-1)
+        assert config.EXPIRATION == 30
+
+    def test_invalid_rate_limit(self):
+        with pytest.raises(ValueError, match="60/fortnight"):
+            GlobalConfig(RATE_LIMIT_LIKE="60/fortnight")
+
+    def test_reset_config(self, monkeypatch):
+        before = config.resolve()
+        monkeypatch.setenv("TEST_EXPIRATION", "5")
+        reset_config()
+        assert config.resolve() is not before
+        assert config.EXPIRATION == 5
+
+        monkeypatch.delenv("TEST_EXPIRATION")
+        reset_config()
+        assert config.EXPIRATION == 30
+
+    def test_importing_app_does_not_build_config(self):
+        # Settings, the database and the other singletons are built on first
+        # use, so a fresh interpreter can import the app without any config
+        code = "import storeapi.main; from storeapi.config import config; print(config._config is None)"
+        result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+        assert result.stdout.strip() == "True"
@@ -0,0 +1,42 @@
+import pytest
+import sqlalchemy
+from typing import Dict
+from databases import Database
+from sqlalchemy.dialects import postgresql, sqlite
+from storeapi.database import CachedQuery, user_table
+
+@pytest.mark.anyio
+class TestDatabase:
+
+    @pytest.fixture()
+    def query(self) -> CachedQuery:
+        return CachedQuery(user_table.select().where(user_table.c.email == sqlalchemy.bindparam("email")))
+
+    def test_compile_is_cached_per_dialect(self, query: CachedQuery):
+        dialect = sqlite.dialect()
+
+        assert query.compile(dialect) is query.compile(dialect)
+        assert query.compile(dialect) is query.compile(sqlite.dialect())
+
+    def test_bind_values(self, query: CachedQuery):
+        first = query.bind(email="first@example.net").compile(sqlite.dialect())
+        second = query.bind(email="second@example.net").compile(sqlite.dialect())
+
+        assert first.string == second.string
+        assert first.params == {"email": "first@example.net"}
+        assert second.construct_params() == {"email": "second@example.net"}
+
+    def test_dialect_statements(self):
+        query = CachedQuery(
+            user_table.insert().values(email=sqlalchemy.bindparam("email")),
+            {"sqlite": sqlite.insert(user_table).values(email=sqlalchemy.bindparam("email")).on_conflict_do_nothing()}
+        )
+
+        assert "ON CONFLICT DO NOTHING" in query.compile(sqlite.dialect()).string
+        assert "ON CONFLICT" not in query.compile(postgresql.dialect()).string
+
+    async def test_fetch_bound_query(self, query: CachedQuery, registered_user: Dict, db: Database):
+        user = await db.fetch_one(query.bind(email=registered_user["email"]))
+
+        assert user.id == registered_user["id"]
+        assert await db.fetch_one(query.bind(email="missing@example.net")) is None
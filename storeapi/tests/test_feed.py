@@ -0,0 +1,51 @@
+import pytest
+from storeapi.feed import FeedBroker, FeedHub, InMemoryBroker
+
+@pytest.mark.anyio
+class TestFeed:
+
+    @pytest.fixture()
+    def hub(self) -> FeedHub:
+        return FeedHub(buffer_size=2)
+
+    async def test_publish_fans_out(self, hub: FeedHub):
+        first, second = hub.subscribe(), hub.subscribe()
+        await hub.publish("post_created", post={"id": 1})
+
+        assert await first.get() == {"type": "post_created", "post": {"id": 1}}
+        assert await second.get() == {"type": "post_created", "post": {"id": 1}}
+
+    async def test_unsubscribe(self, hub: FeedHub):
+        subscription = hub.subscribe()
+        hub.unsubscribe(subscription)
+        await hub.publish("post_created", post={"id": 1})
+
+        assert subscription.queue.empty()
+
+    async def test_slow_subscriber_evicted(self, hub: FeedHub):
+        slow, fast = hub.subscribe(), hub.subscribe()
+        for post_id in range(3):
+            await hub.publish("post_created", post={"id": post_id})
+            await fast.get()
+
+        assert slow.evicted
+        assert await slow.get() is None
+        assert hub.subscriptions == {fast}
+        assert hub.evictions == 1
+
+    async def test_broker_shared_between_hubs(self):
+        broker = InMemoryBroker()
+        first, second = FeedHub(broker=broker), FeedHub(broker=broker)
+        subscription = second.subscribe()
+
+        await first.publish("post_liked", post_id=1, likes=2)
+
+        assert await subscription.get() == {"type": "post_liked", "post_id": 1, "likes": 2}
+
+    def test_partial_broker_cannot_be_created(self):
+        class PublishOnlyBroker(FeedBroker):
+            async def publish(self, event):
+                pass
+
+        with pytest.raises(TypeError):
+            PublishOnlyBroker()
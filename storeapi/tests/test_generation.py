@@ -0,0 +1,100 @@
+import asyncio
+import pytest
+from typing import List
+from storeapi.generation import GenerationScheduler
+from storeapi.tests.fake_clock import FakeClock
+
+class FakeGenerator:
+    def __init__(self) -> None:
+        self.calls: List[str] = []
+        self.release = asyncio.Event()
+        self.running = 0
+        self.max_running = 0
+
+    def __call__(self, prompt: str, fail: bool = False):
+        async def generate():
+            self.calls.append(prompt)
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+            try:
+                await self.release.wait()
+                if fail:
+                    raise ValueError(prompt)
+                return {"output_url": f"https://example.net/{prompt}"}
+            finally:
+                self.running -= 1
+
+        return generate
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+@pytest.mark.anyio
+class TestGeneration:
+
+    @pytest.fixture()
+    def scheduler(self, clock: FakeClock) -> GenerationScheduler:
+        return GenerationScheduler(max_concurrency=2, cache_ttl=60, cache_size=2, clock=clock)
+
+    @pytest.fixture()
+    def generator(self) -> FakeGenerator:
+        return FakeGenerator()
+
+    async def test_concurrent_identical_prompts_coalesce(self, scheduler: GenerationScheduler, generator: FakeGenerator):
+        tasks = [asyncio.create_task(scheduler.run("cat", generator("cat"))) for _ in range(3)]
+        await settle()
+        generator.release.set()
+
+        results = await asyncio.gather(*tasks)
+
+        assert generator.calls == ["cat"]
+        assert results == [{"output_url": "https://example.net/cat"}] * 3
+
+    async def test_results_cached_until_ttl(self, scheduler: GenerationScheduler, generator: FakeGenerator, clock: FakeClock):
+        generator.release.set()
+        await scheduler.run("cat", generator("cat"))
+        await scheduler.run("cat", generator("cat"))
+        assert generator.calls == ["cat"]
+
+        clock.now = 61
+        await scheduler.run("cat", generator("cat"))
+        assert generator.calls == ["cat", "cat"]
+
+    async def test_cache_is_bounded(self, scheduler: GenerationScheduler, generator: FakeGenerator):
+        generator.release.set()
+        for prompt in ["a", "b", "c"]:
+            await scheduler.run(prompt, generator(prompt))
+
+        assert list(scheduler.cache) == ["b", "c"]
+
+    async def test_failures_are_not_cached(self, scheduler: GenerationScheduler, generator: FakeGenerator):
+        generator.release.set()
+        with pytest.raises(ValueError):
+            await scheduler.run("cat", generator("cat", fail=True))
+
+        await scheduler.run("cat", generator("cat"))
+
+        assert generator.calls == ["cat", "cat"]
+        assert scheduler.in_flight == {}
+
+    async def test_concurrency_bound_and_priority(self, scheduler: GenerationScheduler, generator: FakeGenerator):
+        tasks = [asyncio.create_task(scheduler.run(prompt, generator(prompt), priority)) for prompt, priority in [("a", 5), ("b", 5), ("low", 9), ("high", 1)]]
+        await settle()
+        assert generator.calls == ["a", "b"]
+
+        generator.release.set()
+        await asyncio.gather(*tasks)
+
+        assert generator.calls == ["a", "b", "high", "low"]
+        assert generator.max_running == 2
+        assert scheduler.running == 0
+
+    async def test_cancelled_caller_does_not_cancel_generation(self, scheduler: GenerationScheduler, generator: FakeGenerator):
+        first = asyncio.create_task(scheduler.run("cat", generator("cat")))
+        second = asyncio.create_task(scheduler.run("cat", generator("cat")))
+        await settle()
+        first.cancel()
+        generator.release.set()
+
+        assert await second == {"output_url": "https://example.net/cat"}
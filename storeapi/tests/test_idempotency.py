@@ -0,0 +1,198 @@
+import asyncio
+import pytest
+from typing import AsyncGenerator, Dict
+from fastapi import FastAPI, HTTPException, Request
+from httpx import ASGITransport, AsyncClient
+from storeapi.idempotency import IdempotencyMiddleware, IdempotencyStore, MemoryIdempotencyStore, StoredResponse
+from storeapi.tests.fake_clock import FakeClock
+
+def create_app(store: MemoryIdempotencyStore, calls: Dict[str, int], release: asyncio.Event, wait_timeout: float = 30) -> FastAPI:
+    app = FastAPI()
+    app.add_middleware(IdempotencyMiddleware, store=store, paths=["/items", "/fail"], wait_timeout=wait_timeout)
+
+    @app.post("/items", status_code=201)
+    async def create_item(request: Request):
+        calls["items"] += 1
+        await release.wait()
+        return {"id": calls["items"], "body": (await request.json())["body"]}
+
+    @app.post("/items/{item_id}/archive")
+    async def archive_item(item_id: int):
+        calls["items"] += 1
+        return {"id": item_id, "archived": calls["items"]}
+
+    @app.post("/itemsets")
+    async def create_itemset():
+        calls["items"] += 1
+        return {"id": calls["items"]}
+
+    @app.post("/fail")
+    async def fail():
+        calls["fail"] += 1
+        raise HTTPException(status_code=503, detail="Unavailable")
+
+    return app
+
+@pytest.mark.anyio
+class TestIdempotency:
+
+    @pytest.fixture()
+    def store(self, clock: FakeClock) -> MemoryIdempotencyStore:
+        return MemoryIdempotencyStore(ttl=60, max_size=2, clock=clock)
+
+    @pytest.fixture()
+    def calls(self) -> Dict[str, int]:
+        return {"items": 0, "fail": 0}
+
+    @pytest.fixture()
+    def release(self) -> asyncio.Event:
+        release = asyncio.Event()
+        release.set()
+        return release
+
+    @pytest.fixture()
+    async def client(self, store: MemoryIdempotencyStore, calls: Dict[str, int], release: asyncio.Event) -> AsyncGenerator:
+        transport = ASGITransport(app=create_app(store, calls, release))
+        async with AsyncClient(transport=transport, base_url="http://test") as client:
+            yield client
+
+    async def post(self, client: AsyncClient, key: str, body: str = "Test", path: str = "/items"):
+        return await client.post(path, json={"body": body}, headers={"Idempotency-Key": key})
+
+    async def test_store_reserve_and_complete(self, store: MemoryIdempotencyStore):
+        assert await store.reserve("key") is None
+
+        entry = await store.reserve("key")
+        assert not entry.done.is_set()
+
+        await store.complete("key", "fingerprint", StoredResponse(201, [], b"{}"))
+        assert entry.done.is_set()
+        assert (await store.reserve("key")).response.status == 201
+
+    async def test_store_release(self, store: MemoryIdempotencyStore):
+        await store.reserve("key")
+        await store.release("key")
+
+        assert await store.reserve("key") is None
+
+    async def test_store_expiry(self, store: MemoryIdempotencyStore, clock: FakeClock):
+        await store.reserve("key")
+        await store.complete("key", "fingerprint", StoredResponse(201, [], b"{}"))
+        clock.now += 61
+
+        assert await store.reserve("key") is None
+
+    async def test_store_is_bounded(self, store: MemoryIdempotencyStore):
+        for key in ("first", "second", "third"):
+            await store.reserve(key)
+            await store.complete(key, "fingerprint", StoredResponse(201, [], b"{}"))
+
+        assert list(store.entries) == ["second", "third"]
+
+    async def test_store_keeps_in_flight_entries(self, store: MemoryIdempotencyStore, clock: FakeClock):
+        for key in ("first", "second"):
+            await store.reserve(key)
+        clock.now += 61
+        await store.reserve("third")
+
+        assert list(store.entries) == ["first", "second", "third"]
+        assert not (await store.reserve("first")).done.is_set()
+
+        await store.complete("first", "fingerprint", StoredResponse(201, [], b"{}"))
+        await store.reserve("fourth")
+        assert list(store.entries) == ["second", "third", "fourth"]
+
+    def test_partial_store_cannot_be_created(self):
+        class ReserveOnlyStore(IdempotencyStore):
+            async def reserve(self, key):
+                return None
+
+        with pytest.raises(TypeError):
+            ReserveOnlyStore()
+
+    async def test_retry_returns_stored_response(self, client: AsyncClient, calls: Dict[str, int]):
+        first = await self.post(client, "key")
+        second = await self.post(client, "key")
+
+        assert calls["items"] == 1
+        assert second.status_code == 201
+        assert second.json() == first.json()
+        assert second.headers["idempotent-replayed"] == "true"
+
+    async def test_covers_paths_below(self, client: AsyncClient, calls: Dict[str, int]):
+        first = await self.post(client, "key", path="/items/1/archive")
+        second = await self.post(client, "key", path="/items/1/archive")
+
+        assert calls["items"] == 1
+        assert second.json() == first.json()
+        assert second.headers["idempotent-replayed"] == "true"
+
+    async def test_prefix_matches_whole_segments(self, client: AsyncClient, calls: Dict[str, int]):
+        await self.post(client, "key", path="/itemsets")
+        second = await self.post(client, "key", path="/itemsets")
+
+        assert calls["items"] == 2
+        assert "idempotent-replayed" not in second.headers
+
+    async def test_without_key(self, client: AsyncClient, calls: Dict[str, int]):
+        await client.post("/items", json={"body": "Test"})
+        await client.post("/items", json={"body": "Test"})
+
+        assert calls["items"] == 2
+
+    async def test_different_keys(self, client: AsyncClient, calls: Dict[str, int]):
+        await self.post(client, "first")
+        await self.post(client, "second")
+
+        assert calls["items"] == 2
+
+    async def test_key_scoped_to_caller(self, client: AsyncClient, calls: Dict[str, int]):
+        await client.post("/items", json={"body": "Test"}, headers={"Idempotency-Key": "key", "Authorization": "Bearer first"})
+        await client.post("/items", json={"body": "Test"}, headers={"Idempotency-Key": "key", "Authorization": "Bearer second"})
+
+        assert calls["items"] == 2
+
+    async def test_different_body(self, client: AsyncClient, calls: Dict[str, int]):
+        await self.post(client, "key")
+        response = await self.post(client, "key", body="Other")
+
+        assert response.status_code == 422
+        assert calls["items"] == 1
+
+    async def test_invalid_key(self, client: AsyncClient):
+        response = await self.post(client, "k" * 256)
+
+        assert response.status_code == 400
+
+    async def test_server_errors_are_not_stored(self, client: AsyncClient, calls: Dict[str, int]):
+        await self.post(client, "key", path="/fail")
+        response = await self.post(client, "key", path="/fail")
+
+        assert response.status_code == 503
+        assert calls["fail"] == 2
+
+    async def test_concurrent_duplicates_wait(self, client: AsyncClient, calls: Dict[str, int], release: asyncio.Event):
+        release.clear()
+        first = asyncio.create_task(self.post(client, "key"))
+        second = asyncio.create_task(self.post(client, "key"))
+        for _ in range(10):
+            await asyncio.sleep(0)
+
+        release.set()
+        first, second = await first, await second
+
+        assert calls["items"] == 1
+        assert first.json() == second.json()
+
+    async def test_in_flight_wait_timeout(self, store: MemoryIdempotencyStore, calls: Dict[str, int]):
+        release = asyncio.Event()
+        transport = ASGITransport(app=create_app(store, calls, release, wait_timeout=0.01))
+        async with AsyncClient(transport=transport, base_url="http://test") as client:
+            first = asyncio.create_task(self.post(client, "key"))
+            await asyncio.sleep(0)
+            response = await self.post(client, "key")
+            release.set()
+            await first
+
+        assert response.status_code == 409
+        assert calls["items"] == 1
@@ -0,0 +1,50 @@
+import logging
+import pytest
+from storeapi.logging_conf import EmailObfuscationFilter, obfuscated
+
+@pytest.mark.anyio
+class TestLoggingConf:
+
+    def make_record(self, **extra) -> logging.LogRecord:
+        record = logging.LogRecord("storeapi", logging.INFO, __file__, 1, "message", None, None)
+        record.__dict__.update(extra)
+        return record
+
+    @pytest.mark.parametrize(
+            "email, obfuscated_length, expected",
+            [
+                ("wesley@example.net", 2, "we****@example.net"),
+                ("wesley@example.net", 0, "******@example.net"),
+                ("ab@example.net", 4, "ab@example.net"),
+                ("a@b@example.net", 1, "a**@example.net"),
+                ("not an email", 3, "not*********"),
+                ("", 2, ""),
+            ]
+    )
+    def test_obfuscated(self, email: str, obfuscated_length: int, expected: str):
+        assert obfuscated(email, obfuscated_length) == expected
+
+    def test_filter_obfuscates_email(self):
+        record = self.make_record(email="wesley@example.net")
+
+        assert EmailObfuscationFilter(obfuscated_length=2).filter(record)
+        assert record.email == "we****@example.net"
+
+    def test_filter_obfuscates_once_per_record(self):
+        record = self.make_record(email="wesley@example.net")
+        EmailObfuscationFilter(obfuscated_length=2).filter(record)
+        EmailObfuscationFilter(obfuscated_length=0).filter(record)
+
+        assert record.email == "we****@example.net"
+
+    def test_filter_handles_non_string_email(self):
+        record = self.make_record(email=12345)
+
+        assert EmailObfuscationFilter(obfuscated_length=2).filter(record)
+        assert record.email == "12***"
+
+    def test_filter_without_email(self):
+        record = self.make_record()
+
+        assert EmailObfuscationFilter().filter(record)
+        assert "email" not in record.__dict__
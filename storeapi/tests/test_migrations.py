@@ -0,0 +1,62 @@
+import pathlib
+import pytest
+import sqlalchemy
+from storeapi.database import metadata
+from storeapi.migrations import migrate
+
+@pytest.mark.anyio
+class TestMigrations:
+
+    @pytest.fixture()
+    def engine(self, tmp_path: pathlib.Path) -> sqlalchemy.engine.Engine:
+        return sqlalchemy.create_engine(f"sqlite:///{tmp_path / 'migrations.db'}")
+
+    def test_migrate_creates_tables(self, engine: sqlalchemy.engine.Engine):
+        applied = migrate(engine)
+
+        assert set(sqlalchemy.inspect(engine).get_table_names()) == set(metadata.tables)
+        assert "create table posts" in applied
+        assert migrate(engine) == []
+
+    def test_migrate_adds_missing_columns_and_indexes(self, engine: sqlalchemy.engine.Engine):
+        with engine.begin() as connection:
+            connection.execute(sqlalchemy.text("CREATE TABLE users (id INTEGER PRIMARY KEY, email VARCHAR, password VARCHAR, confirmed BOOLEAN)"))
+            connection.execute(sqlalchemy.text("CREATE TABLE posts (id INTEGER PRIMARY KEY, body VARCHAR, user_id INTEGER NOT NULL, image_url VARCHAR)"))
+            connection.execute(sqlalchemy.text("INSERT INTO posts (body, user_id) VALUES ('Test Post', 1)"))
+
+        applied = migrate(engine)
+
+        assert "add column posts.like_count" in applied
+        assert "add column posts.trending_score" in applied
+        assert "create index ix_posts_like_count" in applied
+        with engine.connect() as connection:
+            assert connection.execute(sqlalchemy.text("SELECT like_count FROM posts")).scalar() == 0
+
+    def test_migrate_backfills_counts(self, engine: sqlalchemy.engine.Engine):
+        with engine.begin() as connection:
+            connection.execute(sqlalchemy.text("CREATE TABLE posts (id INTEGER PRIMARY KEY, body VARCHAR, user_id INTEGER NOT NULL, image_url VARCHAR)"))
+            connection.execute(sqlalchemy.text("CREATE TABLE comments (id INTEGER PRIMARY KEY, body VARCHAR, post_id INTEGER NOT NULL, user_id INTEGER NOT NULL)"))
+            connection.execute(sqlalchemy.text("INSERT INTO posts (body, user_id) VALUES ('Test Post', 1)"))
+            connection.execute(sqlalchemy.text("INSERT INTO comments (body, post_id, user_id) VALUES ('First', 1, 1), ('Second', 1, 1)"))
+
+        applied = migrate(engine)
+
+        assert "backfill posts.comment_count" in applied
+        assert "backfill posts.like_count" in applied
+        with engine.connect() as connection:
+            assert connection.execute(sqlalchemy.text("SELECT comment_count, like_count FROM posts")).one() == (2, 0)
+
+    def test_migrate_removes_duplicate_likes(self, engine: sqlalchemy.engine.Engine):
+        with engine.begin() as connection:
+            connection.execute(sqlalchemy.text("CREATE TABLE posts (id INTEGER PRIMARY KEY, body VARCHAR, user_id INTEGER NOT NULL, image_url VARCHAR, like_count INTEGER NOT NULL DEFAULT 0)"))
+            connection.execute(sqlalchemy.text("CREATE TABLE likes (id INTEGER PRIMARY KEY, post_id INTEGER NOT NULL, user_id INTEGER NOT NULL)"))
+            connection.execute(sqlalchemy.text("INSERT INTO posts (body, user_id, like_count) VALUES ('Test Post', 1, 3)"))
+            connection.execute(sqlalchemy.text("INSERT INTO likes (post_id, user_id) VALUES (1, 1), (1, 1), (1, 2)"))
+
+        applied = migrate(engine)
+
+        assert "prepare index ix_likes_post_id_user_id" in applied
+        assert "create index ix_likes_post_id_user_id" in applied
+        with engine.connect() as connection:
+            assert connection.execute(sqlalchemy.text("SELECT id, user_id FROM likes ORDER BY id")).all() == [(1, 1), (3, 2)]
+            assert connection.execute(sqlalchemy.text("SELECT like_count FROM posts")).scalar() == 2
@@ -0,0 +1,43 @@
+import asyncio
+import pytest
+from types import SimpleNamespace
+from storeapi.routers.post import PostSorting, select_sorted_post_likes
+from storeapi.querylimits import QueryTimeoutError, ResultTooLargeError, fetch_all_limited, fetch_page, is_query_canceled, statement_timeout
+
+@pytest.mark.anyio
+class TestQueryLimits:
+
+    def test_is_query_canceled(self):
+        assert is_query_canceled(SimpleNamespace(sqlstate="57014"))
+        assert is_query_canceled(SimpleNamespace(orig=SimpleNamespace(sqlstate="57014")))
+        assert not is_query_canceled(SimpleNamespace(sqlstate="23505"))
+        assert not is_query_canceled(ValueError())
+
+    async def test_statement_timeout(self):
+        with pytest.raises(QueryTimeoutError):
+            async with statement_timeout(0.01):
+                await asyncio.sleep(1)
+
+    async def test_statement_timeout_not_reached(self):
+        async with statement_timeout(1):
+            await asyncio.sleep(0)
+
+    async def test_fetch_all_limited(self, mocker):
+        fetch_all = mocker.patch("storeapi.querylimits.database.fetch_all", return_value=[{"id": 1}, {"id": 2}])
+
+        assert await fetch_all_limited(select_sorted_post_likes[PostSorting.new], 2, 1) == [{"id": 1}, {"id": 2}]
+        assert fetch_all.call_args.args[0].values == {"limit": 3}
+
+    async def test_fetch_all_limited_too_many_rows(self, mocker):
+        mocker.patch("storeapi.querylimits.database.fetch_all", return_value=[{"id": 1}, {"id": 2}])
+
+        with pytest.raises(ResultTooLargeError) as e:
+            await fetch_all_limited(select_sorted_post_likes[PostSorting.new], 1, 1)
+
+        assert e.value.max_rows == 1
+
+    async def test_fetch_page(self, mocker):
+        mocker.patch("storeapi.querylimits.database.fetch_all", return_value=[{"id": 1}, {"id": 2}])
+
+        assert await fetch_page(select_sorted_post_likes[PostSorting.new], 1, 1) == ([{"id": 1}], True)
+        assert await fetch_page(select_sorted_post_likes[PostSorting.new], 2, 1) == ([{"id": 1}, {"id": 2}], False)
@@ -0,0 +1,155 @@
+import pytest
+import sqlalchemy
+from typing import Dict
+from httpx import AsyncClient
+from storeapi import querystats
+from storeapi.config import ProdConfig
+from storeapi.database import CachedQuery, InstrumentedDatabase, database, post_table, user_table
+from storeapi.querystats import QueryStats, redact
+from storeapi.tests.fake_clock import FakeClock
+
+@pytest.mark.anyio
+class TestQueryStats:
+
+    @pytest.fixture()
+    def stats(self, clock: FakeClock) -> QueryStats:
+        return QueryStats(slow_threshold=1, plan_interval=60, max_shapes=10, clock=clock)
+
+    @pytest.fixture()
+    def instrumented(self, stats: QueryStats) -> InstrumentedDatabase:
+        return InstrumentedDatabase(database.backend, stats)
+
+    def test_redact(self):
+        params = {"id": 1, "limit": 10, "email": "test@example.net", "body": b"x", "image_url": None}
+
+        assert redact(params) == {"id": 1, "limit": 10, "email": "<str>", "body": "<bytes>", "image_url": None}
+
+    def test_same_shape_with_different_values(self, stats: QueryStats):
+        stats.record(post_table.select().where(post_table.c.id == 1), None, 0.1, 1)
+        stats.record(post_table.select().where(post_table.c.id == 2), None, 0.3, 0)
+
+        metrics = stats.metrics()
+        assert len(metrics) == 1
+        assert metrics[0]["sql"].endswith("WHERE posts.id = :id_1")
+        assert metrics[0]["calls"] == 2
+        assert metrics[0]["rows"] == 1
+        assert metrics[0]["total_ms"] == pytest.approx(400)
+        assert metrics[0]["max_ms"] == pytest.approx(300)
+
+    def test_cached_query_shape(self, stats: QueryStats):
+        query = CachedQuery(post_table.select().where(post_table.c.id == sqlalchemy.bindparam("post_id")))
+        stats.record(query.bind(post_id=1), None, 0.1, 1)
+        stats.record(query, None, 0.1, 1)
+
+        assert stats.metrics()[0]["calls"] == 2
+
+    def test_least_recent_shape_evicted(self, stats: QueryStats):
+        stats.max_shapes = 2
+        stats.record(post_table.select(), None, 0.1, 0)
+        stats.record(user_table.select(), None, 0.1, 0)
+        stats.record(post_table.select(), None, 0.1, 0)
+        stats.record(post_table.select().limit(1), None, 0.1, 0)
+
+        assert [metrics["sql"].split(" FROM ")[1] for metrics in stats.metrics()] == ["posts", "posts LIMIT :param_1"]
+
+    def test_sorted_by_total_time(self, stats: QueryStats):
+        stats.record(post_table.select(), None, 0.1, 0)
+        stats.record(user_table.select(), None, 0.2, 0)
+
+        assert stats.metrics()[0]["sql"].endswith("FROM users")
+
+    def test_slow_query(self, stats: QueryStats):
+        assert stats.record(post_table.select(), None, 0.5, 0) is None
+
+        slow = stats.record(post_table.select(), None, 1.5, 3)
+
+        assert slow.duration == 1.5
+        assert slow.rows == 3
+        assert stats.metrics()[0]["slow"] == 1
+
+    def test_failed_query(self, stats: QueryStats):
+        stats.record(post_table.select(), None, 0.1, None, failed=True)
+
+        assert stats.metrics()[0]["errors"] == 1
+
+    async def test_instrumented_queries(self, instrumented: InstrumentedDatabase, stats: QueryStats, registered_user: Dict):
+        await instrumented.fetch_all(user_table.select())
+        await instrumented.fetch_one(user_table.select().where(user_table.c.id == registered_user["id"]))
+        await instrumented.execute(user_table.update().where(user_table.c.id == registered_user["id"]).values(confirmed=True))
+        rows = [row async for row in instrumented.iterate(user_table.select())]
+
+        metrics = {metrics["sql"]: metrics for metrics in stats.metrics()}
+        assert len(metrics) == 3
+        assert metrics["SELECT users.id, users.email, users.password, users.confirmed FROM users"]["calls"] == 2
+        assert metrics["SELECT users.id, users.email, users.password, users.confirmed FROM users"]["rows"] == 2 * len(rows)
+
+    async def test_failed_query_is_recorded(self, instrumented: InstrumentedDatabase, stats: QueryStats):
+        with pytest.raises(Exception):
+            await instrumented.fetch_all("SELECT * FROM missing_table")
+
+        assert stats.metrics()[0]["errors"] == 1
+
+    async def test_slow_query_logged_with_plan(self, instrumented: InstrumentedDatabase, stats: QueryStats, registered_user: Dict, caplog):
+        stats.slow_threshold = 0
+        query = user_table.select().where(user_table.c.email == registered_user["email"])
+
+        with caplog.at_level("WARNING"):
+            await instrumented.fetch_one(query)
+
+        record = next(record for record in caplog.records if record.name == "storeapi.querystats")
+        assert record.params == {"email_1": "<str>"}
+        assert record.rows == 1
+        assert "users" in record.plan
+        assert stats.metrics()[0]["plan"] == record.plan
+
+    async def test_plan_captured_once_per_interval(self, instrumented: InstrumentedDatabase, stats: QueryStats, clock: FakeClock, mocker):
+        stats.slow_threshold = 0
+        fetch_all = mocker.spy(instrumented.backend, "fetch_all")
+
+        await instrumented.fetch_all(post_table.select())
+        await instrumented.fetch_all(post_table.select())
+        clock.now = 60
+        await instrumented.fetch_all(post_table.select())
+
+        explains = [call for call in fetch_all.call_args_list if str(call.args[0]).startswith("EXPLAIN")]
+        assert len(explains) == 2
+
+    async def test_write_statements_not_explained_on_failure(self, instrumented: InstrumentedDatabase, stats: QueryStats, mocker):
+        stats.slow_threshold = 0
+        fetch_all = mocker.spy(instrumented.backend, "fetch_all")
+
+        with pytest.raises(Exception):
+            await instrumented.execute(post_table.insert().values(body="Test Post"))
+
+        assert fetch_all.call_count == 0
+        assert stats.metrics()[0]["errors"] == 1
+
+    def test_disabled_by_default_in_production(self):
+        assert ProdConfig().QUERY_STATS_ENABLED is False
+
+    def test_explain_prefix(self):
+        assert querystats.explain_prefix("postgresql://localhost/storeapi") == "EXPLAIN"
+        assert querystats.explain_prefix("sqlite:///test.db") == "EXPLAIN QUERY PLAN"
+        assert querystats.explain_prefix("mysql://localhost/storeapi") is None
+
+    async def test_metrics_endpoint(self, async_client: AsyncClient, confirmed_user: Dict, metrics_headers: Dict[str, str]):
+        await async_client.post("/token", json=confirmed_user)
+        response = await async_client.get("/metrics/queries", headers=metrics_headers)
+
+        assert response.status_code == 200
+        assert any(metrics["sql"].startswith("SELECT users.") for metrics in response.json())
+
+    async def test_metrics_endpoint_wrong_token(self, async_client: AsyncClient, metrics_headers: Dict[str, str]):
+        response = await async_client.get("/metrics/queries", headers={"Authorization": "Bearer wrong"})
+
+        assert response.status_code == 401
+
+    async def test_metrics_endpoint_missing_token(self, async_client: AsyncClient, metrics_headers: Dict[str, str]):
+        response = await async_client.get("/metrics/queries")
+
+        assert response.status_code == 401
+
+    async def test_metrics_endpoint_disabled_without_token(self, async_client: AsyncClient):
+        response = await async_client.get("/metrics/queries")
+
+        assert response.status_code == 404
@@ -0,0 +1,37 @@
+import pytest
+from storeapi.ranking import TRENDING_EPOCH, decayed_likes, trending_score
+
+HALF_LIFE = 60
+
+@pytest.mark.anyio
+class TestRanking:
+
+    def test_first_like(self):
+        assert trending_score(None, TRENDING_EPOCH + HALF_LIFE, HALF_LIFE) == 1
+
+    def test_likes_accumulate(self):
+        now = TRENDING_EPOCH + 10 * HALF_LIFE
+        score = trending_score(trending_score(None, now, HALF_LIFE), now, HALF_LIFE)
+
+        assert decayed_likes(score, now, HALF_LIFE) == pytest.approx(2)
+
+    def test_likes_decay(self):
+        liked_at = TRENDING_EPOCH + 10 * HALF_LIFE
+        score = trending_score(None, liked_at, HALF_LIFE)
+
+        assert decayed_likes(score, liked_at + HALF_LIFE, HALF_LIFE) == pytest.approx(0.5)
+        assert decayed_likes(None, liked_at, HALF_LIFE) == 0
+
+    def test_recent_like_outranks_old_likes(self):
+        old = TRENDING_EPOCH + 10 * HALF_LIFE
+        old_score = trending_score(trending_score(None, old, HALF_LIFE), old, HALF_LIFE)
+        recent_score = trending_score(None, old + 2 * HALF_LIFE, HALF_LIFE)
+
+        assert recent_score > old_score
+
+    def test_order_independent(self):
+        first, second = TRENDING_EPOCH + 5 * HALF_LIFE, TRENDING_EPOCH + 7 * HALF_LIFE
+
+        assert trending_score(trending_score(None, first, HALF_LIFE), second, HALF_LIFE) == pytest.approx(
+            trending_score(trending_score(None, second, HALF_LIFE), first, HALF_LIFE)
+        )
@@ -0,0 +1,84 @@
+import pytest
+from typing import Dict
+from httpx import AsyncClient
+from storeapi import ratelimit
+from storeapi.config import config
+from storeapi.ratelimit import MemoryRateLimitStore, RateLimit, parse_rate_limit
+from storeapi.tests.fake_clock import FakeClock
+
+@pytest.mark.anyio
+class TestRateLimit:
+
+    @pytest.fixture()
+    def store(self, clock: FakeClock) -> MemoryRateLimitStore:
+        return MemoryRateLimitStore(clock=clock, sweep_interval=10)
+
+    @pytest.fixture()
+    def enabled_rate_limit(self, mocker, clock: FakeClock):
+        # A fake clock, so slow requests on a busy machine don't refill the bucket
+        mocker.patch.object(config, "RATE_LIMIT_ENABLED", True)
+        mocker.patch.object(config, "RATE_LIMIT_TOKEN", "2/minute")
+        mocker.patch.object(ratelimit, "rate_limit_store", MemoryRateLimitStore(clock=clock))
+
+    @pytest.mark.parametrize(
+            "value, expected",
+            [
+                ("10/minute", RateLimit(10, 60)),
+                ("5/second", RateLimit(5, 1)),
+                ("3", RateLimit(3, 1)),
+                (None, None),
+                ("", None),
+            ]
+    )
+    def test_parse_rate_limit(self, value, expected):
+        assert parse_rate_limit(value) == expected
+
+    @pytest.mark.parametrize("value", ["10/fortnight", "ten/minute", "0/minute", "/minute"])
+    def test_parse_rate_limit_invalid(self, value):
+        with pytest.raises(ValueError, match=value):
+            parse_rate_limit(value)
+
+    async def test_hit_within_capacity(self, store: MemoryRateLimitStore):
+        limit = RateLimit(2, 60)
+
+        assert await store.hit("key", limit) == 0
+        assert await store.hit("key", limit) == 0
+        assert await store.hit("key", limit) == pytest.approx(30)
+
+    async def test_hit_refills_over_time(self, store: MemoryRateLimitStore, clock: FakeClock):
+        limit = RateLimit(1, 60)
+        await store.hit("key", limit)
+        clock.now = 60
+
+        assert await store.hit("key", limit) == 0
+
+    async def test_hit_keys_are_independent(self, store: MemoryRateLimitStore):
+        limit = RateLimit(1, 60)
+        await store.hit("first", limit)
+
+        assert await store.hit("second", limit) == 0
+
+    async def test_sweep_removes_full_buckets(self, store: MemoryRateLimitStore, clock: FakeClock):
+        limit = RateLimit(1, 5)
+        await store.hit("first", limit)
+        clock.now = 11
+        await store.hit("second", limit)
+
+        assert list(store.buckets) == ["second"]
+
+    async def test_login_rate_limited(self, async_client: AsyncClient, confirmed_user: Dict, enabled_rate_limit):
+        for _ in range(2):
+            response = await async_client.post("/token", json=confirmed_user)
+            assert response.status_code == 200
+
+        response = await async_client.post("/token", json=confirmed_user)
+
+        assert response.status_code == 429
+        assert response.headers["Retry-After"] == "30"
+
+    async def test_rate_limit_disabled(self, async_client: AsyncClient, confirmed_user: Dict, enabled_rate_limit, mocker):
+        mocker.patch.object(config, "RATE_LIMIT_ENABLED", False)
+
+        for _ in range(3):
+            response = await async_client.post("/token", json=confirmed_user)
+            assert response.status_code == 200
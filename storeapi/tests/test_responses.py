@@ -0,0 +1,28 @@
+import json
+import pytest
+from typing import Dict
+from databases import Database
+from storeapi.database import user_table
+from storeapi.models.user import User
+from storeapi.responses import RecordsJSONResponse
+
+@pytest.mark.anyio
+class TestResponses:
+
+    async def test_records_json_response(self, registered_user: Dict, db: Database):
+        records = await db.fetch_all(user_table.select())
+        response = RecordsJSONResponse(records, model=User)
+
+        assert response.media_type == "application/json"
+        assert json.loads(response.body) == [{"id": registered_user["id"], "email": registered_user["email"]}]
+
+    async def test_records_json_response_computed(self, registered_user: Dict, db: Database):
+        records = await db.fetch_all(user_table.select())
+        response = RecordsJSONResponse(records, model=User, computed={"email": lambda record: record.email.upper()})
+
+        assert json.loads(response.body) == [{"id": registered_user["id"], "email": registered_user["email"].upper()}]
+
+    def test_records_json_response_empty(self):
+        response = RecordsJSONResponse([], model=User)
+
+        assert response.body == b"[]"
@@ -2,7 +2,7 @@ import pytest
 from typing import Dict
 from jose import jwt
 from storeapi import security
-from storeapi.config import config
+from storeapi.config import config, rebuild_runtime_settings
 
 @pytest.mark.anyio
 class TestSecurity:
@@ -47,8 +47,8 @@ class TestSecurity:
 
         assert email == security.get_subject_for_token_type(token, "access")
 
-    def test_get_subject_for_token_type_expired(self, mocker):
-        mocker.patch("storeapi.security.access_token_expire_minutes", return_value=-1)
+    def test_get_subject_for_token_type_expired(self):
+        rebuild_runtime_settings(EXPIRATION=-1)
         email = "test@example.com"
         token = security.create_access_token(email)
 
@@ -0,0 +1,57 @@
+import pytest
+from storeapi import server
+from storeapi.config import TestConfig
+
+@pytest.mark.anyio
+class TestServer:
+
+    @pytest.fixture()
+    def settings(self) -> TestConfig:
+        return TestConfig(SERVER_WORKERS=None, DB_POOL_MAX_SIZE=3, DB_MAX_CONNECTIONS=None)
+
+    def test_worker_count_defaults_to_cpus(self, settings: TestConfig, mocker, monkeypatch):
+        monkeypatch.delenv("WEB_CONCURRENCY", raising=False)
+        mocker.patch("storeapi.server.available_cpus", return_value=6)
+
+        assert server.worker_count(settings) == 6
+
+    def test_worker_count_overrides(self, settings: TestConfig, monkeypatch):
+        monkeypatch.setenv("WEB_CONCURRENCY", "3")
+        assert server.worker_count(settings) == 3
+
+        settings.SERVER_WORKERS = 2
+        assert server.worker_count(settings) == 2
+        assert server.worker_count(settings, requested=4) == 4
+
+    def test_pool_max_size(self, settings: TestConfig):
+        assert server.pool_max_size(settings, workers=4) == 3
+
+        settings.DB_MAX_CONNECTIONS = 20
+        assert server.pool_max_size(settings, workers=4) == 5
+        assert server.pool_max_size(settings, workers=40) == settings.DB_POOL_MIN_SIZE
+
+    def test_worker_environment_uses_config_prefix(self, settings: TestConfig):
+        settings.DB_MAX_CONNECTIONS = 8
+
+        assert server.worker_environment(settings, workers=2) == {"TEST_DB_POOL_MAX_SIZE": "4"}
+
+    def test_uvicorn_options(self, settings: TestConfig, mocker):
+        mocker.patch("storeapi.server.available_cpus", return_value=2)
+        options = server.uvicorn_options(settings, server.parse_args(["--port", "9000"]))
+
+        assert options["port"] == 9000
+        assert options["host"] == settings.SERVER_HOST
+        assert options["lifespan"] == "on"
+        assert options["http"] == "httptools"
+        assert options["timeout_graceful_shutdown"] == settings.SERVER_GRACEFUL_TIMEOUT
+
+    def test_main_runs_uvicorn(self, mocker):
+        run = mocker.patch("storeapi.server.uvicorn.run")
+        mocker.patch.object(server.config, "DB_POOL_MAX_SIZE", 3)
+        mocker.patch.dict("os.environ")
+
+        server.main(["--workers", "2"])
+
+        run.assert_called_once()
+        assert run.call_args.args == ("storeapi.main:app",)
+        assert run.call_args.kwargs["workers"] == 2
@@ -0,0 +1,67 @@
+import pytest
+import sqlalchemy
+from typing import AsyncGenerator
+from storeapi.config import config
+from storeapi.database import CachedQuery, create_database, user_table
+from storeapi.sqlalchemy_database import SQLAlchemyDatabase, async_url
+
+@pytest.mark.anyio
+class TestSQLAlchemyDatabase:
+
+    @pytest.fixture()
+    async def sa_database(self) -> AsyncGenerator:
+        async with SQLAlchemyDatabase(config.DATABASE_URL, force_rollback=True) as database:
+            yield database
+
+    def test_async_url(self):
+        assert async_url("sqlite:///test.db", 100).drivername == "sqlite+aiosqlite"
+
+        url = async_url("postgresql://localhost/storeapi", 100)
+        assert url.drivername == "postgresql+asyncpg"
+        assert url.query["prepared_statement_cache_size"] == "100"
+
+    def test_create_database_backends(self):
+        assert isinstance(create_database("sqlalchemy"), SQLAlchemyDatabase)
+        with pytest.raises(ValueError):
+            create_database("unknown")
+
+    async def test_execute_and_fetch(self, sa_database: SQLAlchemyDatabase):
+        user_id = await sa_database.execute(user_table.insert().values(email="sa@example.net", password="1234"))
+        user = await sa_database.fetch_one(user_table.select().where(user_table.c.id == user_id))
+
+        assert user.email == "sa@example.net"
+        assert user["id"] == user_id
+        assert dict(user)["email"] == "sa@example.net"
+        assert user._mapping["password"] == "1234"
+        assert await sa_database.fetch_val(sqlalchemy.select(sqlalchemy.func.count()).select_from(user_table)) == 1
+
+    async def test_fetch_bound_query(self, sa_database: SQLAlchemyDatabase):
+        query = CachedQuery(user_table.select().where(user_table.c.email == sqlalchemy.bindparam("email")))
+        await sa_database.execute(user_table.insert().values(email="sa@example.net", password="1234"))
+
+        assert (await sa_database.fetch_one(query.bind(email="sa@example.net"))).email == "sa@example.net"
+        assert await sa_database.fetch_all(query.bind(email="missing@example.net")) == []
+
+    async def test_transaction_rolls_back(self, sa_database: SQLAlchemyDatabase):
+        with pytest.raises(RuntimeError):
+            async with sa_database.transaction():
+                await sa_database.execute(user_table.insert().values(email="sa@example.net", password="1234"))
+                raise RuntimeError()
+
+        assert await sa_database.fetch_all(user_table.select()) == []
+
+    async def test_iterate(self, sa_database: SQLAlchemyDatabase):
+        await sa_database.execute_many(user_table.insert(), [
+            {"email": "first@example.net", "password": "1234"},
+            {"email": "second@example.net", "password": "1234"}
+        ])
+
+        emails = [row.email async for row in sa_database.iterate(user_table.select().order_by(user_table.c.id))]
+        assert emails == ["first@example.net", "second@example.net"]
+
+    async def test_force_rollback_discards_changes(self):
+        async with SQLAlchemyDatabase(config.DATABASE_URL, force_rollback=True) as database:
+            await database.execute(user_table.insert().values(email="sa@example.net", password="1234"))
+
+        async with SQLAlchemyDatabase(config.DATABASE_URL, force_rollback=True) as database:
+            assert await database.fetch_all(user_table.select()) == []
@@ -2,7 +2,7 @@ import pytest
 import httpx
 from databases import Database
 from storeapi.database import post_table
-from storeapi.tasks import APIResponseError, send_simple_email, _generate_cute_creature_api
+from storeapi.tasks import APIResponseError, get_deepai_breaker, send_simple_email, _generate_cute_creature_api
 
 @pytest.mark.anyio
 class TestTasks:
@@ -37,6 +37,26 @@ class TestTasks:
         with pytest.raises(APIResponseError, match="API response parsing failed"):
             await _generate_cute_creature_api("A cat")
 
+    async def test_generate_cute_creature_api_circuit_open(self, mock_httpx_client):
+        get_deepai_breaker().open()
+
+        with pytest.raises(APIResponseError, match="is open"):
+            await _generate_cute_creature_api("A cat")
+
+        mock_httpx_client.post.assert_not_called()
+
+    async def test_generate_cute_creature_api_fake_deepai(self, fake_deepai):
+        result = await _generate_cute_creature_api("A cat")
+
+        assert fake_deepai.requests == [{"generator": "cute-creature-generator", "text": "A cat", "api-key": "test"}]
+        assert result["output_url"].endswith("/outputs/output.jpg")
+
+    async def test_generate_cute_creature_api_fake_deepai_error(self, fake_deepai):
+        fake_deepai.status_code = 503
+
+        with pytest.raises(APIResponseError, match="status code 503"):
+            await _generate_cute_creature_api("A cat")
+
     async def test_generate_and_add_to_post_success(self, mock_httpx_client, created_post: dict, confirmed_user: dict, db: Database):
         json_data = {"output_url": "https://example.com/image.jpg"}
 
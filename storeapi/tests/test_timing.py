@@ -0,0 +1,83 @@
+import asyncio
+import pytest
+from typing import Dict
+from fastapi import FastAPI
+from httpx import ASGITransport, AsyncClient
+from storeapi import timing
+from storeapi.circuitbreaker import CircuitBreaker
+from storeapi.database import database, user_table
+from storeapi.security import create_access_token, get_current_user
+from storeapi.timing import NO_SPAN, RequestTimings, ServerTimingMiddleware, request_timings, span
+
+def create_app() -> FastAPI:
+    app = FastAPI()
+    app.add_middleware(ServerTimingMiddleware)
+
+    @app.get("/")
+    async def root():
+        with span("auth"):
+            pass
+        for _ in range(2):
+            with span("db"):
+                pass
+        return {"message": "Hello, world!"}
+
+    return app
+
+@pytest.mark.anyio
+class TestTiming:
+
+    @pytest.fixture()
+    def timings(self) -> RequestTimings:
+        timings = RequestTimings()
+        token = request_timings.set(timings)
+        yield timings
+        request_timings.reset(token)
+
+    def test_span_outside_request(self):
+        assert span("db") is NO_SPAN
+
+    def test_server_timing(self, timings: RequestTimings):
+        timings.spans = [("db", 0.001), ("auth", 0.002), ("db", 0.003)]
+
+        assert timings.totals() == {"db": (pytest.approx(0.004), 2), "auth": (0.002, 1)}
+        assert timings.server_timing().startswith('db;dur=4.0;desc="2 calls", auth;dur=2.0, total;dur=')
+
+    async def test_middleware(self, mocker):
+        log = mocker.patch.object(timing.logger, "info")
+        async with AsyncClient(transport=ASGITransport(app=create_app()), base_url="http://test") as client:
+            response = await client.get("/")
+
+        metrics = [metric.split(";")[0] for metric in response.headers["server-timing"].split(", ")]
+        assert metrics == ["auth", "db", "total"]
+        extra = log.call_args.kwargs["extra"]
+        assert extra["status_code"] == 200
+        assert extra["spans"]["db"]["count"] == 2
+        assert request_timings.get() is None
+
+    async def test_database_spans(self, timings: RequestTimings, registered_user: Dict):
+        timings.spans.clear()
+        await database.fetch_one(user_table.select())
+        await database.fetch_all(user_table.select())
+
+        assert [name for name, _ in timings.spans] == ["db", "db"]
+
+    async def test_iterate_span_excludes_consumer(self, timings: RequestTimings, registered_user: Dict):
+        timings.spans.clear()
+        async for _ in database.iterate(user_table.select()):
+            await asyncio.sleep(0.2)
+
+        [(name, duration)] = timings.spans
+        assert name == "db" and duration < 0.2
+
+    async def test_auth_span(self, timings: RequestTimings, confirmed_user: Dict):
+        timings.spans.clear()
+        await get_current_user(create_access_token(confirmed_user["email"]))
+
+        assert [name for name, _ in timings.spans] == ["db", "auth"]
+
+    def test_circuit_breaker_span(self, timings: RequestTimings):
+        with CircuitBreaker("deepai").guard():
+            pass
+
+        assert [name for name, _ in timings.spans] == ["deepai"]
@@ -0,0 +1,50 @@
+import os
+import pathlib
+import sqlalchemy
+from typing import Optional
+from sqlalchemy.engine import make_url
+
+# pytest-xdist runs the suite in worker processes ("gw0", "gw1", ...). Each
+# worker gets its own database, so workers never wait on each other's locks
+# or see each other's rows. Without xdist the suite keeps using test.db.
+DEFAULT_URL = "sqlite:///test.db"
+
+def worker_database_url(url: str, worker: str) -> str:
+    parsed = make_url(url)
+    if parsed.get_backend_name() == "sqlite":
+        path = pathlib.Path(parsed.database)
+        return str(parsed.set(database=str(path.with_name(f"{path.stem}_{worker}{path.suffix}"))))
+
+    return str(parsed.set(database=f"{parsed.database}_{worker}"))
+
+def configure_worker_database() -> None:
+    # Must run before the config is first read. TEST_DATABASE_URL_BASE keeps
+    # the URL the developer asked for, if any.
+    if "TEST_DATABASE_URL_BASE" not in os.environ:
+        os.environ["TEST_DATABASE_URL_BASE"] = os.environ.get("TEST_DATABASE_URL", "")
+
+    worker = os.environ.get("PYTEST_XDIST_WORKER")
+    if worker:
+        os.environ["TEST_DATABASE_URL"] = worker_database_url(os.environ["TEST_DATABASE_URL_BASE"] or DEFAULT_URL, worker)
+
+def harness_sqlite_file(url: str) -> Optional[pathlib.Path]:
+    # The SQLite file the harness named and may delete, never one the
+    # developer passed in TEST_DATABASE_URL
+    if os.environ["TEST_DATABASE_URL_BASE"] or make_url(url).get_backend_name() != "sqlite":
+        return None
+
+    return pathlib.Path(make_url(url).database)
+
+def create_worker_database(url: str) -> None:
+    # A worker's PostgreSQL database is created through the one configured
+    base_url = os.environ["TEST_DATABASE_URL_BASE"]
+    if not base_url or url == base_url or make_url(url).get_backend_name() != "postgresql":
+        return
+
+    name = make_url(url).database
+    engine = sqlalchemy.create_engine(base_url, isolation_level="AUTOCOMMIT")
+    with engine.connect() as connection:
+        exists = connection.execute(sqlalchemy.text("SELECT 1 FROM pg_database WHERE datname = :name"), {"name": name}).scalar()
+        if not exists:
+            connection.execute(sqlalchemy.text(f'CREATE DATABASE "{name}"'))
+    engine.dispose()
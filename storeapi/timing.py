@@ -0,0 +1,107 @@
+import logging
+import time
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from typing import ContextManager, Dict, Iterator, List, Optional, Tuple
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+logger = logging.getLogger(__name__)
+
+NO_SPAN = nullcontext()
+
+class RequestTimings:
+    def __init__(self) -> None:
+        self.start = time.perf_counter()
+        self.spans: List[Tuple[str, float]] = []
+
+    @contextmanager
+    def span(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def record(self, name: str, duration: float) -> None:
+        self.spans.append((name, duration))
+
+    def totals(self) -> Dict[str, Tuple[float, int]]:
+        # name -> (total seconds, number of spans)
+        totals: Dict[str, Tuple[float, int]] = {}
+        for name, duration in self.spans:
+            total, count = totals.get(name, (0.0, 0))
+            totals[name] = (total + duration, count + 1)
+
+        return totals
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.start
+
+    def server_timing(self) -> str:
+        metrics = []
+        for name, (total, count) in self.totals().items():
+            metric = f"{name};dur={total * 1000:.1f}"
+            if count > 1:
+                metric += f';desc="{count} calls"'
+            metrics.append(metric)
+
+        metrics.append(f"total;dur={self.elapsed() * 1000:.1f}")
+        return ", ".join(metrics)
+
+request_timings: ContextVar[Optional[RequestTimings]] = ContextVar("request_timings", default=None)
+
+def span(name: str) -> ContextManager[None]:
+    # Outside an instrumented request this is a lookup and a shared no-op
+    timings = request_timings.get()
+    if timings is None:
+        return NO_SPAN
+
+    return timings.span(name)
+
+def record_span(name: str, duration: float) -> None:
+    # For time measured in pieces, such as the waits between streamed rows
+    timings = request_timings.get()
+    if timings is not None:
+        timings.record(name, duration)
+
+class ServerTimingMiddleware:
+    # Collects the spans recorded while handling a request. They are sent as a
+    # Server-Timing header and, once the request is done (background tasks
+    # included), logged as one line carrying the correlation id.
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings = RequestTimings()
+        token = request_timings.set(timings)
+        status = None
+
+        async def send_with_timing(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = MutableHeaders(scope=message)
+                headers.append("Server-Timing", timings.server_timing())
+
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            request_timings.reset(token)
+            elapsed = timings.elapsed()
+            logger.info(
+                f"{scope['method']} {scope['path']} {status} in {elapsed * 1000:.1f}ms",
+                extra={
+                    "method": scope["method"],
+                    "path": scope["path"],
+                    "status_code": status,
+                    "duration_ms": round(elapsed * 1000, 3),
+                    "spans": {name: {"duration_ms": round(total * 1000, 3), "count": count} for name, (total, count) in timings.totals().items()}
+                }
+            )